@@ -2,10 +2,26 @@
 A simplified key/value embedded-database.
 
 See the :class:`DataStore` class docstring for an example.
+
+:class:`ThreadSafeDataStore` can be shared between threads,
+:class:`SharedDataStore` (backed by a SQLite database file) can be shared
+between processes and :class:`BoundedDataStore` has a bounded capacity.
 """
+import array
+import bisect
 import collections
-import functools
+import contextlib
+import heapq
+import io
+import itertools
+import os
 import pickle
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
 
 #: No automatic export
 __all__ = []
@@ -81,6 +97,482 @@ class _DataStoreEntryKey:
             raise AttributeError('Attribute not found')
 
 
+#: The positions of the bits that are set, for any byte value
+_BYTE_BITS = tuple([tuple([b for b in range(8) if value & (1 << b)]) for value in range(256)])
+
+_NONZERO_BYTES_RE = re.compile(b'[^\x00]')
+
+
+def _bitmap_ids(bitmap):
+    """Iterate (in ascending order) over the ids that are set in a bytes-like **bitmap**."""
+    for match in _NONZERO_BYTES_RE.finditer(bitmap):
+        i = match.start()
+        for b in _BYTE_BITS[bitmap[i]]:
+            yield i * 8 + b
+
+
+def _int2bitmap(value):
+    """Convert a (Python's integer) bitmap into bytes."""
+    return value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+
+class _SparsePosting(array.array):
+    """A posting list (i.e. a set of integer ids) stored as a sorted array."""
+
+    __slots__ = ()
+
+    dense = False
+
+    def __new__(cls, ids=()):
+        return super().__new__(cls, 'q', ids)
+
+    def __reduce_ex__(self, protocol):
+        return self.__class__, (array.array('q', self), )
+
+    def __contains__(self, i):
+        j = bisect.bisect_left(self, i)
+        return j < len(self) and self[j] == i
+
+    def add(self, i):
+        if not self or i > self[-1]:
+            self.append(i)
+        elif i not in self:
+            bisect.insort(self, i)
+
+    def remove(self, i):
+        del self[bisect.bisect_left(self, i)]
+
+    def set_bits(self, bits):
+        """Set the bits corresponding to the present ids in the **bits** bytearray."""
+        for i in self:
+            bits[i >> 3] |= 1 << (i & 7)
+
+
+class _DensePosting:
+    """A posting list (i.e. a set of integer ids) stored as a bitmap."""
+
+    __slots__ = ('_bits', '_count', '_int')
+
+    dense = True
+
+    def __init__(self, ids=()):
+        self._bits = bytearray()
+        self._count = 0
+        self._int = None
+        if isinstance(ids, _SparsePosting):
+            if ids:
+                self._bits = bytearray((ids[-1] >> 3) + 1)
+                ids.set_bits(self._bits)
+                self._count = len(ids)
+        else:
+            for i in ids:
+                self.add(i)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, i):
+        j = i >> 3
+        return j < len(self._bits) and bool(self._bits[j] & (1 << (i & 7)))
+
+    def __iter__(self):
+        return _bitmap_ids(bytes(self._bits))
+
+    def __getstate__(self):
+        return self._bits, self._count
+
+    def __setstate__(self, state):
+        self._bits, self._count = state
+        self._int = None
+
+    def add(self, i):
+        j = i >> 3
+        if j >= len(self._bits):
+            self._bits.extend(bytes(j + 1 - len(self._bits)))
+        mask = 1 << (i & 7)
+        if not self._bits[j] & mask:
+            self._bits[j] |= mask
+            self._count += 1
+            self._int = None
+
+    def remove(self, i):
+        self._bits[i >> 3] &= ~ (1 << (i & 7))
+        self._count -= 1
+        self._int = None
+
+    def as_int(self):
+        """The bitmap as a Python's integer (cached until the next modification)."""
+        if self._int is None:
+            self._int = int.from_bytes(self._bits, 'little')
+        return self._int
+
+    @property
+    def nbits(self):
+        """The size of the bitmap (in bits)."""
+        return len(self._bits) * 8
+
+
+class DataStorePredicate:
+    """Abstract class for predicates on the *extras* values (see :meth:`DataStore.grep`)."""
+
+    def match(self, value):
+        """Check if **value** satisfies the predicate."""
+        raise NotImplementedError()
+
+    def select(self, sorted_values):
+        """Return the items of the **sorted_values** list that satisfy the predicate."""
+        return [v for v in sorted_values if self.match(v)]
+
+
+class DataStoreRange(DataStorePredicate):
+    """Match *extras* values that are in the [**start**, **end**] range.
+
+    If **start** (resp. **end**) is ``None``, the range is not bounded.
+    """
+
+    def __init__(self, start=None, end=None):
+        self._start = start
+        self._end = end
+
+    def match(self, value):
+        try:
+            return ((self._start is None or self._start <= value) and
+                    (self._end is None or value <= self._end))
+        except TypeError:
+            return False
+
+    def select(self, sorted_values):
+        lo = 0 if self._start is None else bisect.bisect_left(sorted_values, self._start)
+        hi = len(sorted_values) if self._end is None else bisect.bisect_right(sorted_values, self._end)
+        return sorted_values[lo:hi]
+
+    def __repr__(self):
+        return '{:s}({!r}, {!r})'.format(self.__class__.__name__, self._start, self._end)
+
+
+class DataStorePrefix(DataStorePredicate):
+    """Match *extras* values (strings) that start with **prefix**."""
+
+    def __init__(self, prefix):
+        self._prefix = prefix
+
+    def match(self, value):
+        return isinstance(value, type(self._prefix)) and value.startswith(self._prefix)
+
+    def select(self, sorted_values):
+        selection = list()
+        for v in itertools.islice(sorted_values, bisect.bisect_left(sorted_values, self._prefix), None):
+            if not self.match(v):
+                break
+            selection.append(v)
+        return selection
+
+    def __repr__(self):
+        return '{:s}({!r})'.format(self.__class__.__name__, self._prefix)
+
+
+class _DataStoreIndex:
+    """The index of a :class:`DataStore` object.
+
+    Each key is given an integer id (freed ids are recycled, smallest first).
+    For the *kind* and for each *extras* key/value pair, the set of matching
+    ids (i.e. a posting list) is stored either as a sorted array (sparse
+    postings) or as a bitmap (dense postings).
+
+    Since ids are usually given in ascending order, adding a key only appends
+    ids to sorted arrays: the density of the postings is only looked at when
+    they are searched (see :meth:`_posting`), when an id needs to be inserted
+    in the middle of a large sorted array, or when an id is removed from it.
+    """
+
+    #: A posting becomes dense when it references more than 1/_DENSITY of the ids
+    _DENSITY = 64
+    #: Dense postings are never created below this size
+    _DENSE_MIN = 64
+
+    def __init__(self):
+        self._key2id = dict()
+        self._id2key = list()
+        self._free_ids = list()
+        self._kinds = dict()
+        self._attrs = collections.defaultdict(dict)
+        self._sorted_values = dict()
+        self._generation = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_sorted_values']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sorted_values = dict()
+
+    @property
+    def generation(self):
+        """A counter that is incremented each time the index changes."""
+        return self._generation
+
+    def _posting(self, postings, value):
+        """Return the posting associated with **value** (``None`` if there is none).
+
+        The representation of the posting is chosen here (rather than each time
+        an id is added or removed) depending on its current density.
+        """
+        posting = postings.get(value)
+        if posting is not None:
+            size = len(posting)
+            if posting.dense:
+                if size * self._DENSITY * 4 < posting.nbits:
+                    posting = postings[value] = _SparsePosting(posting)
+            elif size >= self._DENSE_MIN and size * self._DENSITY >= len(self._id2key):
+                posting = postings[value] = _DensePosting(posting)
+        return posting
+
+    def _posting_insort(self, postings, value, i):
+        """Add **i** to a posting when it is not the largest id (the uncommon case)."""
+        posting = postings[value]
+        if not posting.dense and len(posting) >= max(self._DENSE_MIN, len(self._id2key) // self._DENSITY):
+            # Inserting into a large sorted array is costly
+            posting = postings[value] = _DensePosting(posting)
+        posting.add(i)
+
+    def add(self, key):
+        """Add a new **key** to the index."""
+        if key in self._key2id:
+            return
+        if self._free_ids:
+            i = heapq.heappop(self._free_ids)
+            self._id2key[i] = key
+        else:
+            i = len(self._id2key)
+            self._id2key.append(key)
+        self._key2id[key] = i
+        self._generation += 1
+        posting = self._kinds.get(key.kind)
+        if posting is None:
+            self._kinds[key.kind] = _SparsePosting((i, ))
+        elif not posting.dense and i > posting[-1]:
+            posting.append(i)
+        else:
+            self._posting_insort(self._kinds, key.kind, i)
+        for k, v in key:
+            values = self._attrs[k]
+            posting = values.get(v)
+            if posting is None:
+                values[v] = _SparsePosting((i, ))
+                self._sorted_values.pop(k, None)
+            elif not posting.dense and i > posting[-1]:
+                # The usual case: ids are given in ascending order
+                posting.append(i)
+            else:
+                self._posting_insort(values, v, i)
+
+    def _posting_remove(self, postings, value, i, dense_min):
+        """Remove **i** from a posting (returns ``False`` if the posting is deleted)."""
+        posting = postings[value]
+        if not posting.dense and len(posting) >= dense_min:
+            # Removing from a large sorted array is costly
+            posting = postings[value] = _DensePosting(posting)
+        posting.remove(i)
+        if not posting:
+            del postings[value]
+            return False
+        return True
+
+    def remove(self, key):
+        """Remove **key** from the index."""
+        i = self._key2id.pop(key)
+        self._id2key[i] = None
+        heapq.heappush(self._free_ids, i)
+        self._generation += 1
+        dense_min = max(self._DENSE_MIN, len(self._id2key) // self._DENSITY)
+        self._posting_remove(self._kinds, key.kind, i, dense_min)
+        for k, v in key:
+            values = self._attrs[k]
+            posting = values[v]
+            if not posting.dense and len(posting) < dense_min:
+                # The usual case: a small sparse posting
+                del posting[bisect.bisect_left(posting, i)]
+                if posting:
+                    continue
+                del values[v]
+                self._sorted_values.pop(k, None)
+            elif not self._posting_remove(values, v, i, dense_min):
+                self._sorted_values.pop(k, None)
+
+    def _select(self, attr, predicate):
+        """The values of the **attr** extra key that satisfy **predicate**."""
+        values = self._attrs.get(attr)
+        if not values:
+            return []
+        if attr not in self._sorted_values:
+            try:
+                self._sorted_values[attr] = sorted(values)
+            except TypeError:
+                # Heterogeneous values that can't be sorted
+                self._sorted_values[attr] = None
+        svalues = self._sorted_values[attr]
+        if svalues is not None:
+            try:
+                return predicate.select(svalues)
+            except TypeError:
+                pass
+        return [v for v in values if predicate.match(v)]
+
+    def _terms(self, kind, extras):
+        """Find the postings to look into: a list of lists of postings (the union of each sub-list is needed).
+
+        ``None`` is returned if the result will obviously be empty.
+        """
+        terms = [[self._posting(self._kinds, kind)]]
+        for k, v in extras.items():
+            values = self._attrs.get(k, {})
+            if isinstance(v, DataStorePredicate):
+                terms.append([self._posting(values, value) for value in self._select(k, v)])
+            else:
+                terms.append([self._posting(values, v)])
+        if any(not term or term[0] is None for term in terms):
+            return None
+        return terms
+
+    def _union_int(self, term):
+        """The union of several postings, as a Python's integer bitmap."""
+        bits = bytearray((len(self._id2key) + 7) // 8)
+        result = 0
+        for posting in term:
+            if posting.dense:
+                result |= posting.as_int()
+            else:
+                posting.set_bits(bits)
+        return result | int.from_bytes(bits, 'little')
+
+    def grep_keys(self, kind, extras):
+        """Iterate (in ids order) over the keys that match **kind** and **extras**."""
+        terms = self._terms(kind, extras)
+        if terms is None:
+            return
+        terms.sort(key=lambda t: sum([len(p) for p in t]))
+        first, others = terms[0], terms[1:]
+        if sum([len(p) for p in first]) * self._DENSITY < len(self._id2key):
+            # Few candidates: look for them in the other postings
+            candidates = sorted(set(itertools.chain(*first)))
+            checkers = list()
+            for term in others:
+                if len(term) == 1:
+                    checkers.append(term[0].__contains__)
+                else:
+                    bitmap = _int2bitmap(self._union_int(term))
+                    checkers.append(lambda i, b=bitmap: (i >> 3) < len(b) and (b[i >> 3] >> (i & 7)) & 1)
+            for i in candidates:
+                if all(checker(i) for checker in checkers):
+                    yield self._id2key[i]
+        else:
+            # Bitmaps intersection (smallest first)
+            result = first[0].as_int() if len(first) == 1 and first[0].dense else self._union_int(first)
+            for term in others:
+                result &= term[0].as_int() if len(term) == 1 and term[0].dense else self._union_int(term)
+                if not result:
+                    return
+            id2key = self._id2key
+            for i in _bitmap_ids(_int2bitmap(result)):
+                yield id2key[i]
+
+
+class _JournalPayload:
+    """A payload that still lies (pickled) in the journal file."""
+
+    __slots__ = ('offset', 'size')
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+
+    def __getstate__(self):
+        return self.offset, self.size
+
+    def __setstate__(self, state):
+        self.offset, self.size = state
+
+    def __repr__(self):
+        return '<{:s} | offset={:d} size={:d}>'.format(self.__class__.__name__, self.offset, self.size)
+
+
+class _DataStoreJournal:
+    """Describes the append-only journal file associated with a DataStore.
+
+    The journal file starts with a header record. It is followed by insertion
+    records (that are immediately followed by the pickled payload) and deletion
+    records. The ``.index`` companion file contains a snapshot of the DataStore's
+    index and keys (that matches the journal file's content up to a given offset).
+
+    Only one DataStore should write to a given journal file: if the journal file
+    is compacted (and therefore replaced) by someone else, the offsets of the lazy
+    payloads are meaningless. This is detected (using the token recorded in the
+    header) and a :class:`RuntimeError` is raised.
+    """
+
+    MAGIC = 'bronx.datagrip.datastore.journal'
+
+    VERSION = 1
+
+    def __init__(self, path, token, size, nrecords):
+        """
+        :param str path: Path to the journal file
+        :param str token: A unique identifier of the journal file
+        :param int size: The size of the (valid) journal file
+        :param int nrecords: The number of records in the journal file
+        """
+        self.path = path
+        self.token = token
+        self.size = size
+        self.nrecords = nrecords
+        self.dirty = set()
+
+    @staticmethod
+    def snapshot_path(path):
+        """The path to the index snapshot associated with the **path** journal file."""
+        return path + '.index'
+
+    def check(self, fh):
+        """Check that the **fh** file object is still the journal file described by this object."""
+        fh.seek(0)
+        try:
+            header = pickle.load(fh)
+        except Exception:
+            # Garbage may cause almost any exception
+            header = None
+        if not (isinstance(header, tuple) and len(header) == 3 and header[2] == self.token):
+            raise RuntimeError("The {:s} journal file was replaced (by another DataStore ?). "
+                               .format(self.path) + "Lazy payloads can no longer be read.")
+
+    @staticmethod
+    def valid_record(record):
+        """Check that **record** is a well-formed insertion or deletion record."""
+        if not (isinstance(record, tuple) and record):
+            return False
+        if record[0] == 'i':
+            return (len(record) == 4 and isinstance(record[1], _DataStoreEntryKey) and
+                    isinstance(record[3], int) and record[3] >= 0)
+        return record[0] == 'd' and len(record) == 2 and isinstance(record[1], _DataStoreEntryKey)
+
+    def read_raw(self, lazy, fh=None):
+        """Read the pickled data associated with the **lazy** payload placeholder.
+
+        If **fh** is provided, it must have been checked beforehand (see :meth:`check`).
+        """
+        if fh is None:
+            with open(self.path, 'rb') as fh:
+                self.check(fh)
+                return self.read_raw(lazy, fh)
+        fh.seek(lazy.offset)
+        return fh.read(lazy.size)
+
+    def read(self, lazy):
+        """Read and unpickle the payload associated with the **lazy** placeholder."""
+        return pickle.loads(self.read_raw(lazy))
+
+
 class DataStore:
     """An object that can store any pickable data. It acts like a small
     key/value database.
@@ -90,6 +582,9 @@ class DataStore:
       data more precisely.
     * Various methods are provided to access the entries.
     * Keys are indexed in order to perform fast searches (see the grep method).
+      Each key is given an integer id and, for a given *kind* or *extras*
+      key/value pair, the set of matching ids is stored either as a sorted
+      array or as a bitmap (depending on its density).
 
     Data should always be pickalable so that the DataStore could be dumped to
     disk using the :meth:`pickle_dump` method.
@@ -116,6 +611,11 @@ class DataStore:
             {<_DataStoreEntryKey object | kind='kind_of_data' key1='meaningful' key2='breathtaking'>: 'More date...',
              <_DataStoreEntryKey object | kind='kind_of_data' key1='meaningful'>: 'The data themselves...'}
 
+        Results can also be streamed and predicates may be used on *extras* values::
+
+            for key, data in ds.grep_iter('kind_of_data', dict(key1=DataStorePrefix('mean'))):
+                print(key, data)
+
         Finally the DataStore can be dumped/loaded to/from disk::
 
             ds.pickle_dump()
@@ -126,28 +626,44 @@ class DataStore:
 
     _PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
 
-    def __init__(self, default_picklefile='datastore.pickled'):
+    #: The journal is compacted when it contains more than _JOURNAL_COMPACTION_RATIO
+    #: records per entry (and at least _JOURNAL_COMPACTION_MIN records)
+    _JOURNAL_COMPACTION_RATIO = 2
+    _JOURNAL_COMPACTION_MIN = 1024
+
+    def __init__(self, default_picklefile='datastore.pickled',
+                 default_journalfile='datastore.journal'):
         """
         :param str default_picklefile: default name for the pickle dump file
+        :param str default_journalfile: default name for the journal file
         """
         self._pickle_dumpfile = default_picklefile
+        self._journal_dumpfile = default_journalfile
         self._reset_internal_state()
 
     def _reset_internal_state(self):
         self._store = dict()
         self._lock = dict()
-        self._index = collections.defaultdict(functools.partial(collections.defaultdict,
-                                                                set))
+        self._index = _DataStoreIndex()
+        self._journal = None
+
+    def _touch(self, key):
+        """Record that **key** changed since the last journal checkpoint."""
+        if self._journal is not None:
+            self._journal.dirty.add(key)
+
+    def _payload(self, key):
+        """Return the payload associated with **key** (lazy payloads are unpickled)."""
+        payload = self._store[key]
+        if type(payload) is _JournalPayload:
+            payload = self._store[key] = self._journal.read(payload)
+        return payload
 
     def _index_update(self, key):
-        self._index['kind'][key.kind].add(key)
-        for k, v in key:
-            self._index[k][v].add(key)
+        self._index.add(key)
 
     def _index_remove(self, key):
-        self._index['kind'][key.kind].remove(key)
-        for k, v in key:
-            self._index[k][v].remove(key)
+        self._index.remove(key)
 
     def _build_key(self, kind, extras):
         if not isinstance(extras, dict):
@@ -162,12 +678,15 @@ class DataStore:
         :param object payload: The data that will be stored
         :param bool readonly: Is the data readonly ?
         """
-        key = self._build_key(kind, extras)
+        return self._insert(self._build_key(kind, extras), payload, readonly)
+
+    def _insert(self, key, payload, readonly):
         if key in self._store and self._lock[key]:
             raise RuntimeError("This entry already exists and is read-only.")
         self._index_update(key)
         self._store[key] = payload
         self._lock[key] = readonly
+        self._touch(key)
         return payload
 
     def check(self, kind, extras):
@@ -191,16 +710,17 @@ class DataStore:
         :param object default_payload: Default data that may be stored and returned
         :param bool readonly: Is the default data readonly ?
         """
-        key = self._build_key(kind, extras)
+        return self._get(self._build_key(kind, extras), default_payload, readonly)
+
+    def _get(self, key, default_payload, readonly):
         try:
-            return self._store[key]
+            return self._payload(key)
         except KeyError:
             if default_payload is None:
                 raise KeyError("No corresponding entry was found in the DataStore for {!r}".
                                format(key))
             else:
-                self.insert(kind, extras, default_payload, readonly=readonly)
-                return self._store[key]
+                return self._insert(key, default_payload, readonly)
 
     def delete(self, kind, extras, force=False):
         """Delete data from the current DataStore.
@@ -208,11 +728,14 @@ class DataStore:
         :param object kind: The kind of the expected data
         :param dict extras: Any key/value pairs that describe the expected data
         """
-        key = self._build_key(kind, extras)
+        self._delete(self._build_key(kind, extras), force)
+
+    def _delete(self, key, force):
         if not self._lock[key] or force:
             self._index_remove(key)
             del self._store[key]
             del self._lock[key]
+            self._touch(key)
         else:
             raise RuntimeError("This entry already exists and is read-only.")
 
@@ -221,16 +744,46 @@ class DataStore:
 
         :note: When matching ``extras``, supernumerary attributes are ignored
             (e.g. ``extras=dict(a=1)`` will match ``dict(a=1, b=2)``)
+        :note: Instead of a plain value, a :class:`DataStorePredicate` object
+            (e.g. :class:`DataStoreRange` or :class:`DataStorePrefix`) may be
+            provided in ``extras``.
 
         :param object kind: The kind of the expected data
         :param dict extras: Any key/value pairs that describe the expected data
         """
+        return dict(self.grep_iter(kind, extras))
+
+    @staticmethod
+    def _key_matches(key, kind, extras):
+        """Check that **key** matches both ``kind`` and ``extras``."""
+        if key is None or key.kind != kind:
+            return False
+        kextras = key.extras
+        for k, v in extras.items():
+            if k not in kextras:
+                return False
+            if isinstance(v, DataStorePredicate):
+                if not v.match(kextras[k]):
+                    return False
+            elif kextras[k] != v:
+                return False
+        return True
+
+    def grep_iter(self, kind, extras):
+        """Iterate over the (key, data) pairs that match both ``kind`` and ``extras``.
+
+        Contrary to :meth:`grep`, the results are streamed (see :meth:`grep` for
+        a description of the arguments).
+        """
         if not isinstance(extras, dict):
             raise ValueError("The 'extras' needs to be dictionary of hashables.")
-        result = self._index['kind'][kind].copy()
-        for k, v in extras.items():
-            result &= self._index[k][v]
-        return {k: self._store[k] for k in result}
+        generation = self._index.generation
+        for key in self._index.grep_keys(kind, extras):
+            if generation != self._index.generation:
+                # The DataStore was modified in the meantime: double-check
+                if not self._key_matches(key, kind, extras):
+                    continue
+            yield key, self._payload(key)
 
     def grep_delete(self, kind, extras, force=False):
         """Search for items that matches both ``kind`` and ``extras`` and delete them.
@@ -245,12 +798,7 @@ class DataStore:
         """
         grep = self.grep(kind, extras)
         for k in grep.keys():
-            if not self._lock[k] or force:
-                self._index_remove(k)
-                del self._store[k]
-                del self._lock[k]
-            else:
-                raise RuntimeError("This entry already exists and is read-only.")
+            self._delete(k, force)
         return grep
 
     def pickle_dump(self, dumpfile=None):
@@ -261,7 +809,7 @@ class DataStore:
         """
         thefile = dumpfile or self._pickle_dumpfile
         with open(thefile, 'wb') as pfh:
-            pickle.dump((self._store, self._lock), pfh,
+            pickle.dump(({k: self._payload(k) for k in self._store}, self._lock), pfh,
                         protocol=self._PICKLE_PROTOCOL)
 
     def pickle_load(self, dumpfile=None):
@@ -277,7 +825,7 @@ class DataStore:
         # Build the new store dictionary
         newstore = dict()
         for k, v in unpickled[0].items():
-            if k in self._store and hasattr(self._store[k], 'datastore_inplace_overwrite'):
+            if k in self._store and hasattr(self._payload(k), 'datastore_inplace_overwrite'):
                 # In some particular cases, we want the an existing object to
                 # reset itself. I guess we could call that an inplace overwrite
                 self._store[k].datastore_inplace_overwrite(v)
@@ -291,13 +839,190 @@ class DataStore:
         for k in self._store.keys():
             self._index_update(k)
 
+    def journal_checkpoint(self, journalfile=None):
+        """Save the changes made to the current DataStore in an append-only journal file.
+
+        The first time (or if another journal file is requested), the whole
+        DataStore is written (see :meth:`journal_compact`). Subsequent calls
+        only append the insertions/deletions that occurred since the previous
+        checkpoint: their cost is proportional to the number of changes. The
+        journal is automatically compacted when it contains too many obsolete
+        records.
+
+        :note: In-place modifications of payloads are not tracked: modified
+            payloads need to be inserted again (alternatively,
+            :meth:`journal_compact` writes all the payloads).
+        :note: A given journal file must only be written by one DataStore (a
+            :class:`RuntimeError` is raised if another DataStore compacted it).
+
+        :param str journalfile: Path to the journal file (if `None`, the default
+            provided at the object creation time is used).
+        """
+        thefile = journalfile or self._journal_dumpfile
+        journal = self._journal
+        if (journal is None or os.path.abspath(journal.path) != os.path.abspath(thefile) or
+                (journal.nrecords + len(journal.dirty) >
+                 max(self._JOURNAL_COMPACTION_RATIO * len(self), self._JOURNAL_COMPACTION_MIN))):
+            self.journal_compact(thefile)
+            return
+        if not journal.dirty:
+            return
+        with open(journal.path, 'r+b') as jfh:
+            journal.check(jfh)
+            # Discard any incomplete record left by an interrupted checkpoint
+            jfh.seek(journal.size)
+            jfh.truncate()
+            for key in journal.dirty:
+                if key in self._store:
+                    raw = pickle.dumps(self._payload(key), protocol=self._PICKLE_PROTOCOL)
+                    pickle.dump(('i', key, self._lock[key], len(raw)), jfh,
+                                protocol=self._PICKLE_PROTOCOL)
+                    jfh.write(raw)
+                else:
+                    pickle.dump(('d', key), jfh, protocol=self._PICKLE_PROTOCOL)
+            journal.size = jfh.tell()
+        journal.nrecords += len(journal.dirty)
+        journal.dirty.clear()
+
+    def journal_compact(self, journalfile=None):
+        """Write the whole DataStore in a new journal file (and an index snapshot).
+
+        Payloads that were not unpickled yet are copied as is.
+
+        :param str journalfile: Path to the journal file (if `None`, the default
+            provided at the object creation time is used).
+        """
+        thefile = journalfile or self._journal_dumpfile
+        token = uuid.uuid4().hex
+        placeholders = dict()
+        old_fh = open(self._journal.path, 'rb') if self._journal is not None else None
+        try:
+            if old_fh is not None:
+                self._journal.check(old_fh)
+            with open(thefile + '.tmp', 'wb') as jfh:
+                pickle.dump((_DataStoreJournal.MAGIC, _DataStoreJournal.VERSION, token), jfh,
+                            protocol=self._PICKLE_PROTOCOL)
+                for key, payload in self._store.items():
+                    if type(payload) is _JournalPayload:
+                        raw = self._journal.read_raw(payload, old_fh)
+                    else:
+                        raw = pickle.dumps(payload, protocol=self._PICKLE_PROTOCOL)
+                    pickle.dump(('i', key, self._lock[key], len(raw)), jfh,
+                                protocol=self._PICKLE_PROTOCOL)
+                    placeholders[key] = _JournalPayload(jfh.tell(), len(raw))
+                    jfh.write(raw)
+                size = jfh.tell()
+        finally:
+            if old_fh is not None:
+                old_fh.close()
+        os.replace(thefile + '.tmp', thefile)
+        # Payloads that are still in the journal now lie in the new file
+        for key, payload in self._store.items():
+            if type(payload) is _JournalPayload:
+                self._store[key] = placeholders[key]
+        self._journal = _DataStoreJournal(thefile, token, size, len(placeholders))
+        # The index snapshot
+        snapshot = _DataStoreJournal.snapshot_path(thefile)
+        with open(snapshot + '.tmp', 'wb') as sfh:
+            pickle.dump(dict(token=token, size=size, nrecords=len(placeholders),
+                             store=placeholders, lock=self._lock, index=self._index), sfh,
+                        protocol=self._PICKLE_PROTOCOL)
+        os.replace(snapshot + '.tmp', snapshot)
+
+    def journal_load(self, journalfile=None):
+        """Read a journal file from disk and refill the current DataStore.
+
+        Payloads are only unpickled when they are accessed for the first time.
+        The index snapshot is used (if valid) so that only the records
+        appended since the last compaction need to be replayed.
+
+        :param str journalfile: Path to the journal file (if `None`, the default
+            provided at the object creation time is used).
+        """
+        thefile = journalfile or self._journal_dumpfile
+        try:
+            with open(_DataStoreJournal.snapshot_path(thefile), 'rb') as sfh:
+                snapshot = pickle.load(sfh)
+        except Exception:
+            # Missing or corrupted snapshot (garbage may cause almost any exception)
+            snapshot = None
+        if not (isinstance(snapshot, dict) and
+                {'token', 'size', 'nrecords', 'store', 'lock', 'index'} <= set(snapshot)):
+            snapshot = None
+        with open(thefile, 'rb') as jfh:
+            try:
+                header = pickle.load(jfh)
+            except Exception:
+                header = None
+            if (not isinstance(header, tuple) or len(header) != 3 or
+                    header[0] != _DataStoreJournal.MAGIC):
+                raise ValueError("{:s} is not a DataStore journal file.".format(thefile))
+            if header[1] != _DataStoreJournal.VERSION:
+                raise ValueError("Unsupported DataStore journal version: {!s}".format(header[1]))
+            if snapshot is not None and snapshot['token'] == header[2]:
+                newstore, newlock, newindex = snapshot['store'], snapshot['lock'], snapshot['index']
+                nrecords = snapshot['nrecords']
+                jfh.seek(snapshot['size'])
+            else:
+                newstore, newlock, newindex = dict(), dict(), None
+                nrecords = 0
+            jsize = os.fstat(jfh.fileno()).st_size
+            valid = jfh.tell()
+            # Replay the journal records
+            while True:
+                # A torn or corrupted record marks the end of the valid data (garbage
+                # may cause almost any exception or be unpickled as anything)
+                try:
+                    record = pickle.load(jfh)
+                except Exception:
+                    break
+                if not _DataStoreJournal.valid_record(record):
+                    break
+                if record[0] == 'i':
+                    _, key, readonly, rsize = record
+                    if jfh.tell() + rsize > jsize:
+                        break
+                    newstore[key] = _JournalPayload(jfh.tell(), rsize)
+                    newlock[key] = readonly
+                    if newindex is not None:
+                        newindex.add(key)
+                    jfh.seek(rsize, os.SEEK_CUR)
+                else:
+                    key = record[1]
+                    if key in newstore:
+                        del newstore[key]
+                        del newlock[key]
+                        if newindex is not None:
+                            newindex.remove(key)
+                nrecords += 1
+                valid = jfh.tell()
+        journal = _DataStoreJournal(thefile, header[2], valid, nrecords)
+        # Inplace overwrites (see pickle_load). Payloads that were never unpickled
+        # can't be referenced elsewhere: they are simply replaced.
+        for k in newstore.keys():
+            if (type(self._store.get(k, None)) not in (type(None), _JournalPayload) and
+                    hasattr(self._store[k], 'datastore_inplace_overwrite')):
+                self._store[k].datastore_inplace_overwrite(journal.read(newstore[k]))
+                newstore[k] = self._store[k]
+        # Update internals and rebuild the index (if needed)
+        self._reset_internal_state()
+        self._store = newstore
+        self._lock = newlock
+        if newindex is None:
+            for k in self._store.keys():
+                self._index_update(k)
+        else:
+            self._index = newindex
+        self._journal = journal
+
     def keys(self):
         """Return the list of available keys in this DataStore."""
         return self._store.keys()
 
     def __iter__(self):
         """Iterate over the DataStore's items."""
-        yield from self._store.items()
+        for k in self._store:
+            yield k, self._payload(k)
 
     def __len__(self):
         """The number of entries in the present DataStore."""
@@ -316,3 +1041,844 @@ class DataStore:
             outstr += '{:10s} key  : {!s}\n'.format('read-only' if self._lock[k] else 'read-write', k)
             outstr += '{:10s} value: {!r}\n'.format('', v)
         return outstr
+
+
+class ThreadSafeDataStore(DataStore):
+    """A :class:`DataStore` that can safely be shared between threads.
+
+    Each entry is protected by a lock (locks are striped across entries) and
+    a dedicated lock protects the index. Bulk operations (persistence,
+    :meth:`grep_delete`, ...) acquire all the locks.
+
+    :note: :meth:`grep_iter` works on a snapshot of the matching keys: entries
+        that are deleted in the meantime are skipped.
+    """
+
+    #: The number of entries' locks
+    _NSTRIPES = 64
+
+    def __init__(self, *kargs, **kwargs):
+        self._index_lock = threading.RLock()
+        self._stripes = tuple([threading.RLock() for _ in range(self._NSTRIPES)])
+        super().__init__(*kargs, **kwargs)
+
+    def _key_lock(self, key):
+        """The lock that protects **key**."""
+        return self._stripes[hash(key) % self._NSTRIPES]
+
+    @contextlib.contextmanager
+    def _all_locks(self):
+        """Acquire all the locks (in a consistent order)."""
+        with contextlib.ExitStack() as stack:
+            for lock in self._stripes:
+                stack.enter_context(lock)
+            stack.enter_context(self._index_lock)
+            yield
+
+    def _index_update(self, key):
+        with self._index_lock:
+            super()._index_update(key)
+
+    def _index_remove(self, key):
+        with self._index_lock:
+            super()._index_remove(key)
+
+    def _payload(self, key):
+        with self._key_lock(key):
+            return super()._payload(key)
+
+    def _insert(self, key, payload, readonly):
+        with self._key_lock(key):
+            return super()._insert(key, payload, readonly)
+
+    def _get(self, key, default_payload, readonly):
+        with self._key_lock(key):
+            return super()._get(key, default_payload, readonly)
+
+    def _delete(self, key, force):
+        with self._key_lock(key):
+            super()._delete(key, force)
+
+    def grep_iter(self, kind, extras):
+        if not isinstance(extras, dict):
+            raise ValueError("The 'extras' needs to be dictionary of hashables.")
+        with self._index_lock:
+            keys = list(self._index.grep_keys(kind, extras))
+        for key in keys:
+            try:
+                payload = self._payload(key)
+            except KeyError:
+                continue
+            yield key, payload
+
+    grep_iter.__doc__ = DataStore.grep_iter.__doc__
+
+    def grep_delete(self, kind, extras, force=False):
+        with self._all_locks():
+            return super().grep_delete(kind, extras, force=force)
+
+    grep_delete.__doc__ = DataStore.grep_delete.__doc__
+
+    def pickle_dump(self, dumpfile=None):
+        with self._all_locks():
+            super().pickle_dump(dumpfile)
+
+    pickle_dump.__doc__ = DataStore.pickle_dump.__doc__
+
+    def pickle_load(self, dumpfile=None):
+        with self._all_locks():
+            super().pickle_load(dumpfile)
+
+    pickle_load.__doc__ = DataStore.pickle_load.__doc__
+
+    def journal_checkpoint(self, journalfile=None):
+        with self._all_locks():
+            super().journal_checkpoint(journalfile)
+
+    journal_checkpoint.__doc__ = DataStore.journal_checkpoint.__doc__
+
+    def journal_compact(self, journalfile=None):
+        with self._all_locks():
+            super().journal_compact(journalfile)
+
+    journal_compact.__doc__ = DataStore.journal_compact.__doc__
+
+    def journal_load(self, journalfile=None):
+        with self._all_locks():
+            super().journal_load(journalfile)
+
+    journal_load.__doc__ = DataStore.journal_load.__doc__
+
+    def keys(self):
+        """Return the list of available keys in this DataStore."""
+        return list(self._store)
+
+    def __iter__(self):
+        """Iterate over the DataStore's items."""
+        for k in list(self._store):
+            try:
+                payload = self._payload(k)
+            except KeyError:
+                continue
+            yield k, payload
+
+    def __str__(self):
+        """A condensed string representation of the present DataStore."""
+        with self._all_locks():
+            return super().__str__()
+
+
+#: Objects that do not reference any other object
+_ATOMIC_TYPES = frozenset([int, float, complex, bool, str, bytes, type(None)])
+
+
+def _deep_sizeof(obj):
+    """Estimate the memory footprint of **obj** (recursively, like a deep ``sys.getsizeof``)."""
+    seen = set()
+    todo = [obj, ]
+    size = 0
+    while todo:
+        item = todo.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        nbytes = getattr(item, 'nbytes', None)
+        if isinstance(nbytes, int) and hasattr(item, 'dtype'):
+            # NumPy-like arrays (sys.getsizeof ignores the data of views)
+            size += max(sys.getsizeof(item), nbytes)
+            continue
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            todo.extend(item.keys())
+            todo.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            for subitem in item:
+                if type(subitem) in _ATOMIC_TYPES:
+                    size += sys.getsizeof(subitem)
+                else:
+                    todo.append(subitem)
+        elif hasattr(item, '__dict__'):
+            todo.append(item.__dict__)
+    return size
+
+
+class _LRUQueue:
+    """Entries ordered by last access (see :class:`BoundedDataStore`)."""
+
+    def __init__(self):
+        self._keys = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, tick):
+        self._keys[key] = tick
+
+    def touch(self, key, tick):
+        self._keys[key] = tick
+        self._keys.move_to_end(key)
+
+    def remove(self, key):
+        del self._keys[key]
+
+    def head(self):
+        """Return the (priority, key) pair of the entry that should be evicted first."""
+        for key, tick in self._keys.items():
+            return tick, key
+        return None
+
+
+class _LFUQueue:
+    """Entries ordered by access count (see :class:`BoundedDataStore`).
+
+    A heap is used (with lazy deletion of obsolete items).
+    """
+
+    def __init__(self):
+        self._freqs = dict()
+        self._heap = list()
+
+    def __len__(self):
+        return len(self._freqs)
+
+    def _push(self, key, freq):
+        self._freqs[key] = freq
+        if len(self._heap) > 2 * len(self._freqs) + 64:
+            self._heap = [f + (k, ) for k, f in self._freqs.items()]
+            heapq.heapify(self._heap)
+        else:
+            heapq.heappush(self._heap, freq + (key, ))
+
+    def add(self, key, tick):
+        self._push(key, (1, tick))
+
+    def touch(self, key, tick):
+        self._push(key, (self._freqs[key][0] + 1, tick))
+
+    def remove(self, key):
+        del self._freqs[key]
+
+    def head(self):
+        """Return the (priority, key) pair of the entry that should be evicted first."""
+        while self._heap:
+            count, tick, key = self._heap[0]
+            if self._freqs.get(key) == (count, tick):
+                return (count, tick), key
+            heapq.heappop(self._heap)
+        return None
+
+
+#: Statistics about a :class:`BoundedDataStore` object
+DataStoreStats = collections.namedtuple('DataStoreStats',
+                                        ('hits', 'misses', 'evictions', 'expirations', 'items', 'size'))
+
+
+class BoundedDataStore(DataStore):
+    """A :class:`DataStore` with a bounded capacity (that may be used as a cache).
+
+    When the DataStore gets full (see the **maxitems**, **maxsize** and
+    **quotas** arguments), entries are evicted according to the **policy**:
+
+    * ``lru``: the least recently used entries are evicted first;
+    * ``lfu``: the least frequently used entries are evicted first.
+
+    Read-write entries are always evicted first. Read-only entries are only
+    evicted if no read-write entry is left (and if **evict_readonly** is
+    ``True``). Additionally, if a **ttl** is specified, entries expire
+    **ttl** seconds after their insertion.
+
+    Only :meth:`get` calls are considered as accesses (for the policies and
+    the statistics).
+
+    :example: A cache for up to 100MB of data::
+
+            ds = BoundedDataStore(maxsize=100 * 1024 ** 2, policy='lru',
+                                  quotas=dict(config=10))
+            ds.get('field', dict(name='t2m'), default_payload=decoded_field,
+                   readonly=False)
+            print(ds.stats())
+
+    """
+
+    _POLICIES = dict(lru=_LRUQueue, lfu=_LFUQueue)
+
+    #: The clock used for the TTL
+    _clock = staticmethod(time.monotonic)
+
+    def __init__(self, default_picklefile='datastore.pickled',
+                 default_journalfile='datastore.journal',
+                 maxitems=None, maxsize=None, policy='lru', ttl=None, quotas=None,
+                 sizer=None, evict_readonly=True):
+        """
+        :param str default_picklefile: default name for the pickle dump file
+        :param str default_journalfile: default name for the journal file
+        :param int maxitems: the maximum number of entries (if `None`, unbounded)
+        :param int maxsize: the maximum total size of the payloads, as
+            estimated by **sizer** (if `None`, unbounded)
+        :param str policy: the eviction policy (``lru`` or ``lfu``)
+        :param float ttl: the lifetime of any entry in seconds (if `None`,
+            entries never expire)
+        :param dict quotas: the maximum number of entries for a given kind
+            (e.g. ``dict(config=10)``)
+        :param sizer: a function that estimates the size of a payload (by
+            default, a recursive version of :func:`sys.getsizeof` is used
+            but only if **maxsize** is specified. Otherwise, sizes are not
+            computed)
+        :param bool evict_readonly: if all the read-write entries are gone,
+            can read-only entries be evicted or expire ?
+        """
+        if policy not in self._POLICIES:
+            raise ValueError('Unknown eviction policy: {!s} (available: {:s})'
+                             .format(policy, ', '.join(sorted(self._POLICIES))))
+        for value in (maxitems, maxsize, ttl):
+            if value is not None and value < 0:
+                raise ValueError('maxitems, maxsize and ttl must be positive.')
+        self._maxitems = maxitems
+        self._maxsize = maxsize
+        self._policy = policy
+        self._ttl = ttl
+        self._quotas = dict(quotas or ())
+        if sizer is None and maxsize is not None:
+            sizer = _deep_sizeof
+        self._sizer = sizer
+        self._evict_readonly = evict_readonly
+        self.reset_stats()
+        super().__init__(default_picklefile=default_picklefile,
+                         default_journalfile=default_journalfile)
+
+    def _reset_internal_state(self):
+        super()._reset_internal_state()
+        self._bk_tick = itertools.count()
+        self._bk_queues = dict()
+        self._bk_entries = dict()
+        self._bk_kinds = collections.Counter()
+        self._bk_deadlines = collections.OrderedDict()
+        self._bk_size = 0
+
+    @property
+    def policy(self):
+        """The eviction policy."""
+        return self._policy
+
+    def reset_stats(self):
+        """Reset the hits/misses/evictions/expirations counters."""
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def stats(self):
+        """Return a :class:`DataStoreStats` named tuple."""
+        self._expire()
+        return DataStoreStats(self._hits, self._misses, self._evictions, self._expirations,
+                              len(self._store), self._bk_size)
+
+    def _bk_register(self, key, readonly, enqueue=True):
+        """Start tracking **key** (if **enqueue** is ``False``, it can't be evicted yet)."""
+        payload = self._store[key]
+        if self._sizer is None:
+            size = 0
+        elif type(payload) is _JournalPayload:
+            # Do not unpickle lazy payloads: the pickled size is a good estimate
+            size = payload.size
+        else:
+            size = self._sizer(payload)
+        self._bk_entries[key] = ((key.kind, readonly), size)
+        self._bk_kinds[key.kind] += 1
+        self._bk_size += size
+        if self._ttl is not None:
+            self._bk_deadlines[key] = self._clock() + self._ttl
+            self._bk_deadlines.move_to_end(key)
+        if enqueue:
+            self._bk_enqueue(key)
+
+    def _bk_enqueue(self, key):
+        """Make **key** a candidate for eviction."""
+        qid = self._bk_entries[key][0]
+        if qid not in self._bk_queues:
+            self._bk_queues[qid] = self._POLICIES[self._policy]()
+        self._bk_queues[qid].add(key, next(self._bk_tick))
+
+    def _bk_forget(self, key):
+        """Stop tracking **key**."""
+        qid, size = self._bk_entries.pop(key)
+        queue = self._bk_queues[qid]
+        queue.remove(key)
+        if not queue:
+            del self._bk_queues[qid]
+        self._bk_kinds[key.kind] -= 1
+        if not self._bk_kinds[key.kind]:
+            del self._bk_kinds[key.kind]
+        self._bk_size -= size
+        self._bk_deadlines.pop(key, None)
+
+    def _bk_rebuild(self):
+        """Track all the existing keys (and enforce the capacity limits)."""
+        for key in self._store:
+            self._bk_register(key, self._lock[key])
+        for kind in list(self._bk_kinds):
+            self._enforce(kind)
+
+    def _victim(self, kind=None):
+        """Find the next entry to evict (for a given **kind**)."""
+        for readonly in ((False, True) if self._evict_readonly else (False, )):
+            best = None
+            for (qkind, qreadonly), queue in self._bk_queues.items():
+                if qreadonly is not readonly or (kind is not None and qkind != kind):
+                    continue
+                head = queue.head()
+                if head is not None and (best is None or head[0] < best[0]):
+                    best = head
+            if best is not None:
+                return best[1]
+        return None
+
+    def _enforce(self, kind):
+        """Evict entries until the quota of **kind** and the global limits are satisfied."""
+        quota = self._quotas.get(kind)
+        while quota is not None and self._bk_kinds[kind] > quota:
+            victim = self._victim(kind)
+            if victim is None:
+                break
+            self._delete(victim, True)
+            self._evictions += 1
+        while ((self._maxitems is not None and len(self._store) > self._maxitems) or
+               (self._maxsize is not None and self._bk_size > self._maxsize)):
+            victim = self._victim()
+            if victim is None:
+                break
+            self._delete(victim, True)
+            self._evictions += 1
+
+    def _expire(self):
+        """Remove the expired entries."""
+        if not self._bk_deadlines:
+            return
+        now = self._clock()
+        expired = list()
+        for key, deadline in self._bk_deadlines.items():
+            if deadline > now:
+                break
+            expired.append(key)
+        for key in expired:
+            if self._evict_readonly or not self._lock[key]:
+                self._delete(key, True)
+                self._expirations += 1
+            else:
+                del self._bk_deadlines[key]
+
+    def _insert(self, key, payload, readonly):
+        self._expire()
+        previous = self._bk_entries.get(key)
+        payload = super()._insert(key, payload, readonly)
+        if previous is not None:
+            self._bk_forget(key)
+        # Make room for the new entry first (it can't be evicted)...
+        self._bk_register(key, readonly, enqueue=False)
+        self._enforce(key.kind)
+        # ...then, it might be too big by itself
+        self._bk_enqueue(key)
+        self._enforce(key.kind)
+        return payload
+
+    def _get(self, key, default_payload, readonly):
+        self._expire()
+        if key in self._store:
+            self._hits += 1
+            qid, _ = self._bk_entries[key]
+            self._bk_queues[qid].touch(key, next(self._bk_tick))
+        else:
+            self._misses += 1
+        return super()._get(key, default_payload, readonly)
+
+    def _delete(self, key, force):
+        super()._delete(key, force)
+        self._bk_forget(key)
+
+    def check(self, kind, extras):
+        self._expire()
+        return super().check(kind, extras)
+
+    check.__doc__ = DataStore.check.__doc__
+
+    def grep_iter(self, kind, extras):
+        self._expire()
+        yield from super().grep_iter(kind, extras)
+
+    grep_iter.__doc__ = DataStore.grep_iter.__doc__
+
+    def pickle_load(self, dumpfile=None):
+        super().pickle_load(dumpfile)
+        self._bk_rebuild()
+
+    pickle_load.__doc__ = DataStore.pickle_load.__doc__
+
+    def journal_load(self, journalfile=None):
+        super().journal_load(journalfile)
+        self._bk_rebuild()
+
+    journal_load.__doc__ = DataStore.journal_load.__doc__
+
+    def keys(self):
+        """Return the list of available keys in this DataStore."""
+        self._expire()
+        return super().keys()
+
+    def __iter__(self):
+        """Iterate over the DataStore's items."""
+        self._expire()
+        yield from super().__iter__()
+
+    def __len__(self):
+        """The number of entries in the present DataStore."""
+        self._expire()
+        return super().__len__()
+
+
+class _CanonicalFrozenset(frozenset):
+    """A frozenset that is always pickled with its items in the same order."""
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return frozenset, (sorted(self, key=_canonical_dumps), )
+
+
+def _canonical(obj):
+    """Replace the frozensets contained in **obj** (recursively through tuples)."""
+    if type(obj) is tuple:
+        return tuple([_canonical(item) for item in obj])
+    if type(obj) is frozenset:
+        return _CanonicalFrozenset([_canonical(item) for item in obj])
+    return obj
+
+
+def _canonical_dumps(obj, protocol=4):
+    """Pickle the **obj** key (or key component) in a canonical way.
+
+    The memo is disabled (otherwise the result would depend on object
+    identities) and the frozensets' items are sorted (their iteration order
+    depends on the hash seed and on the insertion order).
+    """
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=protocol)
+    pickler.fast = True
+    pickler.dump(_canonical(obj))
+    return buffer.getvalue()
+
+
+class SharedDataStore:
+    """A DataStore that lives in a SQLite database file.
+
+    It provides the same ``insert``/``check``/``get``/``delete``/``grep``
+    interface than :class:`DataStore` (including the read-only semantics).
+    Since all the data are stored in the database file, the same
+    SharedDataStore may be used concurrently by several threads or processes
+    (e.g. the object can be passed to the workers of a :mod:`multiprocessing`
+    pool).
+
+    :note: Keys and payloads are pickled. Consequently, the *extras* values
+        are compared using their pickled representation (e.g. ``1`` and
+        ``1.0`` are not considered equal). Keys are pickled in a canonical way
+        (object identities and the order of the frozensets' items do not
+        matter) but the content of arbitrary objects is not normalised.
+    :note: Unpickled payloads are cached (in each process): as long as an entry
+        is not modified, :meth:`get` returns the same object. However, in-place
+        modifications of a payload are never seen by other processes (the
+        entry needs to be inserted again).
+
+    :example: Let's share some data between processes::
+
+            ds = SharedDataStore('/path/to/datastore.db')
+            ds.insert('kind_of_data', dict(key1='meaningful'),
+                      'The data themselves...', readonly=True)
+            with multiprocessing.Pool(4) as pool:
+                pool.map(a_function_that_uses_ds, [ds, ] * 4)
+
+    """
+
+    _PICKLE_PROTOCOL = 4
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY,
+            key BLOB UNIQUE NOT NULL,
+            kind BLOB NOT NULL,
+            readonly INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            payload BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS entries_kind ON entries (kind);
+        CREATE TABLE IF NOT EXISTS extras (
+            entry INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            value BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS extras_name_value ON extras (name, value);
+        CREATE INDEX IF NOT EXISTS extras_entry ON extras (entry);
+    """
+
+    def __init__(self, dbfile='datastore.db', timeout=60.):
+        """
+        :param str dbfile: Path to the SQLite database file
+        :param float timeout: How long to wait for locks held by other
+            processes (in seconds)
+        """
+        self._dbfile = os.path.abspath(dbfile)
+        self._timeout = timeout
+        self._local = threading.local()
+        self._cache = dict()
+        self._connection()
+
+    def __getstate__(self):
+        return dict(dbfile=self._dbfile, timeout=self._timeout)
+
+    def __setstate__(self, state):
+        self.__init__(state['dbfile'], timeout=state['timeout'])
+
+    @property
+    def dbfile(self):
+        """The path to the SQLite database file."""
+        return self._dbfile
+
+    def _connection(self):
+        """The database connection of the current process and thread."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self._dbfile, timeout=self._timeout,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(self._SCHEMA)
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def close(self):
+        """Close the database connection of the current thread."""
+        if getattr(self._local, 'pid', None) == os.getpid():
+            self._local.connection.close()
+        self._local.pid = None
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+
+    def _dumps(self, obj):
+        return pickle.dumps(obj, protocol=self._PICKLE_PROTOCOL)
+
+    def _key_dumps(self, obj):
+        return _canonical_dumps(obj, protocol=self._PICKLE_PROTOCOL)
+
+    def _build_key(self, kind, extras):
+        """Return the key object and the key's (canonical) pickled representation."""
+        if not isinstance(extras, dict):
+            raise ValueError("The 'extras' needs to be dictionary of hashables.")
+        return (_DataStoreEntryKey(kind, **extras),
+                self._key_dumps((kind, tuple(sorted(extras.items())))))
+
+    @staticmethod
+    def _decode_key(blob):
+        kind, extras = pickle.loads(blob)
+        return _DataStoreEntryKey(kind, **dict(extras))
+
+    def _decode_payload(self, blob, version, payload):
+        """Unpickle **payload** (unless an up-to-date version is cached)."""
+        cached = self._cache.get(blob)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        payload = pickle.loads(payload)
+        self._cache[blob] = (version, payload)
+        return payload
+
+    def _insert(self, connection, key, blob, payload, readonly):
+        row = connection.execute('SELECT id, readonly FROM entries WHERE key = ?', (blob, )).fetchone()
+        version = int.from_bytes(os.urandom(7), 'little')
+        if row is not None:
+            if row[1]:
+                raise RuntimeError("This entry already exists and is read-only.")
+            connection.execute('UPDATE entries SET readonly = ?, version = ?, payload = ? WHERE id = ?',
+                               (readonly, version, self._dumps(payload), row[0]))
+        else:
+            cursor = connection.execute('INSERT INTO entries (key, kind, readonly, version, payload) ' +
+                                        'VALUES (?, ?, ?, ?, ?)',
+                                        (blob, self._key_dumps(key.kind), readonly, version,
+                                         self._dumps(payload)))
+            connection.executemany('INSERT INTO extras (entry, name, value) VALUES (?, ?, ?)',
+                                   [(cursor.lastrowid, k, self._key_dumps(v)) for k, v in key])
+        self._cache[blob] = (version, payload)
+        return payload
+
+    def insert(self, kind, extras, payload, readonly=True):
+        """Insert a new ``payload`` data in the current DataStore.
+
+        :param object kind: The kind of the ``payload`` data
+        :param dict extras: Any key/value pairs that describe the ``payload`` data
+        :param object payload: The data that will be stored
+        :param bool readonly: Is the data readonly ?
+        """
+        key, blob = self._build_key(kind, extras)
+        with self._transaction() as connection:
+            return self._insert(connection, key, blob, payload, readonly)
+
+    def check(self, kind, extras):
+        """Check if a data described by ``kind`` and ``extras`` exists in this DataStore.
+
+        :param object kind: The kind of the expected data
+        :param dict extras: Any key/value pairs that describe the expected data
+        """
+        _, blob = self._build_key(kind, extras)
+        return self._connection().execute('SELECT 1 FROM entries WHERE key = ?',
+                                          (blob, )).fetchone() is not None
+
+    def _get(self, connection, blob):
+        row = connection.execute('SELECT version FROM entries WHERE key = ?', (blob, )).fetchone()
+        if row is None:
+            return None
+        cached = self._cache.get(blob)
+        if cached is not None and cached[0] == row[0]:
+            return cached
+        row = connection.execute('SELECT version, payload FROM entries WHERE key = ?', (blob, )).fetchone()
+        if row is None:
+            return None
+        return (row[0], self._decode_payload(blob, row[0], row[1]))
+
+    def get(self, kind, extras, default_payload=None, readonly=True):
+        """Retrieve data from the current DataStore.
+
+        if the desired data is missing and ``default_payload`` is not `None`, a
+        new entry is added to the DataStore using the ``default_payload`` and
+        ``readonly`` arguments (atomically: if another process inserts the
+        same entry in the meantime, this entry is returned).
+
+        :param object kind: The kind of the expected data
+        :param dict extras: Any key/value pairs that describe the expected data
+        :param object default_payload: Default data that may be stored and returned
+        :param bool readonly: Is the default data readonly ?
+        """
+        key, blob = self._build_key(kind, extras)
+        found = self._get(self._connection(), blob)
+        if found is None:
+            if default_payload is None:
+                raise KeyError("No corresponding entry was found in the DataStore for {!r}".
+                               format(key))
+            with self._transaction() as connection:
+                found = self._get(connection, blob)
+                if found is None:
+                    return self._insert(connection, key, blob, default_payload, readonly)
+        return found[1]
+
+    def delete(self, kind, extras, force=False):
+        """Delete data from the current DataStore.
+
+        :param object kind: The kind of the expected data
+        :param dict extras: Any key/value pairs that describe the expected data
+        """
+        key, blob = self._build_key(kind, extras)
+        with self._transaction() as connection:
+            row = connection.execute('SELECT id, readonly FROM entries WHERE key = ?', (blob, )).fetchone()
+            if row is None:
+                raise KeyError("No corresponding entry was found in the DataStore for {!r}".
+                               format(key))
+            if row[1] and not force:
+                raise RuntimeError("This entry already exists and is read-only.")
+            self._delete_ids(connection, [row[0], ])
+        self._cache.pop(blob, None)
+
+    @staticmethod
+    def _delete_ids(connection, ids):
+        connection.executemany('DELETE FROM extras WHERE entry = ?', [(i, ) for i in ids])
+        connection.executemany('DELETE FROM entries WHERE id = ?', [(i, ) for i in ids])
+
+    def _grep_rows(self, connection, kind, extras):
+        """Find the rows that match ``kind`` and ``extras``.
+
+        Return a list of (id, key blob, readonly, version, payload blob, key) tuples.
+        """
+        if not isinstance(extras, dict):
+            raise ValueError("The 'extras' needs to be dictionary of hashables.")
+        query = ['SELECT id, key, readonly, version, payload FROM entries WHERE kind = ?', ]
+        args = [self._key_dumps(kind), ]
+        predicates = dict()
+        for k, v in extras.items():
+            if isinstance(v, DataStorePredicate):
+                query.append('id IN (SELECT entry FROM extras WHERE name = ?)')
+                args.append(k)
+                predicates[k] = v
+            else:
+                query.append('id IN (SELECT entry FROM extras WHERE name = ? AND value = ?)')
+                args.extend([k, self._key_dumps(v)])
+        rows = list()
+        for row in connection.execute(' AND '.join(query), args).fetchall():
+            key = self._decode_key(row[1])
+            if not predicates or DataStore._key_matches(key, kind, predicates):
+                rows.append(row + (key, ))
+        return rows
+
+    def grep_iter(self, kind, extras):
+        """Iterate over the (key, data) pairs that match both ``kind`` and ``extras``.
+
+        See :meth:`DataStore.grep` for a description of the arguments.
+        """
+        for _, blob, _, version, payload, key in self._grep_rows(self._connection(), kind, extras):
+            yield key, self._decode_payload(blob, version, payload)
+
+    def grep(self, kind, extras):
+        """Search for items that matches both ``kind`` and ``extras``.
+
+        See :meth:`DataStore.grep` for a description of the arguments.
+        """
+        return dict(self.grep_iter(kind, extras))
+
+    def grep_delete(self, kind, extras, force=False):
+        """Search for items that matches both ``kind`` and ``extras`` and delete them.
+
+        The dictionary of the removed key/data is returned. Nothing is deleted
+        if one of the matching entries is read-only (and ``force=False``).
+
+        See :meth:`DataStore.grep` for a description of the arguments.
+        """
+        with self._transaction() as connection:
+            rows = self._grep_rows(connection, kind, extras)
+            if not force and any(row[2] for row in rows):
+                raise RuntimeError("This entry already exists and is read-only.")
+            self._delete_ids(connection, [row[0] for row in rows])
+        grep = dict()
+        for _, blob, _, version, payload, key in rows:
+            grep[key] = self._decode_payload(blob, version, payload)
+            del self._cache[blob]
+        return grep
+
+    def keys(self):
+        """Return the list of available keys in this DataStore."""
+        return [self._decode_key(row[0])
+                for row in self._connection().execute('SELECT key FROM entries').fetchall()]
+
+    def __iter__(self):
+        """Iterate over the DataStore's items."""
+        rows = self._connection().execute('SELECT key, version, payload FROM entries').fetchall()
+        for blob, version, payload in rows:
+            yield self._decode_key(blob), self._decode_payload(blob, version, payload)
+
+    def __len__(self):
+        """The number of entries in the present DataStore."""
+        return self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __repr__(self):
+        """A condensed string representation of the present DataStore."""
+        return '<{:s} object at {!s} | {:s} | {:d} items>'.format(self.__class__.__name__,
+                                                                  hex(id(self)),
+                                                                  self._dbfile,
+                                                                  len(self))
+
+    def __str__(self):
+        """A condensed string representation of the present DataStore."""
+        outstr = ''
+        rows = self._connection().execute('SELECT key, readonly, version, payload FROM entries').fetchall()
+        for blob, readonly, version, payload in rows:
+            outstr += '{:10s} key  : {!s}\n'.format('read-only' if readonly else 'read-write',
+                                                    self._decode_key(blob))
+            outstr += '{:10s} value: {!r}\n'.format('', self._decode_payload(blob, version, payload))
+        return outstr
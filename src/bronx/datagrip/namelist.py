@@ -10,17 +10,32 @@ This module contains:
   (described by :class:`NamelistBlock` objects).
 * The :class:`NamelistParser` class that parse a string, a physical file or
   File-like object and look for namelist blocks. Upon success, it returns a
-  :class:`NamelistSet` object
+  :class:`NamelistSet` object (several strings or files may also be parsed
+  at once by a pool of processes).
+* The :class:`NamelistParserCache` class that can be plugged into a
+  :class:`NamelistParser` object in order to avoid parsing the same namelist
+  content again and again.
 
 Inital author: Joris Picot (2010-12-08 / CERFACS)
 """
 import collections
+import concurrent.futures
 import copy
+import hashlib
+import io
+import itertools
+import mmap
+import operator
+import os
+import pickle
 import re
+import tempfile
 from decimal import Decimal
 
+from bronx.stdtypes.tracking import RecursiveMappingTracker
 from bronx.syntax.decorators import secure_getattr
-from bronx.syntax.externalcode import ExternalCodeImportChecker
+from bronx.syntax.externalcode import ExternalCodeImportChecker, ExternalCodeUnavailableError
+from bronx.system.hash import HashAdapter
 
 # Numpy is not mandatory
 npchecker = ExternalCodeImportChecker('numpy')
@@ -129,6 +144,32 @@ FIRST_ORDER_SORTING = 1
 #: Sort only within indexes or attributes of the same key.
 SECOND_ORDER_SORTING = 2
 
+
+class NullValue:
+    """The class of the FORTRAN null value (see :data:`NULL`).
+
+    A null value is obtained when parsing ``A=1,,3`` or ``A=2*`` in a namelist:
+    the corresponding items of the FORTRAN variable are left unchanged.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __repr__(self):
+        return 'NULL'
+
+    def __reduce__(self):
+        """For pickle and deepcopy: the singleton is preserved."""
+        return 'NULL'
+
+
+#: The FORTRAN null value
+NULL = NullValue()
+
 #: Recognised formats...
 _INT_TYPES = [int]
 _F16_TYPES = []
@@ -155,6 +196,54 @@ _C64_TYPES = tuple(_C64_TYPES)
 _C128_TYPES = tuple(_C128_TYPES)
 
 
+def _is_ndarray(value):
+    """Is ``value`` a NumPy array ?"""
+    return npchecker.is_available() and isinstance(value, np.ndarray)
+
+
+def _is_numeric_ndarray(value):
+    """Is ``value`` a NumPy array of numbers or booleans (that can't contain macros) ?"""
+    return _is_ndarray(value) and value.dtype.kind in 'biufc'
+
+
+def _values_equal(v1, v2):
+    """Compare two values of namelist variables (that may be NumPy arrays)."""
+    if _is_ndarray(v1) or _is_ndarray(v2):
+        return (_is_ndarray(v1) and _is_ndarray(v2) and
+                v1.dtype == v2.dtype and np.array_equal(v1, v2))
+    else:
+        return v1 == v2
+
+
+def _pool_equal(pool1, pool2):
+    """Compare two pools of namelist variables (that may contain NumPy arrays).
+
+    The types of the values are compared as well since ``1 == 1.0 == True``
+    whereas they are not written the same way in a namelist.
+    """
+    if list(pool1) == list(pool2):
+        # Fast path: the two pools refer to the very same values
+        values1, values2 = pool1.values(), pool2.values()
+        try:
+            if (list(map(len, values1)) == list(map(len, values2)) and
+                    all(map(operator.is_,
+                            itertools.chain.from_iterable(values1),
+                            itertools.chain.from_iterable(values2)))):
+                return True
+        except TypeError:
+            pass
+    elif pool1.keys() != pool2.keys():
+        return False
+    for k, v1 in pool1.items():
+        v2 = pool2[k]
+        if _is_ndarray(v1) or _is_ndarray(v2):
+            if not _values_equal(v1, v2):
+                return False
+        elif not (v1 == v2 and list(map(type, v1)) == list(map(type, v2))):
+            return False
+    return True
+
+
 class LiteralParser:
     """
     Object in charge of parsing literal fortran expressions that could be found
@@ -291,6 +380,20 @@ class LiteralParser:
         self.logical = re.compile(self._re_logical, self._re_flags)
         self.true = re.compile(self._re_true, self._re_flags)
         self.false = re.compile(self._re_false, self._re_flags)
+        # Comma-separated runs of literals (see the parse_*_array methods)
+        self.integer_array = re.compile(self._re_run(self._re_integer), self._re_flags)
+        self.real_array = re.compile(self._re_run(self._re_real), self._re_flags)
+        self.logical_array = re.compile(self._re_run(self._re_logical), self._re_flags)
+        self._kind_suffix = re.compile("_" + _KIND_PARAM, self._re_flags)
+
+    @staticmethod
+    def _re_run(re_string):
+        """Build a regex string for a comma-separated run of ``re_string`` literals."""
+        if re_string.startswith('^'):
+            re_string = re_string[1:]
+        if re_string.endswith('$'):
+            re_string = re_string[:-1]
+        return r'^\s*(?:{0:s})(?:\s*,\s*(?:{0:s}))*\s*$'.format(re_string)
 
     # Fast check
 
@@ -409,6 +512,75 @@ class LiteralParser:
         else:
             raise ValueError("Literal %s doesn't represent a FORTRAN literal" % string)
 
+    # Bulk parsing of homogeneous literals (NumPy is needed)
+
+    def _run_split(self, string):
+        """Split a comma-separated run of literals (and remove kind parameters)."""
+        return self._kind_suffix.sub('', string).split(',')
+
+    def _parse_integer_run(self, string):
+        """Convert an already checked run of FORTRAN integers."""
+        return np.array(self._run_split(string), dtype=np.int64)
+
+    def _parse_real_run(self, string):
+        """Convert an already checked run of FORTRAN reals."""
+        return np.array(self._run_split(string.replace('d', 'E').replace('D', 'E')),
+                        dtype=np.float64)
+
+    def _parse_logical_run(self, string):
+        """Convert an already checked run of FORTRAN logicals."""
+        return np.array([bool(self.true.match(item.strip())) for item in self._run_split(string)],
+                        dtype=bool)
+
+    @npchecker.disabled_if_unavailable
+    def parse_integer_array(self, string):
+        """
+        If the argument looks like a comma-separated run of FORTRAN integers,
+        returns the matching :class:`numpy.ndarray` (of ``int64`` values).
+        """
+        if self.integer_array.match(string):
+            return self._parse_integer_run(string)
+        raise ValueError("Literal %s doesn't represent a run of FORTRAN integers" % string)
+
+    @npchecker.disabled_if_unavailable
+    def parse_real_array(self, string):
+        """
+        If the argument looks like a comma-separated run of FORTRAN reals,
+        returns the matching :class:`numpy.ndarray` (of ``float64`` values).
+
+        :note: Unlike :meth:`parse_real`, the values are not converted into
+            :class:`decimal.Decimal` objects.
+        """
+        if self.real_array.match(string):
+            return self._parse_real_run(string)
+        raise ValueError("Literal %s doesn't represent a run of FORTRAN reals" % string)
+
+    @npchecker.disabled_if_unavailable
+    def parse_logical_array(self, string):
+        """
+        If the argument looks like a comma-separated run of FORTRAN logicals,
+        returns the matching :class:`numpy.ndarray` (of ``bool`` values).
+        """
+        if self.logical_array.match(string):
+            return self._parse_logical_run(string)
+        raise ValueError("Literal %s doesn't represent a run of FORTRAN logicals" % string)
+
+    @npchecker.disabled_if_unavailable
+    def parse_array(self, string):
+        """
+        Parse a comma-separated run of homogeneous FORTRAN literals and returns
+        the corresponding :class:`numpy.ndarray`. Resolution order is: integer,
+        real and logical.
+        """
+        if self.integer_array.match(string):
+            return self.parse_integer_array(string)
+        elif self.real_array.match(string):
+            return self.parse_real_array(string)
+        elif self.logical_array.match(string):
+            return self.parse_logical_array(string)
+        else:
+            raise ValueError("Literal %s doesn't represent a run of homogeneous FORTRAN literals" % string)
+
     # Python types envoding
 
     @staticmethod
@@ -462,9 +634,102 @@ class LiteralParser:
         else:
             return '.FALSE.'
 
+    #: Formats used by :meth:`encode_array` (depending on the real values' itemsize)
+    _ARRAY_REAL_FMTS = {2: '%.3G', 4: '%.7G', 8: '%.15G'}
+
+    @staticmethod
+    def _encode_real_nodot(real):
+        """Fix a formatted real value that lacks a decimal point (see :meth:`encode_real`)."""
+        if real in ('0', '-0'):
+            return '0.'
+        elif 'E' in real:
+            return real.replace('E', '.0E')
+        else:
+            return real + '.'
+
+    @classmethod
+    def _encode_real_run(cls, values, fmt):
+        """Returns the comma-separated string form of a list of real ``values``.
+
+        The output is identical to what :meth:`encode_real` would produce but
+        the formatting is carried out on the whole run of values at once.
+        """
+        if not values:
+            return ''
+        reals = (','.join([fmt] * len(values)) % tuple(values)).split(',')
+        return ','.join([real if '.' in real else cls._encode_real_nodot(real)
+                         for real in reals]).replace('E', 'D')
+
+    def _encode_array_items(self, values):
+        """Returns the list of string forms of the ``values`` :class:`numpy.ndarray` items."""
+        values = np.ravel(values, order='F')
+        kind = values.dtype.kind
+        if not values.size:
+            return []
+        elif kind == 'b':
+            return [self.encode_logical(True) if v else self.encode_logical(False)
+                    for v in values.tolist()]
+        elif kind in 'iu':
+            return list(map(str, values.tolist()))
+        elif kind == 'f' and values.dtype.itemsize in self._ARRAY_REAL_FMTS:
+            return self._encode_real_run(values.tolist(),
+                                         self._ARRAY_REAL_FMTS[values.dtype.itemsize]).split(',')
+        elif kind == 'c' and values.dtype.itemsize // 2 in self._ARRAY_REAL_FMTS:
+            fmt = self._ARRAY_REAL_FMTS[values.dtype.itemsize // 2]
+            reals = self._encode_real_run(values.real.tolist(), fmt).split(',')
+            imags = self._encode_real_run(values.imag.tolist(), fmt).split(',')
+            return ['({:s},{:s})'.format(r, i) for r, i in zip(reals, imags)]
+        else:
+            return [self.encode(v) for v in values]
+
+    def encode_array(self, values, compress=False):
+        """
+        Returns the comma-separated string form of the ``values``
+        :class:`numpy.ndarray` (multi-dimensional arrays are flattened using the
+        FORTRAN order).
+
+        The output is identical to what :meth:`encode` would produce on each of the
+        array's elements. However, integer, real, complex and logical arrays are
+        processed in bulk.
+
+        :param bool compress: Use the ``r*c`` notation for repeated values
+                              (see :meth:`join_repeated`)
+        """
+        items = self._encode_array_items(values)
+        return self.join_repeated(items) if compress else ','.join(items)
+
+    @staticmethod
+    def join_repeated(encoded):
+        """Join a list of encoded values using the FORTRAN ``r*c`` notation.
+
+        Successive identical values are replaced by ``r*c`` (where ``r`` is the
+        repeat count) whenever it makes the output shorter. Successive null values
+        (i.e. empty strings) are replaced by ``r*``.
+
+        >>> print(LiteralParser.join_repeated(['1', '1', '1.5', '1.5', '1.5', '', '', '', '', '2']))
+        1,1,3*1.5,4*,2
+        """
+        joined = list()
+        for item, group in itertools.groupby(encoded):
+            count = len(list(group))
+            if count > 1:
+                compressed = '{:d}*{:s}'.format(count, item)
+                if len(compressed) < count * (len(item) + 1) - 1:
+                    joined.append(compressed)
+                    continue
+            joined.extend([item, ] * count)
+        return ','.join(joined)
+
+    @staticmethod
+    def encode_null(value):
+        """Returns the string form of the FORTRAN null ``value`` (i.e. an empty string)."""
+        return ''
+
     def encode(self, value):
         """Returns the string form of the specified ``value`` according to its type."""
-        if isinstance(value, bool):
+        if value is NULL:
+            return self.encode_null(value)
+        elif isinstance(value, bool):
             return self.encode_logical(value)
         elif isinstance(value, _INT_TYPES):
             return self.encode_integer(value)
@@ -570,13 +835,20 @@ class NamelistBlock(collections.abc.MutableMapping):
         self.__dict__['_subs'] = dict()
         self.__dict__['_declared_subs'] = set()
         self.__dict__['_literal'] = None
+        self.__dict__['_dumps_version'] = 0
+        self.__dict__['_dumps_cache'] = None
 
     def __getstate__(self):
         """For deepcopy and pickle."""
         st = dict(self.__dict__)
         st['_literal'] = None  # It's recreated on the fly when needed...
+        st['_dumps_cache'] = None  # Same here
         return st
 
+    def _dumps_touch(self):
+        """Invalidate the cached result of the :meth:`dumps` method."""
+        self.__dict__['_dumps_version'] = self.__dict__.get('_dumps_version', 0) + 1
+
     def set_as_reference(self):
         self.__dict__['_ref_pool'] = copy.deepcopy(self._pool)
 
@@ -605,17 +877,21 @@ class NamelistBlock(collections.abc.MutableMapping):
         Insert or change a namelist block variable.
 
         :param str varname: the variable name
-        :param value: the variable value
+        :param value: the variable value (a :class:`numpy.ndarray` is stored as is,
+                      without boxing each of its elements)
         :param int index: if given, set the key to the given index in block.
         """
         varname = varname.upper()
-        if not isinstance(value, list):
+        if _is_ndarray(value) and value.ndim == 0:
+            value = [value[()], ]
+        elif not isinstance(value, list) and not _is_ndarray(value):
             value = [value, ]
         # Automatically add free macros to the macro list
-        for v in [self._RE_FREEMACRO.match(v) for v in value
-                  if isinstance(v, str)]:
-            if v and v.group('NAME') not in self.macros():
-                self.addmacro(v.group('NAME'))
+        if not _is_numeric_ndarray(value):
+            for v in [self._RE_FREEMACRO.match(v) for v in value
+                      if isinstance(v, str)]:
+                if v and v.group('NAME') not in self.macros():
+                    self.addmacro(v.group('NAME'))
         # Process the given value...
         self._pool[varname] = value
         if varname not in self._keys:
@@ -627,6 +903,7 @@ class NamelistBlock(collections.abc.MutableMapping):
             self._keys.remove(varname)
             self._keys.insert(index, varname)
         self._dels.discard(varname)
+        self._dumps_touch()
 
     def __setitem__(self, varname, value):
         """Insert or change a namelist block variable."""
@@ -640,7 +917,9 @@ class NamelistBlock(collections.abc.MutableMapping):
         """Get ``varname`` variable's value (this is not case sensitive)."""
         varname = varname.upper()
         if varname in self._pool:
-            if len(self._pool[varname]) == 1:
+            if _is_ndarray(self._pool[varname]):
+                return self._pool[varname]
+            elif len(self._pool[varname]) == 1:
                 return self._pool[varname][0]
             else:
                 return self._pool[varname]
@@ -662,6 +941,7 @@ class NamelistBlock(collections.abc.MutableMapping):
         if varname in self._pool:
             del self._pool[varname]
             self._keys.remove(varname)
+            self._dumps_touch()
 
     def __delitem__(self, varname):
         """Delete the specified ``varname`` variable from this block."""
@@ -730,6 +1010,7 @@ class NamelistBlock(collections.abc.MutableMapping):
         else:
             self.__dict__['_keys'] = list()
             self.__dict__['_pool'] = dict()
+            self._dumps_touch()
 
     def todelete(self, varname):
         """Register a key to be deleted."""
@@ -750,6 +1031,7 @@ class NamelistBlock(collections.abc.MutableMapping):
     def addmacro(self, macro, value=None):
         """Add a new macro to this definition block, and/or set a value."""
         self._subs[macro] = value
+        self._dumps_touch()
 
     def add_declaredmacro(self, macro, value=None):
         """
@@ -803,15 +1085,37 @@ class NamelistBlock(collections.abc.MutableMapping):
         else:
             return literal.encode(item)
 
-    def dumps_values(self, key, literal=None):
-        """Nice encoded values (incl. list of)."""
-        return ','.join([self.nice(value, literal) for value in self._pool[key]])
+    def dumps_values(self, key, literal=None, compress=False):
+        """Nice encoded values (incl. list of).
+
+        :param bool compress: Use the ``r*c`` notation for repeated values (macros
+                              are never compressed).
+        """
+        values = self._pool[key]
+        if literal is None:
+            if self._literal is None:
+                self.__dict__['_literal'] = LiteralParser()
+            literal = self._literal
+        if _is_numeric_ndarray(values):
+            return literal.encode_array(values, compress=compress)
+        if not compress:
+            return ','.join([self.nice(value, literal) for value in values])
+        chunks = list()
+        for is_macro, group in itertools.groupby(values,
+                                                 lambda v: self._xdetect_macroname(v) is not None):
+            if is_macro:
+                chunks.extend([self.nice(value, literal) for value in group])
+            else:
+                chunks.append(literal.join_repeated([literal.encode(value) for value in group]))
+        return ','.join(chunks)
 
     @property
     def dumps_needs_update(self):
-        identical = self._pool == self._ref_pool
+        identical = _pool_equal(self._pool, self._ref_pool)
         has_macros = False
         for v in self.values():
+            if _is_numeric_ndarray(v):
+                continue
             for item in v:
                 macroname = self._xdetect_macroname(item)
                 if macroname and self._subs.get(macroname, None) is not None:
@@ -819,15 +1123,57 @@ class NamelistBlock(collections.abc.MutableMapping):
                     break
         return not identical or has_macros
 
-    def dumps(self, literal=None, sorting=NO_SORTING):
+    def _dumps_cached(self, sorting, compress=False):
+        """Return the cached result of the :meth:`dumps` method (or ``None``).
+
+        Beside the modifications made through the :class:`NamelistBlock` methods,
+        the namelist variables values and macros are checked against the ones that
+        were used to generate the cached result (in case they were modified in place).
+        """
+        cache = self.__dict__.get('_dumps_cache', None)
+        if (cache is not None and
+                cache['version'] == self.__dict__.get('_dumps_version', 0) and
+                cache['sorting'] == sorting and
+                cache['compress'] == compress and
+                cache['name'] == self._name and
+                cache['keys'] == self._keys and
+                _pool_equal(cache['pool'], self._pool) and
+                cache['subs'] == self._subs):
+            return cache['text']
+        return None
+
+    def dumps(self, literal=None, sorting=NO_SORTING, compress=False):
         """
         Returns a string of the namelist block that will be readable by fortran parsers.
 
+        The result is cached: as long as the namelist block is not modified, the
+        text is not generated again (unless a specific **literal** is provided).
+
         :param sorting: Sorting option. One of :py:data:`NO_SORTING`,
                         :py:data:`FIRST_ORDER_SORTING` (sort based on variable names) or
                         :py:data:`SECOND_ORDER_SORTING` (sort only within indexes or attributes
                         of the same variable: usefull with arrays).
+        :param bool compress: Use the FORTRAN ``r*c`` notation for repeated values
+                              (e.g. ``A=1,1,1,1,`` is written ``A=4*1,``).
         """
+        if literal is not None:
+            return self._dumps_render(literal, sorting, compress)
+        namout = self._dumps_cached(sorting, compress)
+        if namout is None:
+            namout = self._dumps_render(literal, sorting, compress)
+            self.__dict__['_dumps_cache'] = dict(version=self.__dict__.get('_dumps_version', 0),
+                                                 sorting=sorting,
+                                                 compress=compress,
+                                                 name=self._name,
+                                                 keys=list(self._keys),
+                                                 pool={k: v.copy() if _is_ndarray(v) else list(v)
+                                                       for k, v in self._pool.items()},
+                                                 subs=dict(self._subs),
+                                                 text=namout)
+        return namout
+
+    def _dumps_render(self, literal, sorting, compress=False):
+        """Actually generate the text returned by :meth:`dumps`."""
         namout = " &{:s}\n".format(self.name)
         if literal is None:
             if self._literal is None:
@@ -872,7 +1218,7 @@ class NamelistBlock(collections.abc.MutableMapping):
         else:
             keylist = self._keys
         for key in keylist:
-            value_strings = self.dumps_values(key, literal=literal)
+            value_strings = self.dumps_values(key, literal=literal, compress=compress)
             namout += '   {:s}={:s},\n'.format(key, value_strings)
         return namout + " /\n"
 
@@ -890,6 +1236,7 @@ class NamelistBlock(collections.abc.MutableMapping):
         for skey in delta.macros():
             self._subs[skey] = delta._subs[skey]
             self._declared_subs.update(delta._declared_subs)
+        self._dumps_touch()
 
 
 class NamelistSet(collections.abc.MutableMapping):
@@ -1051,13 +1398,28 @@ class NamelistSet(collections.abc.MutableMapping):
         """
         Merge of the current namelist set with the set of namelist blocks
         provided.
+
+        **delta** may also be a :class:`NamelistDelta` object (as returned by
+        the :meth:`diff` method): the keys to be deleted of the updated namelist
+        blocks are then replaced by the ones of the delta's modified namelist set.
         """
+        delta_after = None
+        if isinstance(delta, NamelistDelta):
+            rmblocks = set(delta.deleted) | set(rmblocks or ())
+            delta_after = {bname: delta._after[bname] for bname in delta.updated}
+            delta = delta.as_namelistset()
         assert isinstance(delta, NamelistSet) or delta == dict()
         for namblock in delta.values():
             if namblock.name in self:
                 self[namblock.name].merge(namblock)
             else:
                 self.add(copy.deepcopy(namblock))
+        if delta_after is not None:
+            # Updated blocks end up with the same keys to be deleted as in the delta
+            for bname, after in delta_after.items():
+                if bname in self:
+                    self[bname].rmkeys().clear()
+                    self[bname].rmkeys().update(after.rmkeys())
         if rmblocks is not None:
             for item in [x for x in rmblocks if x in self]:
                 del self[item]
@@ -1075,23 +1437,56 @@ class NamelistSet(collections.abc.MutableMapping):
                                        for v in self.values()])
         return not identical
 
-    def dumps(self, sorting=NO_SORTING, block_sorting=True):
+    def dumps(self, sorting=NO_SORTING, block_sorting=True, compress=False):
         """
         Join the fortran's strings dumped by each namelist block.
 
+        Since each namelist block caches its own text, only the blocks that were
+        modified since the last call are actually re-generated.
+
         :param sorting: Sorting option. One of :py:data:`NO_SORTING`,
                         :py:data:`FIRST_ORDER_SORTING` (sort based on variable names) or
                         :py:data:`SECOND_ORDER_SORTING` (sort only within indexes or attributes
                         of the same variable: usefull with arrays).
         :param bool block_sorting: if True, namelist blocks are ordered based
                                    on their name.
+        :param bool compress: Use the FORTRAN ``r*c`` notation for repeated values.
         """
+        return ''.join([nblock.dumps(sorting=sorting, compress=compress)
+                        for nblock in self._dumps_blocks(block_sorting)])
+
+    def _dumps_blocks(self, block_sorting):
+        """Iterate over namelist blocks in the :meth:`dumps` order."""
         if block_sorting:
-            return ''.join([self[nblock_k].dumps(sorting=sorting)
-                            for nblock_k in sorted(self.keys())])
+            for nblock_k in sorted(self.keys()):
+                yield self[nblock_k]
         else:
-            return ''.join([nblock.dumps(sorting=sorting)
-                            for nblock in self.values()])
+            yield from self.values()
+
+    def dump(self, fh, sorting=NO_SORTING, block_sorting=True, compress=False):
+        """
+        Write the fortran's strings dumped by each namelist block into a File-like
+        object (the whole text of the namelist set is never built in memory).
+
+        :param fh: A File-like object opened in text mode
+        :param sorting: Sorting option (see :meth:`dumps`).
+        :param bool block_sorting: if True, namelist blocks are ordered based
+                                   on their name.
+        :param bool compress: Use the FORTRAN ``r*c`` notation for repeated values.
+        """
+        for nblock in self._dumps_blocks(block_sorting):
+            fh.write(nblock.dumps(sorting=sorting, compress=compress))
+
+    def diff(self, other):
+        """Compute the differences between the present namelist set and **other**.
+
+        Returns a :class:`NamelistDelta` object that describes the created,
+        deleted and updated namelist blocks (and variables). It can be applied
+        to a namelist set using the :meth:`merge` method.
+
+        :param NamelistSet other: The (possibly) modified namelist set
+        """
+        return NamelistDelta(self, other)
 
     def as_dict(self, deepcopy=False):
         """Return the actual namelist set as a dictionary."""
@@ -1108,6 +1503,288 @@ class NamelistSet(collections.abc.MutableMapping):
             return list(self.values())
 
 
+class _NamelistBlockDelta(RecursiveMappingTracker):
+    """The differences between the variables of two namelist blocks."""
+
+    @staticmethod
+    def _differ(item_before, item_after):
+        return not _values_equal(item_before, item_after)
+
+
+class NamelistDelta(RecursiveMappingTracker):
+    """The differences between two namelist sets (see :meth:`NamelistSet.diff`).
+
+    It is a :class:`~bronx.stdtypes.tracking.RecursiveMappingTracker` object
+    where the items are namelist blocks: for updated blocks, the
+    :data:`updated_data` mapping contains another tracker object that
+    describes the created, deleted and updated variables.
+
+    Namelist blocks are compared on the basis of their variables, macros and
+    keys to be deleted (see :meth:`NamelistBlock.todelete`): the pools of
+    variables are compared at once, the variables of a namelist block are
+    only inspected if the namelist block has changed.
+
+    :example: The differences between two namelist sets:
+
+        >>> np = NamelistParser()
+        >>> ref = np.parse('&NAM1 A=1, B=2 / &NAM2 C=1 / &NAM3 D=1 /')
+        >>> other = np.parse('&NAM1 A=1, B=3, E=2 / &NAM2 C=1 / &NAM4 F=1 /')
+        >>> delta = ref.diff(other)
+        >>> sorted(delta.deleted), sorted(delta.created), sorted(delta.updated)
+        (['NAM3'], ['NAM4'], ['NAM1'])
+        >>> delta.updated_data['NAM1'].differences()
+        + E: 2
+        ? B: before=2 after=3
+
+        It can be applied on any namelist set:
+
+        >>> ref.merge(delta)
+        >>> ref.diff(other).differences()
+        No differences
+
+    """
+
+    def __init__(self, before, after):
+        """
+        :param NamelistSet before: The reference namelist set
+        :param NamelistSet after: The (possibly) modified namelist set
+        """
+        super().__init__(before, after)
+        self._after = after
+
+    @staticmethod
+    def _differ(item_before, item_after):
+        return (item_before._subs != item_after._subs or
+                item_before.rmkeys() != item_after.rmkeys() or
+                not _pool_equal(item_before.pool(), item_after.pool()))
+
+    @staticmethod
+    def _mapping_tracker(before, after):
+        return _NamelistBlockDelta(before, after)
+
+    def as_namelistset(self):
+        """Return a :class:`NamelistSet` object that can be merged to apply the present delta.
+
+        :note: Deleted namelist blocks can not be represented in the
+               :class:`NamelistSet` object (see the **rmblocks** argument of the
+               :meth:`NamelistSet.merge` method).
+        """
+        blocks = [copy.deepcopy(nb) for nb in self.created_data.values()]
+        for bname, btracker in self.updated_data.items():
+            after = self._after[bname]
+            nb = NamelistBlock(bname)
+            for key in after.keys():
+                if key in btracker.created or key in btracker.updated:
+                    value = after.pool()[key]
+                    nb.setvar(key, value.copy() if _is_ndarray(value) else list(value))
+            for key in btracker.deleted | after.rmkeys():
+                nb.todelete(key)
+            for macro in after.macros():
+                nb.addmacro(macro, after._subs[macro])
+            nb.declaredmacros().update(after.declaredmacros())
+            blocks.append(nb)
+        return NamelistSet(blocks)
+
+
+class NamelistParserCache:
+    """
+    A cache for the :class:`NamelistSet` objects created by a
+    :class:`NamelistParser` object.
+
+    Entries are keyed by a hash of the namelist source code and by a hash
+    of the parser's configuration (declared macros, regular expressions, ...).
+    Serialised (pickled) :class:`NamelistSet` objects are kept in memory (up
+    to **maxsize** entries, the least recently used ones being discarded
+    first) and, optionally, on disk in the **cachedir** directory.
+
+    Each request to the cache returns a brand new :class:`NamelistSet` object:
+    modifying it does not alter the cache content.
+
+    :example: A cache object needs to be given to the parser:
+
+        >>> cache = NamelistParserCache(maxsize=16)
+        >>> np = NamelistParser(cache=cache)
+        >>> nset = np.parse('&NAM1 A=5.69, / &NAM2 B=1 /')
+        >>> nset['NAM1'].A = 1
+        >>> nset = np.parse('&NAM1 A=5.69, / &NAM2 B=1 /')
+        >>> print(nset['NAM1'].A)
+        5.69
+        >>> print(cache.hits, cache.misses)
+        1 1
+
+    """
+
+    _PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, maxsize=128, cachedir=None, algorithm='sha1'):
+        """
+        :param int maxsize: The maximum number of entries kept in memory
+                            (``None`` for an unbounded cache)
+        :param str cachedir: The path to a directory where entries are also
+                             saved (if omitted, nothing is written on disk)
+        :param str algorithm: The name of the hash algorithm used to compute
+                              cache keys (see :class:`bronx.system.hash.HashAdapter`)
+        """
+        self._maxsize = maxsize
+        self._cachedir = cachedir
+        self._hasher = HashAdapter(algorithm)
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    def __repr__(self):
+        """A condensed string representation of the present cache."""
+        return '<{:s} object at {!s} | {:d} items hits={:d} disk_hits={:d} misses={:d}>'.format(
+            self.__class__.__name__, hex(id(self)), len(self),
+            self.hits, self.disk_hits, self.misses)
+
+    def __len__(self):
+        """The number of entries kept in memory."""
+        return len(self._entries)
+
+    @property
+    def maxsize(self):
+        """The maximum number of entries kept in memory."""
+        return self._maxsize
+
+    @property
+    def cachedir(self):
+        """The path to the on-disk cache directory (or ``None``)."""
+        return self._cachedir
+
+    @property
+    def hits(self):
+        """The number of requests satisfied by the in-memory cache."""
+        return self._hits
+
+    @property
+    def disk_hits(self):
+        """The number of requests satisfied by the on-disk cache."""
+        return self._disk_hits
+
+    @property
+    def misses(self):
+        """The number of requests that led to an actual parsing."""
+        return self._misses
+
+    def stats(self):
+        """Return a dictionary of usage statistics."""
+        return dict(size=len(self), hits=self.hits, disk_hits=self.disk_hits,
+                    misses=self.misses)
+
+    def clear(self, disk=False):
+        """Empty the in-memory cache (and the on-disk one if **disk** is True)."""
+        self._entries.clear()
+        if disk and self._cachedir and os.path.isdir(self._cachedir):
+            for item in os.listdir(self._cachedir):
+                if item.endswith('.pickled'):
+                    os.remove(os.path.join(self._cachedir, item))
+
+    def key(self, parser, source):
+        """The cache key associated with a given **parser** and **source** string.
+
+        The **source** may also be a binary buffer (since the hash is computed on
+        the UTF-8 encoded text, the same key is obtained in both cases).
+        """
+        if isinstance(source, str):
+            source_hash = self._hasher.string2hash(source)
+        else:
+            source_hash = self._hasher.file2hash(source if hasattr(source, 'seek') else io.BytesIO(source))
+        return '{:s}_{:s}'.format(source_hash,
+                                  self._hasher.string2hash(parser._cache_signature()))
+
+    def _disk_path(self, key):
+        return os.path.join(self._cachedir, key + '.pickled')
+
+    def _disk_load(self, key):
+        """Look for **key** in the on-disk cache (returns ``None`` if not found)."""
+        try:
+            with open(self._disk_path(key), 'rb') as pfh:
+                return pfh.read()
+        except OSError:
+            return None
+
+    def _disk_save(self, key, blob):
+        """Atomically save **blob** in the on-disk cache."""
+        try:
+            os.makedirs(self._cachedir, exist_ok=True)
+            fd, tmpfile = tempfile.mkstemp(prefix=key, dir=self._cachedir)
+        except OSError:
+            # Writing on disk is a bonus: not being able to do so is not fatal
+            return
+        try:
+            with os.fdopen(fd, 'wb') as pfh:
+                pfh.write(blob)
+            os.replace(tmpfile, self._disk_path(key))
+        except BaseException as e:
+            # Do not leave partially written files behind
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+            if not isinstance(e, OSError):
+                raise
+
+    def _remember(self, key, blob):
+        """Add a new entry in the in-memory cache (and evict old ones)."""
+        self._entries[key] = blob
+        self._entries.move_to_end(key)
+        while self._maxsize is not None and len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def lookup(self, key):
+        """Look for **key** in the cache.
+
+        Return a new :class:`NamelistSet` object or ``None`` if **key** is not
+        in the cache.
+        """
+        blob = self._entries.get(key, None)
+        if blob is not None:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return pickle.loads(blob)
+        if self._cachedir:
+            blob = self._disk_load(key)
+            if blob is not None:
+                try:
+                    n_set = pickle.loads(blob)
+                except Exception:
+                    # Ignore corrupted cache files
+                    return None
+                self._disk_hits += 1
+                self._remember(key, blob)
+                return n_set
+        return None
+
+    def store(self, key, n_set):
+        """Store the **n_set** :class:`NamelistSet` object in the cache (as a miss)."""
+        self._misses += 1
+        blob = pickle.dumps(n_set, protocol=self._PICKLE_PROTOCOL)
+        self._remember(key, blob)
+        if self._cachedir:
+            self._disk_save(key, blob)
+
+    def parse(self, parser, source):
+        """Return the :class:`NamelistSet` object that results from the parsing of **source**.
+
+        :param NamelistParser parser: The parser used on cache misses.
+        :param source: The namelist source code (a string or a binary buffer).
+        """
+        key = self.key(parser, source)
+        n_set = self.lookup(key)
+        if n_set is None:
+            n_set = parser._namelist_parse(source)
+            self.store(key, n_set)
+        return n_set
+
+
+_DEFAULT_RE_BLOCK = r'&.*/'
+
+#: Binary buffers that can be processed by :meth:`NamelistParser.parse_buffer`
+_BINARY_BUFFERS = (bytes, bytearray, mmap.mmap)
+
+
 class NamelistParser:
     """
     Parser that creates a :class:`NamelistSet` object from a namelist file or
@@ -1143,20 +1820,41 @@ class NamelistParser:
 
     """
 
+    _LITERAL_TYPES = ('integer', 'boz', 'real', 'complex', 'character', 'logical')
+
+    _BYTES_ENCODING = 'utf-8'
+
     def __init__(self,
                  literal=LiteralParser(),
                  macros=None,
                  re_flags=None,
                  re_clean=r"^(\s+|![^\n]*\n)",
-                 re_block=r'&.*/',
+                 re_block=_DEFAULT_RE_BLOCK,
                  re_endblock=r"^/(end)?",
                  re_bname=_NAME,
                  re_entry=_LETTER + r'[ A-Z0-9_,\%\(\):]*' + r"(?=\s*=)",
                  re_macro=_MACRONAME,
                  re_freemacro=_FREEMACRONAME,
                  re_endol=r"(?=\s*(,|/|\n))",
-                 re_comma=r"\s*,"):
+                 re_comma=r"\s*,",
+                 cache=None,
+                 array_threshold=None):
+        """
+        :param LiteralParser literal: The literal parser used to process variable values
+        :param list[str] macros: The list of declared macro names
+        :param NamelistParserCache cache: A cache object that prevents the same
+                                          namelist content to be parsed twice
+        :param int array_threshold: If given (NumPy is needed), the values of a
+                                    namelist variable made of at least
+                                    **array_threshold** integers (or reals, or
+                                    logicals) are parsed at once into a
+                                    :class:`numpy.ndarray` object
+        """
         self._literal = literal
+        self._cache = cache
+        if array_threshold and not npchecker.is_available():
+            raise ExternalCodeUnavailableError('NumPy is needed when array_threshold is specified.')
+        self._array_threshold = array_threshold
         if macros:
             self._declaredmacros = set(macros)
         else:
@@ -1174,26 +1872,84 @@ class NamelistParser:
         self._re_freemacro = re_freemacro
         self._re_endol = re_endol
         self._re_comma = re_comma
+        self._bytes_mode = False
         self._recompile()
 
     def _recompile(self):
         """Recompile regexps according to internal characters strings by namelist entity."""
-        self.clean = re.compile(self._re_clean, self._re_flags)
-        self.block = re.compile(self._re_block, self._re_flags)
-        self.endblock = re.compile(self._re_endblock, self._re_flags)
-        self.bname = re.compile(self._re_bname, self._re_flags)
-        self.entry = re.compile(self._re_entry, self._re_flags)
-        self.macro_eol = re.compile(self._re_macro + self._re_endol, self._re_flags)
-        self.freemacro_eol = re.compile(self._re_freemacro + self._re_endol, self._re_flags)
-        self.comma = re.compile(self._re_comma, self._re_flags)
-        self.deladd = re.compile(r'\-+' + self._re_endol, self._re_flags)
+        self.clean = self._re_compile(self._re_clean)
+        self.block = self._re_compile(self._re_block)
+        self.endblock = self._re_compile(self._re_endblock)
+        self.bname = self._re_compile(self._re_bname)
+        self.entry = self._re_compile(self._re_entry)
+        self.macro_eol = self._re_compile(self._re_macro + self._re_endol)
+        self.freemacro_eol = self._re_compile(self._re_freemacro + self._re_endol)
+        self.comma = self._re_compile(self._re_comma)
+        self.deladd = self._re_compile(r'\-+' + self._re_endol)
         # Element matching, ...
-        self._SIGNED_INT_LCRE = re.compile(_SIGNED_INT_LITERAL_CONSTANT + self._re_endol, self._re_flags)
-        self._BOZ_LCRE = re.compile(_BOZ_LITERAL_CONSTANT + self._re_endol, self._re_flags)
-        self._SIGNED_REAL_LCRE = re.compile(_SIGNED_REAL_LITERAL_CONSTANT + self._re_endol, self._re_flags)
-        self._COMPLEX_LCRE = re.compile(_COMPLEX_LITERAL_CONSTANT + self._re_endol, self._re_flags)
-        self._CHAR_LCRE = re.compile(_CHAR_LITERAL_CONSTANT + self._re_endol, self._re_flags)
-        self._LOGICAL_LCRE = re.compile(_LOGICAL_LITERAL_CONSTANT + self._re_endol, self._re_flags)
+        self._SIGNED_INT_LCRE = self._re_compile(_SIGNED_INT_LITERAL_CONSTANT + self._re_endol)
+        self._BOZ_LCRE = self._re_compile(_BOZ_LITERAL_CONSTANT + self._re_endol)
+        self._SIGNED_REAL_LCRE = self._re_compile(_SIGNED_REAL_LITERAL_CONSTANT + self._re_endol)
+        self._COMPLEX_LCRE = self._re_compile(_COMPLEX_LITERAL_CONSTANT + self._re_endol)
+        self._CHAR_LCRE = self._re_compile(_CHAR_LITERAL_CONSTANT + self._re_endol)
+        self._LOGICAL_LCRE = self._re_compile(_LOGICAL_LITERAL_CONSTANT + self._re_endol)
+        # The offset-based tokenizer matches regexes at a given position in the
+        # source string: leading '^' anchors would never match there...
+        self._clean_at = self._re_compile(self._unanchored(self._re_clean))
+        self._endblock_at = self._re_compile(self._unanchored(self._re_endblock))
+        # ...and a single regex is enough to recognise any of the literal types
+        self._literal_lcre = self._re_compile(
+            '|'.join(['(?P<{:s}>{:s}(?={:s}))'.format(ltype, ltype_re, self._re_endol)
+                      for ltype, ltype_re in zip(self._LITERAL_TYPES,
+                                                 (_SIGNED_INT_LITERAL_CONSTANT,
+                                                  _BOZ_LITERAL_CONSTANT,
+                                                  _SIGNED_REAL_LITERAL_CONSTANT,
+                                                  _COMPLEX_LITERAL_CONSTANT,
+                                                  _CHAR_LITERAL_CONSTANT,
+                                                  _LOGICAL_LITERAL_CONSTANT))])
+        )
+        # The bytes twin of the present parser must be regenerated
+        self._bytes_parser = None
+        # Repeat count (as in r*c or r*)
+        self._repeat_at = self._re_compile(r'(?P<count>[0-9]+)\*')
+        self._endol_at = self._re_compile(self._re_endol)
+        self._block_fastcheck = (self._re_block == _DEFAULT_RE_BLOCK and
+                                 bool(self._re_flags & re.DOTALL))
+        # Comma-separated runs of homogeneous literals (see array_threshold)
+        self._literal_runs = [
+            (ltype, self._re_compile(r'{0:s}(?:\s*,\s*{0:s})*(?={1:s})'.format(ltype_re, self._re_endol)))
+            for ltype, ltype_re in (('integer', _SIGNED_INT_LITERAL_CONSTANT),
+                                    ('real', _SIGNED_REAL_LITERAL_CONSTANT),
+                                    ('logical', _LOGICAL_LITERAL_CONSTANT))
+        ]
+
+    def _re_compile(self, re_string):
+        """Compile **re_string** (as a bytes regex if the parser works on binary buffers)."""
+        if self._bytes_mode:
+            return re.compile(re_string.encode('ascii'), self._re_flags & ~re.UNICODE)
+        else:
+            return re.compile(re_string, self._re_flags)
+
+    def _bytes_twin(self):
+        """A copy of the present parser that works on binary buffers (see :meth:`parse_buffer`)."""
+        if self._bytes_parser is None:
+            twin = copy.copy(self)
+            twin._bytes_mode = True
+            twin._recompile()
+            self._bytes_parser = twin
+        return self._bytes_parser
+
+    def _decode(self, token):
+        """Return **token** as a string (when working on binary buffers, **token** is decoded)."""
+        if self._bytes_mode:
+            return token.decode(self._BYTES_ENCODING)
+        else:
+            return token
+
+    @staticmethod
+    def _unanchored(re_string):
+        """Remove the leading '^' anchor of a regex string (if any)."""
+        return re_string[1:] if re_string.startswith('^') else re_string
 
     def addmacro(self, macro):
         """Add an extra declared macro name (without associated value)."""
@@ -1204,12 +1960,27 @@ class NamelistParser:
         """The literal parser used to process variable values."""
         return self._literal
 
+    @property
+    def cache(self):
+        """The :class:`NamelistParserCache` object used by this parser (or ``None``)."""
+        return self._cache
+
+    def _cache_signature(self):
+        """A string that describes the parser's configuration (see :class:`NamelistParserCache`)."""
+        return repr((self.__class__.__name__,
+                     sorted(self._declaredmacros),
+                     self._array_threshold,
+                     sorted([(k, v) for k, v in vars(self).items() if k.startswith('_re_')]),
+                     self._literal.__class__.__name__,
+                     sorted([(k, v) for k, v in vars(self._literal).items() if k.startswith('_re_')])))
+
     def _namelist_parse(self, source):
         """Parse the all bunch of source as a dict of namelist blocks."""
         namelists = list()
-        while source:
-            if self.block.search(source):
-                namblock, source = self._namelist_block_parse(source)
+        pos = 0
+        while pos < len(source):
+            if self._namelist_block_ahead(source, pos):
+                namblock, pos = self._namelist_block_scan(source, pos)
                 namelists.append(namblock)
             else:
                 break
@@ -1217,6 +1988,16 @@ class NamelistParser:
         n_set.set_as_reference()
         return n_set
 
+    def _namelist_block_ahead(self, source, pos):
+        """Is there any namelist block in **source** after position **pos** ?"""
+        if self._block_fastcheck:
+            # With the default block regex, the answer boils down to: is there a
+            # '&' character somewhere before the last '/' character ?
+            amp = source.find(b'&' if self._bytes_mode else '&', pos)
+            return amp >= 0 and source.rfind(b'/' if self._bytes_mode else '/') > amp
+        else:
+            return bool(self.block.search(source, pos))
+
     def _namelist_clean(self, dirty_source, extraclean=()):
         """Removes spaces and comments before data."""
         cleaner_source = self.clean.sub('', dirty_source)
@@ -1227,129 +2008,389 @@ class NamelistParser:
                 cleaner_source = cleaner.sub('', cleaner_source)
         return cleaner_source
 
+    @staticmethod
+    def _namelist_skip_one(source, pos, cleaner):
+        """Skip whatever **cleaner** matches at position **pos** in **source**."""
+        rmatch = cleaner.match(source, pos)
+        return rmatch.end() if rmatch else pos
+
+    def _namelist_skip(self, source, pos, extraclean=()):
+        """Skip spaces and comments (offset-based equivalent of :meth:`_namelist_clean`)."""
+        newpos = self._namelist_skip_one(source, pos, self._clean_at)
+        while newpos != pos:
+            pos = newpos
+            newpos = self._namelist_skip_one(source, pos, self._clean_at)
+            for cleaner in extraclean:
+                newpos = self._namelist_skip_one(source, newpos, cleaner)
+        return pos
+
+    def _namelist_skip_comma(self, source, pos):
+        """Skip spaces, comments and the eventual comma that follow a value."""
+        pos = self._namelist_skip(source, pos)
+        rmatch = self.comma.match(source, pos)
+        if rmatch:
+            pos = self._namelist_skip(source, rmatch.end())
+        return pos
+
+    def _namelist_array_scan(self, source, pos):
+        """Look for a run of homogeneous literals at position **pos** in **source**.
+
+        The run must contain at least ``array_threshold`` literals and must make up
+        all the values of a namelist variable (i.e. it must be followed by a new
+        entry or by the end of the block). If so, a :class:`numpy.ndarray` object
+        and the position of the next token are returned. Otherwise, ``None``
+        is returned.
+        """
+        for ltype, run_re in self._literal_runs:
+            rmatch = run_re.match(source, pos)
+            if rmatch:
+                break
+        else:
+            return None
+        run = self._decode(rmatch.group(0))
+        if run.count(',') + 1 < self._array_threshold:
+            return None
+        newpos = self._namelist_skip_comma(source, rmatch.end())
+        if not (self._endblock_at.match(source, newpos) or
+                (self.entry.match(source, newpos) and not self._LOGICAL_LCRE.match(source, newpos))):
+            return None
+        try:
+            return getattr(self.literal, '_parse_{:s}_run'.format(ltype))(run), newpos
+        except (ValueError, OverflowError):
+            return None
+
     def _namelist_block_parse(self, source):
-        """Parse a block of namelist."""
-        source = self._namelist_clean(source, extraclean=(self.endblock,))
-        block_name = self.bname.match(source[1:]).group(0)
-        source = self._namelist_clean(source[1 + len(block_name):])
+        """Parse a block of namelist.
+
+        Returns the :class:`NamelistBlock` object and the remaining
+        (unparsed) part of **source**.
+        """
+        namelist, pos = self._namelist_block_scan(source, 0)
+        return (namelist, source[pos:])
+
+    def _namelist_block_scan(self, source, pos):
+        """Parse a block of namelist, starting at position **pos** in **source**.
+
+        The **source** string is never copied: the tokenizer only moves forward
+        in the string. Returns the :class:`NamelistBlock` object and the position
+        of the first character that follows the block.
+        """
+        pos = self._namelist_skip(source, pos, extraclean=(self._endblock_at,))
+        bmatch = self.bname.match(source, pos + 1)
+        if not bmatch:
+            raise ValueError("Badly formatted FORTRAN namelist: [[%s]]" %
+                             self._decode(source[pos:pos + 32]))
+        block_name = self._decode(bmatch.group(0))
+        pos = self._namelist_skip(source, pos + 1 + len(block_name))
         namelist = NamelistBlock(block_name)
 
+        literal_parsers = {ltype: getattr(self.literal, 'parse_' + ltype)
+                           for ltype in self._LITERAL_TYPES}
         current = None
         values = list()
+        srclen = len(source)
 
-        while source:
+        while pos < srclen:
 
-            if self.entry.match(source) and not self._LOGICAL_LCRE.match(source):
+            if self.entry.match(source, pos) and not self._LOGICAL_LCRE.match(source, pos):
                 # Got a new entry in the namelist block
                 if current:
                     namelist.update({current: values})
-                current = self.entry.match(source).group(0).strip()
+                rmatch = self.entry.match(source, pos)
+                current = self._decode(rmatch.group(0).strip())
                 values = list()
-                source = self._namelist_clean(source[len(current):])
+                pos = self._namelist_skip(source, pos + len(rmatch.group(0).strip()))
                 # Removes equal
-                source = self._namelist_clean(source[1:])
+                pos = self._namelist_skip(source, pos + 1)
                 continue
 
-            elif self.endblock.match(source):
+            elif self._endblock_at.match(source, pos):
                 if current:
                     namelist.update({current: values})
-                source = source[1:]
-                if re.match(r'end', source, self._re_flags):
-                    source = source[3:]
+                pos += 1
+                if self._decode(source[pos:pos + 3]).upper() == 'END':
+                    pos += 3
                 break
 
-            elif self.deladd.match(source):
-                item = self.deladd.match(source).group(0)
+            rmatch = self.deladd.match(source, pos)
+            if rmatch:
                 namelist.todelete(current)
                 current = None
-                source = self._namelist_clean(source[len(item):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
+                pos = self._namelist_skip_comma(source, rmatch.end())
                 continue
 
-            elif self.freemacro_eol.match(source):
-                rmatch = self.freemacro_eol.match(source)
-                values.append(rmatch.group(0))
-                source = self._namelist_clean(source[len(rmatch.group(0)):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
+            rmatch = self.freemacro_eol.match(source, pos)
+            if rmatch:
+                values.append(self._decode(rmatch.group(0)))
+                pos = self._namelist_skip_comma(source, rmatch.end())
                 continue
 
-            elif self.macro_eol.match(source):
-                rmatch = self.macro_eol.match(source)
-                if rmatch.group('NAME') in self._declaredmacros:
-                    namelist.add_declaredmacro(rmatch.group('NAME'), None)
-                    values.append(rmatch.group(0))
-                    source = self._namelist_clean(source[len(rmatch.group(0)):])
-                    if self.comma.match(source):
-                        source = self._namelist_clean(self.comma.sub('', source, 1))
+            rmatch = self.macro_eol.match(source, pos)
+            if rmatch and self._decode(rmatch.group('NAME')) in self._declaredmacros:
+                namelist.add_declaredmacro(self._decode(rmatch.group('NAME')), None)
+                values.append(self._decode(rmatch.group(0)))
+                pos = self._namelist_skip_comma(source, rmatch.end())
+                continue
+
+            if self._array_threshold and isinstance(values, list) and not values:
+                array_scan = self._namelist_array_scan(source, pos)
+                if array_scan is not None:
+                    values, pos = array_scan
                     continue
 
-            if self._SIGNED_INT_LCRE.match(source):
-                item = self._SIGNED_INT_LCRE.match(source).group(0)
-                values.append(self.literal.parse_integer(item))
-                source = self._namelist_clean(source[len(item):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
-
-            elif self._BOZ_LCRE.match(source):
-                item = self._BOZ_LCRE.match(source).group(0)
-                values.append(self.literal.parse_boz(item))
-                source = self._namelist_clean(source[len(item):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
-
-            elif self._SIGNED_REAL_LCRE.match(source):
-                item = self._SIGNED_REAL_LCRE.match(source).group(0)
-                values.append(self.literal.parse_real(item))
-                source = self._namelist_clean(source[len(item):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
-
-            elif self._COMPLEX_LCRE.match(source):
-                item = self._COMPLEX_LCRE.match(source).group(0)
-                values.append(self.literal.parse_complex(item))
-                source = self._namelist_clean(source[len(item):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
-
-            elif self._CHAR_LCRE.match(source):
-                item = self._CHAR_LCRE.match(source).group(0)
-                values.append(self.literal.parse_character(item))
-                source = self._namelist_clean(source[len(item):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
-
-            elif self._LOGICAL_LCRE.match(source):
-                item = self._LOGICAL_LCRE.match(source).group(0)
-                values.append(self.literal.parse_logical(item))
-                source = self._namelist_clean(source[len(item):])
-                if self.comma.match(source):
-                    source = self._namelist_clean(self.comma.sub('', source, 1))
+            # Repeated values (r*c) and null values (r* or nothing between commas)
+            repeat = 1
+            rmatch = self._repeat_at.match(source, pos)
+            if rmatch:
+                repeat = int(rmatch.group('count'))
+                if not repeat:
+                    raise ValueError("Badly formatted FORTRAN namelist: [[%s]]" %
+                                     self._decode(source[pos:pos + 32]))
+                pos = rmatch.end()
+                if self._endol_at.match(source, pos):
+                    values.extend([NULL, ] * repeat)
+                    pos = self._namelist_skip_comma(source, pos)
+                    continue
+            elif current and self.comma.match(source, pos):
+                values.append(NULL)
+                pos = self._namelist_skip_comma(source, pos)
+                continue
 
+            # All the literal types are recognised at once (in the
+            # integer, boz, real, complex, character, logical order)
+            rmatch = self._literal_lcre.match(source, pos)
+            if rmatch:
+                value = literal_parsers[rmatch.lastgroup](self._decode(rmatch.group(0)))
+                if repeat > 1:
+                    # The literal is parsed only once (the list holds references
+                    # to the same immutable object)
+                    values.extend([value, ] * repeat)
+                else:
+                    values.append(value)
+                pos = self._namelist_skip_comma(source, rmatch.end())
             else:
-                raise ValueError("Badly formatted FORTRAN namelist: [[%s]]" % source[:32])
+                raise ValueError("Badly formatted FORTRAN namelist: [[%s]]" %
+                                 self._decode(source[pos:pos + 32]))
 
-        return (namelist, source)
+        return (namelist, pos)
 
-    def parse(self, obj):
-        """Parse a string or a file.
-
-        Returns a :class:`NamelistSet` object.
-        """
+    def _read_source(self, obj):
+        """Return the namelist source code associated with a string or a file."""
         if isinstance(obj, str):
             if not self.block.search(obj):
                 obj = obj.strip()
                 with open(obj) as iod:
                     obj = iod.read()
-            return self._namelist_parse(obj)
-
+            return obj
         elif hasattr(obj, 'seek') and hasattr(obj, 'read'):
             obj.seek(0)
-            return self._namelist_parse(obj.read())
+            return obj.read()
         else:
             raise ValueError("Argument %s cannot be parsed." % str(obj))
 
+    def parse(self, obj):
+        """Parse a string or a file (or a binary buffer, see :meth:`parse_buffer`).
+
+        Returns a :class:`NamelistSet` object.
+        """
+        if isinstance(obj, _BINARY_BUFFERS):
+            return self.parse_buffer(obj)
+        source = self._read_source(obj)
+        if self._cache is None:
+            return self._namelist_parse(source)
+        else:
+            return self._cache.parse(self, source)
+
+    def parse_buffer(self, buf):
+        """Parse a binary buffer (:class:`bytes`, :class:`bytearray` or :class:`mmap.mmap` object).
+
+        The buffer is never decoded (or copied) as a whole: the regular
+        expressions are applied directly on the buffer and only the tokens
+        (entry names, literals, ...) are decoded (using UTF-8).
+
+        Returns a :class:`NamelistSet` object.
+        """
+        if not isinstance(buf, _BINARY_BUFFERS):
+            raise ValueError("Argument %s is not a binary buffer." % str(type(buf)))
+        if self._cache is None:
+            return self._bytes_twin()._namelist_parse(buf)
+        else:
+            return self._cache.parse(self._bytes_twin(), buf)
+
+    def parse_mmap(self, obj):
+        """Parse a file using a read-only memory-map (see :meth:`parse_buffer`).
+
+        For huge namelist files, the peak memory usage stays close to the file
+        size (plus the size of the resulting :class:`NamelistSet` object).
+
+        :param obj: Path to a file or a File-like object opened in binary mode
+                    (it must have a ``fileno`` method)
+
+        Returns a :class:`NamelistSet` object.
+        """
+        if isinstance(obj, str):
+            with open(obj, 'rb') as fh:
+                return self.parse_mmap(fh)
+        elif hasattr(obj, 'fileno'):
+            if not os.fstat(obj.fileno()).st_size:
+                # Empty files can't be memory-mapped
+                return self.parse_buffer(b'')
+            with mmap.mmap(obj.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return self.parse_buffer(buf)
+        else:
+            raise ValueError("Argument %s cannot be memory-mapped." % str(obj))
+
+    def __getstate__(self):
+        """For pickle (the cache is not sent to other processes)."""
+        st = dict(self.__dict__)
+        st['_cache'] = None
+        st['_bytes_parser'] = None
+        return st
+
+    def _parse_many_source(self, source):
+        """Parse a string or a binary buffer (see :meth:`parse_many`)."""
+        if isinstance(source, _BINARY_BUFFERS):
+            return self._bytes_twin()._namelist_parse(source)
+        return self._namelist_parse(source)
+
+    @staticmethod
+    def _parse_many_dispatch(results, indices, n_set):
+        """Store **n_set** in **results** (duplicated sources get their own copy)."""
+        results[indices[0]] = n_set
+        for i in indices[1:]:
+            results[i] = copy.deepcopy(n_set)
+
+    def parse_many(self, objs, workers=None):
+        """Parse a bunch of strings or files, using a pool of processes.
+
+        Returns a list of :class:`NamelistSet` objects (in the same order as
+        **objs**). Identical sources are only parsed once (but distinct
+        :class:`NamelistSet` objects are returned for each of them). If the
+        parsing of any of the **objs** fails, a
+        :class:`NamelistBatchParsingError` exception is raised once all the
+        **objs** have been processed: it contains the per-file errors as well
+        as the successfully parsed :class:`NamelistSet` objects.
+
+        :param list objs: A list of strings, files or binary buffers (see :meth:`parse`)
+        :param int workers: The maximum number of worker processes (if omitted,
+                            the number of available CPUs is used)
+
+        :example: To get two :class:`NamelistSet` objects at once:
+
+            >>> np = NamelistParser()
+            >>> nsets = np.parse_many(['&NAM1 A=1 /', '&NAM2 B=2 /'], workers=2)
+            >>> print(nsets[1].dumps())
+             &NAM2
+               B=2,
+             /
+            <BLANKLINE>
+
+        """
+        objs = list(objs)
+        results = [None, ] * len(objs)
+        errors = collections.OrderedDict()
+        # Read the sources (identical sources are only parsed once)
+        sources = collections.OrderedDict()
+        for i, obj in enumerate(objs):
+            try:
+                source = obj if isinstance(obj, _BINARY_BUFFERS) else self._read_source(obj)
+            except (OSError, ValueError) as e:
+                errors[i] = e
+                continue
+            if isinstance(source, str):
+                ident = (False, source)
+            else:
+                ident = (True, hashlib.sha256(source).digest())
+            sources.setdefault(ident, (source, list()))[1].append(i)
+        todo = list()
+        for (binary, _), (source, indices) in sources.items():
+            parser = self._bytes_twin() if binary else self
+            key = None
+            if self._cache is not None:
+                key = self._cache.key(parser, source)
+                n_set = self._cache.lookup(key)
+                if n_set is not None:
+                    self._parse_many_dispatch(results, indices, n_set)
+                    continue
+            todo.append((indices, source, key))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(todo))
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                        initializer=_parse_many_init,
+                                                        initargs=(self, )) as executor:
+                # Memory-mapped files can't be sent to other processes
+                futures = [executor.submit(_parse_many_worker,
+                                           bytes(source) if isinstance(source, mmap.mmap) else source)
+                           for _, source, _ in todo]
+                outcomes = list()
+                for future in futures:
+                    try:
+                        outcomes.append((future.result(), None))
+                    except Exception as e:
+                        outcomes.append((None, e))
+        else:
+            outcomes = list()
+            for _, source, _ in todo:
+                try:
+                    outcomes.append((self._parse_many_source(source), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+        for (indices, _, key), (n_set, error) in zip(todo, outcomes):
+            if error is None:
+                if self._cache is not None:
+                    self._cache.store(key, n_set)
+                self._parse_many_dispatch(results, indices, n_set)
+            else:
+                for i in indices:
+                    errors[i] = error
+        errors = collections.OrderedDict(sorted(errors.items()))
+        if errors:
+            raise NamelistBatchParsingError(objs, results, errors)
+        return results
+
+
+class NamelistBatchParsingError(ValueError):
+    """Raised by :meth:`NamelistParser.parse_many` whenever some of the parsings failed."""
+
+    def __init__(self, objs, results, errors):
+        """
+        :param list objs: The list of strings or files that were parsed
+        :param list results: The list of :class:`NamelistSet` objects
+                             (``None`` for failed parsings)
+        :param dict errors: The exceptions raised, indexed by position in **objs**
+        """
+        self.objs = objs
+        self.results = results
+        self.errors = errors
+        super().__init__('{:d} out of {:d} namelist parsing(s) failed:\n'.format(len(errors), len(objs)) +
+                         '\n'.join(['  #{:d} ({:s}): {!s}'.format(i, self._short_obj(objs[i]), e)
+                                    for i, e in errors.items()]))
+
+    @staticmethod
+    def _short_obj(obj):
+        obj = str(obj).strip()
+        return obj if len(obj) <= 48 else obj[:45] + '...'
+
+    def __reduce__(self):
+        return (self.__class__, (self.objs, self.results, self.errors))
+
+
+#: The parser used by worker processes in :meth:`NamelistParser.parse_many`
+_PARSE_MANY_PARSER = None
+
+
+def _parse_many_init(parser):
+    """Initialise a worker process for :meth:`NamelistParser.parse_many`."""
+    global _PARSE_MANY_PARSER
+    _PARSE_MANY_PARSER = parser
+
+
+def _parse_many_worker(source):
+    """Parse **source** in a worker process for :meth:`NamelistParser.parse_many`."""
+    return _PARSE_MANY_PARSER._parse_many_source(source)
+
 
 def namparse(obj, **kwargs):
     """Raw parsing with an default anonymous fortran parser.
@@ -6,11 +6,18 @@ This module uses code from pylibtiff (https://pypi.python.org/pypi/libtiff,
 https://code.google.com/p/pylibtiff or https://github.com/hmeine/pylibtiff)
 """
 
+import functools
 import io
 import mmap
 import numpy
 import os
-import PIL.Image
+
+from bronx.syntax.externalcode import ExternalCodeImportChecker
+
+# PIL is only needed to decode compressed images
+pilchecker = ExternalCodeImportChecker('PIL')
+with pilchecker:
+    import PIL.Image
 
 
 class PyexttiffError(Exception):
@@ -51,6 +58,7 @@ class TiffFile:
         float64 = numpy.dtype('<f8')
         complex64 = numpy.dtype('<c8')
         complex128 = numpy.dtype('<c16')
+        ifdentry = numpy.dtype([('tag', '<u2'), ('type', '<u2'), ('count', '<u4'), ('value', '<u4')])
 
         @property
         def type2dt(self):
@@ -69,12 +77,13 @@ class TiffFile:
         float64 = numpy.dtype('>f8')
         complex64 = numpy.dtype('>c8')
         complex128 = numpy.dtype('>c16')
+        ifdentry = numpy.dtype([('tag', '>u2'), ('type', '>u2'), ('count', '>u4'), ('value', '>u4')])
 
         @property
         def type2dt(self):
             return {k: numpy.dtype(v).newbyteorder('>') for k, v in TiffFile._type2dtype.items()}
 
-    def __init__(self, filename, subIFDpaths=[], method=1):
+    def __init__(self, filename, subIFDpaths=[], method=1, lazy=False):
         """Opens a tiff file, reads header and IFDs.
 
         *filename* is the filename containing the tiff
@@ -92,6 +101,14 @@ class TiffFile:
             * 2: f=open(..., 'rb') ; numpy.ndarray(buffer=mmap(f), dtype=numpy.ubyte)
             * 3: same as 2 but with modifications allowed - DANGEROUS
 
+        *lazy*: if True, only the structure of the IFDs is read when the file
+        is opened. The values of the tags are read the first time they are
+        accessed and the images are decoded only when :meth:`IFD.get_image`
+        is called. Uncompressed images are then returned as views on the
+        file's data (without any copy) and PIL is only used for other images.
+        Combined with *method* 2, only the parts of the file that are actually
+        accessed are read from disk.
+
         """
         self._filename = filename
         self._subIFDpaths = subIFDpaths
@@ -124,6 +141,7 @@ class TiffFile:
             self.dtypes = TiffFile._BigEndianNumpyDTypes()
         else:
             raise OSError('unrecognized byteorder: %s' % (hex(byteorder)))
+        self._type2dt = self.dtypes.type2dt
 
         # Decoding header - magic number
         magic = self._get_uint16(2)
@@ -137,8 +155,9 @@ class TiffFile:
         self.IFDs = []
         offset = IFD0offset
         num = 0
+        readIFD = self._readIFD_lazy if lazy else self._readIFD
         while offset:
-            ifd, offset = self._readIFD(offset, (), subIFDpaths, num)
+            ifd, offset = readIFD(offset, (), subIFDpaths, num)
             if ifd.has_image():
                 num += 1
             else:
@@ -156,45 +175,130 @@ class TiffFile:
             entrytag = self._get_uint16(entryOffset)
             entrytype = self._get_uint16(entryOffset + 2)
             entrycount = self._get_uint32(entryOffset + 4)
-            entrybytes = TiffFile._type2bytes.get(entrytype, 0)
-            if entrycount == 1 and 1 <= entrybytes <= 4:
-                entryvalue = self._get_values(entryOffset + 8, entrytype, entrycount)
-            else:
-                valueOffset = self._get_int32(entryOffset + 8)
-                entryvalue = self._get_values(valueOffset, entrytype, entrycount)
+            entryvalue = self._get_entry_values(entryOffset, entrytype, entrycount)
             entrypath = tuple(list(path) + [entrytag])
             if entrypath in [mypath[:len(entrypath)] for mypath in subIFDpaths]:
-                subifd, _ = self._readIFD(entryvalue, entrypath, subIFDpaths, None)
+                subifd, _ = self._readIFD(int(entryvalue[0]), entrypath, subIFDpaths, None)
                 ifd.append(IFDEntry(entrytag, entrytype, subifd))
             else:
                 ifd.append(IFDEntry(entrytag, entrytype, entryvalue))
         if path == () and ifd.has_tag(273):
             # Raw data
-            nbRows = ifd.get_value(257)
-            offsetValues = ifd.get_value(273)
-            nbRowsPerStrip = ifd.get_value(278)
-            nbBytesPerStrip = ifd.get_value(279)
-            if not isinstance(offsetValues, numpy.ndarray):
-                offsetValues = numpy.array([offsetValues])
-                nbBytesPerStrip = numpy.array([nbBytesPerStrip])
-            if nbRows / nbRowsPerStrip + (1 if nbRows % nbRowsPerStrip != 0 else 0) != len(offsetValues):
-                raise PyexttiffError("Total number of rows, " +
-                                     "strip numbers and number of rows per strips are not consistent.")
-            data = []
-            for i in range(len(offsetValues)):
-                data.append(self._get_values(offsetValues[i], 1, nbBytesPerStrip[i]))
-            ifd.get_entry(273).set_value(data)
+            ifd.get_entry(273).set_value(self._get_strips(ifd, ifd.get_value(273)))
 
             # Image data
-            im = self.get_PILImage()
-            im.seek(num)
-            data = numpy.array(im)
-            if data.shape == ():
-                data = numpy.array(im)  # Sometimes must be called twice to return values...
-            ifd._image = data
+            ifd._image = self._get_PIL_array(num)
         nextIFD = self._get_uint32(offset + 2 + n * 12)
         return (ifd, nextIFD)
 
+    def _readIFD_lazy(self, offset, path, subIFDpaths, num):
+        """
+        Reads IFDs without reading tag values nor images (they are read on demand).
+        """
+        ifd = IFD()
+        n = self._get_uint16(offset)
+        table = self.get_data()[offset + 2:offset + 2 + n * 12].view(dtype=self.dtypes.ifdentry)
+        subpaths = {mypath[:len(path) + 1] for mypath in subIFDpaths}
+        entries = zip(table['tag'].tolist(), table['type'].tolist(), table['count'].tolist())
+        for i, (entrytag, entrytype, entrycount) in enumerate(entries):
+            loader = functools.partial(self._get_entry_values, offset + 2 + i * 12, entrytype, entrycount)
+            entrypath = path + (entrytag, )
+            if entrypath in subpaths:
+                loader = functools.partial(self._read_subIFD_lazy, loader, entrypath, subIFDpaths)
+            elif path == () and entrytag == 273:
+                loader = functools.partial(self._get_strips, ifd, loader)
+            ifd.append(IFDEntry(entrytag, entrytype, loader=loader))
+        if path == () and ifd.has_tag(273):
+            ifd._image_loader = functools.partial(self._decode_image, ifd, num)
+        nextIFD = self._get_uint32(offset + 2 + n * 12)
+        return (ifd, nextIFD)
+
+    def _read_subIFD_lazy(self, loader, path, subIFDpaths):
+        """Read the private IFD whose offset is given by **loader**."""
+        return self._readIFD_lazy(int(loader()[0]), path, subIFDpaths, None)[0]
+
+    def _get_entry_values(self, entryOffset, entrytype, entrycount):
+        """Returns the values of the IFD entry located at **entryOffset**."""
+        if entrycount * TiffFile._type2bytes.get(entrytype, 0) <= 4:
+            # The values fit in the entry itself
+            return self._get_values(entryOffset + 8, entrytype, entrycount)
+        else:
+            return self._get_values(self._get_uint32(entryOffset + 8), entrytype, entrycount)
+
+    def _get_strips(self, ifd, offsetValues):
+        """
+        Returns the list of strips (views on the file's data) given their offsets.
+
+        *offsetValues* may also be a callable that returns the offsets.
+        """
+        if callable(offsetValues):
+            offsetValues = offsetValues()
+        nbRows = ifd.get_value(257)
+        nbRowsPerStrip = ifd.get_value(278)
+        offsetValues = numpy.atleast_1d(offsetValues)
+        nbBytesPerStrip = numpy.atleast_1d(ifd.get_value(279))
+        if nbRows // nbRowsPerStrip + (1 if nbRows % nbRowsPerStrip != 0 else 0) != len(offsetValues):
+            raise PyexttiffError("Total number of rows, " +
+                                 "strip numbers and number of rows per strips are not consistent.")
+        return [self._get_values(int(offsetValues[i]), 1, int(nbBytesPerStrip[i]))
+                for i in range(len(offsetValues))]
+
+    def _get_PIL_array(self, num):
+        """Decodes the **num**-th image of the file using PIL."""
+        im = self.get_PILImage()
+        im.seek(num)
+        data = numpy.array(im)
+        if data.shape == ():
+            data = numpy.array(im)  # Sometimes must be called twice to return values...
+        return data
+
+    def _get_uncompressed_image(self, ifd):
+        """
+        Returns the image of **ifd** as a view on the file's data.
+
+        ``None`` is returned if the image is compressed, if its pixels can
+        not be described by a NumPy data type or if they are not stored as is
+        (only the BlackIsZero, RGB and Palette photometric interpretations are
+        supported).
+        """
+        def tag_values(tag, default):
+            return ifd.get_value(tag, human=False) if ifd.has_tag(tag) else numpy.array([default])
+
+        photometric = tag_values(262, -1)[0]
+        samples = int(tag_values(277, 1)[0])
+        if photometric not in (1, 2, 3) or (photometric == 3 and samples != 1):
+            return None
+        bits = set(tag_values(258, 1).tolist())
+        formats = set(tag_values(339, 1).tolist())
+        if (tag_values(259, 1)[0] != 1 or (samples > 1 and tag_values(284, 1)[0] != 1) or
+                len(bits) != 1 or len(formats) != 1):
+            return None
+        bits, fmt = bits.pop(), formats.pop()
+        if bits not in (8, 16, 32, 64) or fmt not in (1, 2, 3) or (fmt == 3 and bits == 8):
+            return None
+        dtype = numpy.dtype(('<' if self.endian == 'little' else '>') + 'uif'[fmt - 1] + str(bits // 8))
+        width = int(tag_values(256, 0)[0])
+        length = int(tag_values(257, 0)[0])
+        rowsPerStrip = min(int(tag_values(278, length)[0]), length)
+        rowBytes = width * samples * dtype.itemsize
+        strips = ifd.get_value(273, human=False)
+        stripBytes = [min(rowsPerStrip, length - i * rowsPerStrip) * rowBytes for i in range(len(strips))]
+        if any(strip.size < nbytes for strip, nbytes in zip(strips, stripBytes)):
+            return None
+        # Offsets of the strips in the file
+        base = self.get_data().__array_interface__['data'][0]
+        offsets = [strip.__array_interface__['data'][0] - base for strip in strips]
+        if all(offsets[i] + stripBytes[i] == offsets[i + 1] for i in range(len(strips) - 1)):
+            flat = self.get_data()[offsets[0]:offsets[0] + sum(stripBytes)]
+        else:
+            flat = numpy.concatenate([strip[:nbytes] for strip, nbytes in zip(strips, stripBytes)])
+        return flat.view(dtype=dtype).reshape((length, width, samples) if samples > 1 else (length, width))
+
+    def _decode_image(self, ifd, num):
+        """Decodes the image of **ifd** (which is the **num**-th image of the file)."""
+        data = self._get_uncompressed_image(ifd)
+        return self._get_PIL_array(num) if data is None else data
+
     def get_data(self):
         """
         Returns the ndarray containing the data.
@@ -205,14 +309,15 @@ class TiffFile:
         """
         Returns the buffer.
         """
-        return numpy.getbuffer(self.get_data())
+        return memoryview(self.get_data())
 
     def get_stringio(self):
         """
-        Returns the stringio representeing the buffer.
+        Returns a binary file-like object (:class:`io.BytesIO`) on the buffer.
         """
-        return io.StringIO(self.get_buffer())
+        return io.BytesIO(self.get_buffer())
 
+    @pilchecker.disabled_if_unavailable
     def get_PILImage(self):
         """
         Returns the PIL image object of the file.
@@ -241,7 +346,7 @@ class TiffFile:
                 typ = TiffFile._name2type.get(typ)
             else:
                 ntyp = str(typ)
-            dtype = self.dtypes.type2dt.get(typ)
+            dtype = self._type2dt.get(typ)
             size = TiffFile._type2bytes.get(typ)
             if dtype is None or size is None:
                 raise PyexttiffError(('_get_values: incomplete info for type=%r [%r]: ' +
@@ -269,6 +374,7 @@ class IFD(list):
     def __init__(self):
         """Initialisation method of IFD class."""
         self._image = None
+        self._image_loader = None
 
     def has_tag(self, tag):
         """Returns True if an entry fits the tag given."""
@@ -302,12 +408,15 @@ class IFD(list):
 
     def has_image(self):
         """Returns True if one tag is an image"""
-        return self._image is not None
+        return self._image is not None or self._image_loader is not None
 
     def get_image(self):
-        """Returns the image"""
+        """Returns the image (decoded on first access if the file was opened in lazy mode)"""
         if not self.has_image():
             raise PyexttiffError("This IFD doesn't contain an image.")
+        if self._image is None:
+            self._image = self._image_loader()
+            self._image_loader = None
         return self._image
 
     def get_tags(self):
@@ -503,15 +612,18 @@ EXIF_ImageUniqueID a420 ASCII 33
             _tag_value2type[h] = t
             _tag_name2value[n] = h
 
-    def __init__(self, tag, entrytype, value=None):
+    def __init__(self, tag, entrytype, value=None, loader=None):
         """
         * *tag* is the tag number of the entry
         * *entrytype* is the type of the entry
         * *value* is the value associated to the tag
+        * *loader* is a callable returning the value: it is only called
+          when the value is first accessed (instead of providing *value*)
         """
         self._tag = tag
         self._type = entrytype
         self._value = value
+        self._loader = loader
 
     def is_image(self):
         """Returns True if content in an image."""
@@ -534,17 +646,20 @@ EXIF_ImageUniqueID a420 ASCII 33
             * conversion in string is achieved for arrays representing strings
 
         """
+        if self._loader is not None:
+            self._value = self._loader()
+            self._loader = None
         value = self._value
         if human:
-            if len(value) == 1:
-                value = value[0]
             if self.get_type() == 2:
-                value = ''.join(value.view('|S%s' % (value.nbytes // value.size)))
+                value = value.tobytes().replace(b'\x00', b'').decode('latin-1')
+            elif len(value) == 1:
+                value = value[0]
         return value
 
     def get_tagName(self):
         """Returns the tag name."""
-        return self._tag_value2name.get(self.get_tag, 'TAG{}'.format(hex(self._tag)))
+        return self._tag_value2name.get(self.get_tag(), 'TAG{}'.format(hex(self._tag)))
 
     def get_type(self):
         """Returns the type of entry."""
@@ -552,4 +667,5 @@ EXIF_ImageUniqueID a420 ASCII 33
 
     def set_value(self, value):
         """Sets the value of the entry."""
+        self._loader = None
         self._value = value
@@ -4,10 +4,14 @@ The :class:`VarbcFile` should be used to read VarBC files (see its documentation
 below).
 """
 
-from collections import namedtuple, OrderedDict, abc
+from collections import namedtuple, abc
 from contextlib import contextmanager
+import io
+import mmap
 import numpy as np
+import os
 import re
+import warnings
 
 from bronx.datagrip import varbcheaders
 
@@ -89,8 +93,8 @@ class VarbcEntry:
             return False
         return (self.key == other.key and self.type == other.type and
                 self.ndata == other.ndata and self.npred == other.npred and
-                np.alltrue(self.predcs == other.predcs) and
-                np.alltrue(self.params == other.params))
+                np.array_equal(self.predcs, other.predcs) and
+                np.array_equal(self.params, other.params))
 
     def __ne__(self, other):
         return not self == other
@@ -167,6 +171,120 @@ class _VarbcMatchList:
         mt.save_entry()
 
 
+#: Columnar representation of the entries of a VarBC file (see :attr:`VarbcFile.columns`).
+#: ``ix``, ``type``, ``key``, ``ndata`` and ``npred`` are arrays with one element
+#: per entry. The predictors and coefficients of all the entries are concatenated
+#: in the ``predcs`` and ``params`` arrays: those of the i-th entry (starting
+#: at 0) are ``predcs[offsets[i]:offsets[i + 1]]``.
+VarbcColumns = namedtuple('VarbcColumns',
+                          ('ix', 'type', 'key', 'ndata', 'npred', 'predcs', 'params', 'offsets'))
+
+
+class _VarbcFastParser:
+    """Parse all the entries of a VarBC file at once (with a columnar output).
+
+    A single regular expression matches whole entries: it mimics the line by
+    line processing of :class:`_VarbcMatchTool` (lines are matched in the same
+    order and unexpected lines are skipped). Then, the numbers are converted by
+    NumPy. If the file is not perfectly regular (e.g. incomplete or
+    inconsistent entries), ``None`` is returned: the line by line parser must
+    be used in order to get the exact same result (or error).
+    """
+
+    _SKIP = r'(?:(?!ix=0*\d+$).*\n)*?'
+    _ENTRY = (r'\nix=0*(\d+)\n' + _SKIP +
+              r'class=(\w+)\n' + _SKIP +
+              r'key=[^\S\n]*([^=\n]+)\n' + _SKIP +
+              r'ndata=(\d+)\n' + _SKIP +
+              r'npred=(\d+)\n' + _SKIP +
+              r'predcs=([\d ]+)\n' + _SKIP +
+              r'params=([\dEe+-. ]+)$')
+    _ENTRY_RE = {str: re.compile(_ENTRY, re.MULTILINE),
+                 bytes: re.compile(_ENTRY.encode(), re.MULTILINE)}
+    _START = r'\nix=0*\d+$'
+    _START_RE = {str: re.compile(_START, re.MULTILINE),
+                 bytes: re.compile(_START.encode(), re.MULTILINE)}
+    _FIRST = r'ix=0*\d+$'
+    _FIRST_RE = {str: re.compile(_FIRST, re.MULTILINE),
+                 bytes: re.compile(_FIRST.encode(), re.MULTILINE)}
+
+    @staticmethod
+    def _ntokens(strings, joined):
+        """The number of space separated items in each of the **strings**."""
+        lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+        notspace = np.frombuffer(joined, dtype=np.uint8) != ord(' ')
+        tokstart = notspace.copy()
+        tokstart[1:] &= ~notspace[:-1]
+        csum = np.concatenate(([0], np.cumsum(tokstart)))
+        ends = np.cumsum(lengths + 1) - 1
+        return csum[ends] - csum[ends - lengths]
+
+    @classmethod
+    def _ragged(cls, strings, dtype):
+        """Convert and concatenate the space separated numbers of all the **strings**."""
+        if isinstance(strings[0], str):
+            joined = ' '.join(strings).encode('ascii')
+        else:
+            joined = b' '.join(strings)
+        return np.fromstring(joined, dtype=dtype, sep=' '), cls._ntokens(strings, joined)
+
+    @classmethod
+    def parse(cls, buffer, pos=0):
+        """Parse **buffer** (a :class:`str` or a bytes-like object), starting at **pos**.
+
+        :return: ``None`` or a tuple with the parsed buffer (it may have been
+            decoded), **pos**, a :class:`VarbcColumns` object and the offsets
+            of the entries in the buffer.
+        """
+        if not isinstance(buffer, str):
+            if buffer.find(b'\r', pos) >= 0:
+                # Universal newlines are dealt with by the line by line parser
+                return None
+            if len(buffer) > pos and np.frombuffer(buffer, dtype=np.uint8)[pos:].max() >= 0x80:
+                # Unicode characters: the str regular expression is needed
+                buffer, pos = bytes(buffer[pos:]).decode('utf-8', 'surrogateescape'), 0
+        kind = str if isinstance(buffer, str) else bytes
+        matches = []
+        starts = []
+        if cls._FIRST_RE[kind].match(buffer, pos):
+            # The regular expression expects a newline before each entry
+            second = cls._START_RE[kind].search(buffer, pos)
+            first = cls._ENTRY_RE[kind].match(('\n' if kind is str else b'\n') +
+                                              buffer[pos:second.start() if second else len(buffer)])
+            if first is None:
+                return None
+            matches.append(first.groups())
+            starts.append(pos)
+        starts.extend(m.start() + 1 for m in cls._START_RE[kind].finditer(buffer, pos))
+        matches.extend(cls._ENTRY_RE[kind].findall(buffer, pos))
+        if not matches or len(matches) != len(starts):
+            return None
+        ix, types, keys, ndata, npred, predcs, params = zip(*matches)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                ix, ndata, npred = [np.array(values).astype(np.int64) for values in (ix, ndata, npred)]
+                predcs, npredcs = cls._ragged(predcs, np.int64)
+                params, nparams = cls._ragged(params, np.float64)
+        except (ValueError, OverflowError, DeprecationWarning):
+            return None
+        if kind is bytes:
+            types = [t.decode('ascii') for t in types]
+            keys = [k.decode('ascii') for k in keys]
+        if any(k[:1].isspace() for k in keys):
+            # Blank characters that are not stripped by the regular expression
+            return None
+        if not (np.array_equal(ix, np.arange(1, len(ix) + 1)) and
+                np.array_equal(npredcs, npred) and np.array_equal(nparams, npred) and
+                predcs.size == params.size and np.all((predcs >= 0) & (predcs <= 255))):
+            return None
+        return (buffer, pos,
+                VarbcColumns(ix, np.array(types), np.array(keys), ndata, npred,
+                             predcs.astype(np.uint8), params.astype(np.float32),
+                             np.concatenate(([0], np.cumsum(npred)))),
+                np.array(starts, dtype=np.int64))
+
+
 class VarbcFile(abc.Mapping):
     """Class to handle a full VarBC file.
 
@@ -177,6 +295,12 @@ class VarbcFile(abc.Mapping):
     :meth:`__iter__`, :meth:`keys`, :meth:`values` and :meth:`items` methods
     are defined. With all of these methods, the values are returned in the same
     order than originaly read in thh VarBC file.
+
+    The entries are stored in a columnar way (see :attr:`columns`) and the
+    :class:`VarbcEntry` objects are only created when they are accessed.
+
+    VarBC files can be compared (see :meth:`diff`), merged (see :meth:`merge`)
+    and written back (see :meth:`dump` and :meth:`dumps`).
     """
 
     _VBC_MATCH_ELEMENTS = [
@@ -191,20 +315,120 @@ class VarbcFile(abc.Mapping):
 
     def __init__(self, asciidatas):
         """
-        :param asciidatas: Any iterable over lines from a VarBC file.
+        :param asciidatas: Any iterable over lines from a VarBC file, the path
+            to a VarBC file or the content of a VarBC file (as a bytes-like
+            object like :class:`bytes` or :class:`mmap.mmap`).
+
+        When a path is given, the file is memory-mapped (it is read directly
+        from the page cache, without any intermediate copy). Since the text of
+        the entries is kept (see :meth:`dumps`), the file must not be modified
+        while the present object is in use.
         """
-        self._datalist = []
-
-        self._metadata = varbcheaders.VarbcHeadersFile(asciidatas)
-
+        mapped = None
+        if isinstance(asciidatas, (str, os.PathLike)):
+            with open(asciidatas, 'rb') as fhvbc:
+                try:
+                    asciidatas = mapped = mmap.mmap(fhvbc.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # Empty file
+                    asciidatas = fhvbc.read()
+        if isinstance(asciidatas, (bytes, bytearray, memoryview, mmap.mmap)):
+            buffer = asciidatas
+            headers, pos = self._header_lines(buffer)
+            self._metadata = varbcheaders.VarbcHeadersFile(headers)
+        else:
+            self._metadata = varbcheaders.VarbcHeadersFile(asciidatas)
+            pos = 0
+            if hasattr(asciidatas, 'read'):
+                buffer = asciidatas.read()
+            else:
+                reiterable = iter(asciidatas) is not asciidatas
+                asciidatas = list(asciidatas)
+                if reiterable:
+                    # The header lines were not consumed by VarbcHeadersFile
+                    asciidatas = asciidatas[len(self._metadata.lines()):]
+                buffer = self._join_lines(asciidatas)
+        self._entries = dict()
+        self._key2i = None
+        try:
+            parsed = None if buffer is None else _VarbcFastParser.parse(buffer, pos)
+            if parsed is None:
+                parsed = self._slow_parse(buffer, pos, asciidatas)
+        except Exception:
+            if mapped is not None:
+                mapped.close()
+            raise
+        buffer, pos, self._columns, starts = parsed
+        if mapped is not None and buffer is not mapped:
+            mapped.close()
+        if not isinstance(buffer, (str, bytes)) and buffer is not mapped:
+            # Do not keep a reference to a buffer that may be changed or closed
+            buffer = bytes(buffer)
+        self._preamble = self._decode(buffer[pos:starts[0] if len(starts) else len(buffer)])
+        self._sources = (buffer, )
+        self._srcid = np.zeros(len(starts), dtype=np.intp)
+        self._srcix = self._columns.ix
+        # The text of each entry (in the source buffers)
+        self._spans = np.stack((starts, np.append(starts, len(buffer))[1:]), axis=1)
+
+    @staticmethod
+    def _header_lines(buffer, nlines=3):
+        """Decode the first lines of **buffer** (and find the beginning of the next one)."""
+        lines = []
+        start = 0
+        while len(lines) < nlines and start < len(buffer):
+            end = buffer.find(b'\n', start)
+            end = len(buffer) if end < 0 else end + 1
+            # Like a file opened in text mode (with universal newlines)
+            lines.append(bytes(buffer[start:end]).decode('utf-8', 'surrogateescape').replace('\r\n', '\n'))
+            start = end
+        return lines, start
+
+    @staticmethod
+    def _join_lines(lines):
+        """Concatenate the VarBC **lines** (or return ``None`` if they are not well formed)."""
+        text = ''.join(lines)
+        if lines and not (all(line.endswith('\n') for line in lines[:-1]) and
+                          text.count('\n') == len(lines) - (not lines[-1].endswith('\n'))):
+            return None
+        return text
+
+    @staticmethod
+    def _decode(text):
+        """Decode **text** if it is a bytes-like object."""
+        return text if isinstance(text, str) else bytes(text).decode('utf-8', 'surrogateescape')
+
+    def _slow_parse(self, buffer, pos, lines):
+        """Parse the VarBC lines one by one (see :class:`_VarbcMatchTool`)."""
+        if isinstance(buffer, str):
+            lines = io.StringIO(buffer[pos:], newline='\n')
+        elif buffer is not None:
+            # Like a file opened in text mode (with universal newlines)
+            lines = io.StringIO(self._decode(buffer[pos:]), newline=None)
+        lines = list(lines)
+        datalist = []
+        starts = []
+        offset = 0
+        firstmatch = self._VBC_MATCH_ELEMENTS[0].regex.match
         mymatchlist = _VarbcMatchList(self._VBC_MATCH_ELEMENTS)
-        with mymatchlist.autorecord(self._datalist) as mymatchtool:
-            for a_line in asciidatas:
+        with mymatchlist.autorecord(datalist) as mymatchtool:
+            for a_line in lines:
+                if firstmatch(a_line):
+                    starts.append(offset)
+                offset += len(a_line)
                 mymatchtool(a_line)
-
-        self._key2entry = OrderedDict()
-        for entry in self._datalist:
-            self._key2entry[entry.key] = entry
+        self._entries = dict(enumerate(datalist))
+        npred = np.array([e.npred for e in datalist], dtype=np.int64)
+        return (''.join(lines), 0,
+                VarbcColumns(np.array([e.ix for e in datalist], dtype=np.int64),
+                             np.array([e.type for e in datalist], dtype=str),
+                             np.array([e.key for e in datalist], dtype=str),
+                             np.array([e.ndata for e in datalist], dtype=np.int64),
+                             npred,
+                             np.concatenate([e.predcs for e in datalist] + [np.zeros(0, dtype=np.uint8)]),
+                             np.concatenate([e.params for e in datalist] + [np.zeros(0, dtype=np.float32)]),
+                             np.concatenate(([0], np.cumsum(npred)))),
+                np.array(starts, dtype=np.int64))
 
     @property
     def metadata(self):
@@ -214,9 +438,17 @@ class VarbcFile(abc.Mapping):
         """
         return self._metadata
 
+    @property
+    def columns(self):
+        """The entries of the VarBC file, as NumPy arrays.
+
+        :rtype: :class:`VarbcColumns`
+        """
+        return self._columns
+
     def __len__(self):
         """The number of entries in the VarBC file."""
-        return len(self._datalist)
+        return len(self._columns.ix)
 
     def __getitem__(self, item):
         """Return the entry associated with **entry**.
@@ -231,9 +463,32 @@ class VarbcFile(abc.Mapping):
         else:
             raise KeyError('{!s} is not a valid key for a VarbcFile object'.format(item))
 
+    @property
+    def _key2index(self):
+        """Dictionary of entry indices (for each key, the last entry wins)."""
+        if self._key2i is None:
+            self._key2i = dict(zip(self._columns.key.tolist(), range(len(self))))
+        return self._key2i
+
+    def _entry(self, i):
+        """The **i**-th :class:`VarbcEntry` object (starting at 0)."""
+        entry = self._entries.get(i)
+        if entry is None:
+            columns = self._columns
+            entry = VarbcEntry()
+            entry.ix = columns.ix[i]
+            entry.type = columns.type[i]
+            entry.key = columns.key[i]
+            entry.ndata = columns.ndata[i]
+            entry.npred = columns.npred[i]
+            entry.predcs = columns.predcs[columns.offsets[i]:columns.offsets[i + 1]]
+            entry.params = columns.params[columns.offsets[i]:columns.offsets[i + 1]]
+            self._entries[i] = entry
+        return entry
+
     def keys(self):
         """Iterate over all the keys available in the VarBC file."""
-        yield from self._key2entry.keys()
+        yield from self._key2index.keys()
 
     def __iter__(self):
         """Iterate over all the keys available in the VarBC file."""
@@ -241,11 +496,13 @@ class VarbcFile(abc.Mapping):
 
     def values(self):
         """Iterate over all the :class:`ObsVarbcEntry` objects read from file."""
-        yield from self._datalist
+        for i in range(len(self)):
+            yield self._entry(i)
 
     def items(self):
         """Iterate over all the (key, entry) pairs available in the VarBC file."""
-        yield from self._key2entry.items()
+        for key, i in self._key2index.items():
+            yield key, self._entry(i)
 
     def getix(self, ix):
         """Gives the **ix** th entry of the VarBC file
@@ -254,7 +511,9 @@ class VarbcFile(abc.Mapping):
         """
         if ix < 1:
             raise KeyError("The serie of ix numbers starts with 1")
-        return self._datalist[ix - 1]
+        if ix > len(self):
+            raise IndexError("list index out of range")
+        return self._entry(ix - 1)
 
     def getkey(self, key):
         """Returns a VarBC entry given its **key**
@@ -262,4 +521,223 @@ class VarbcFile(abc.Mapping):
         :rtype: :class:`VarbcEntry`
         :example: ``myobj.getkey('4 3 7')``
         """
-        return self._key2entry[key]
+        return self._entry(self._key2index[key])
+
+    def _iter_dumps(self):
+        """Iterate over the pieces of text of the VarBC file."""
+        yield from self._metadata.lines()
+        yield self._preamble
+        nentries = len(self)
+        renumbered = self._columns.ix != self._srcix
+        starts, ends = self._spans.T
+        # Contiguous entries are written at once
+        cuts = np.ones(nentries, dtype=bool)
+        cuts[1:] = ((self._srcid[1:] != self._srcid[:-1]) | (starts[1:] != ends[:-1]) |
+                    renumbered[1:] | renumbered[:-1])
+        firsts = np.nonzero(cuts)[0]
+        lasts = np.append(firsts[1:], nentries) - 1
+        for first, last in zip(firsts.tolist(), lasts.tolist()):
+            text = self._decode(self._sources[self._srcid[first]][starts[first]:ends[last]])
+            if renumbered[first]:
+                # The zero-padding of the ix number is preserved
+                eol = text.find('\n')
+                eol = len(text) if eol < 0 else eol
+                text = 'ix={:0{:d}d}'.format(self._columns.ix[first], eol - 3) + text[eol:]
+            if last < nentries - 1 and not text.endswith('\n'):
+                text += '\n'
+            yield text
+
+    def dumps(self):
+        """Return the text of the VarBC file.
+
+        The headers and the entries are written as they were read, only the
+        number of entries (in the headers) and the ix numbers are updated
+        (e.g. after a :meth:`merge`).
+        """
+        return ''.join(self._iter_dumps())
+
+    def dump(self, fh):
+        """Write the VarBC file into a File-like object opened in text mode (see :meth:`dumps`)."""
+        for text in self._iter_dumps():
+            fh.write(text)
+
+    def _aligned(self, other):
+        """For each of the keys of the present object, the index of the **other**'s entry (or -1)."""
+        other_k2i = other._key2index
+        return np.fromiter((other_k2i.get(k, -1) for k in self._key2index),
+                           dtype=np.intp, count=len(self._key2index))
+
+    def diff(self, other, rtol=0., atol=0.):
+        """Compute the differences between the present VarBC file and **other**.
+
+        :param VarbcFile other: The (possibly) modified VarBC file
+        :param float rtol: The relative tolerance on the coefficients
+        :param float atol: The absolute tolerance on the coefficients
+        :rtype: :class:`VarbcDelta`
+        """
+        return VarbcDelta(self, other, rtol=rtol, atol=atol)
+
+    def merge(self, other, overwrite=True):
+        """Merge the entries of another VarBC file into a copy of the present one.
+
+        The entries are matched using their key. The entries of **other** that
+        are missing in the present object are appended and the entries are
+        renumbered. The headers of the present object are used (except for the
+        number of entries).
+
+        :param VarbcFile other: The VarBC file to merge in
+        :param bool overwrite: When a key is present in both files, use the
+            **other**'s entry (otherwise the present object's entry is kept).
+        :rtype: :class:`VarbcFile`
+        """
+        mine = np.fromiter(self._key2index.values(), dtype=np.intp, count=len(self._key2index))
+        theirs = self._aligned(other)
+        created = np.fromiter(other._key2index.values(), dtype=np.intp, count=len(other._key2index))
+        created = created[np.isin(created, theirs, invert=True)]
+        if overwrite:
+            mine = np.where(theirs >= 0, theirs + len(self), mine)
+        # Indices in the concatenation of both files
+        select = np.concatenate((mine, created + len(self)))
+        new = self.__class__.__new__(self.__class__)
+        new._metadata = varbcheaders.VarbcHeadersFile(self._metadata.lines(nentries=len(select)))
+        new._preamble = self._preamble
+        new._sources = self._sources + other._sources
+        new._srcid = np.concatenate((self._srcid, other._srcid + len(self._sources)))[select]
+        new._spans = np.concatenate((self._spans, other._spans))[select]
+        new._srcix = np.concatenate((self._srcix, other._srcix))[select]
+        new._columns = (_columns_take(_columns_concatenate(self._columns, other._columns), select)
+                        ._replace(ix=np.arange(1, len(select) + 1, dtype=np.int64)))
+        new._entries = dict()
+        new._key2i = None
+        return new
+
+
+#: Per-class statistics of the differences between two VarBC files (see :meth:`VarbcDelta.stats`):
+#: the number of entries (in any of the files), the number of created, deleted
+#: and updated entries, the maximum and the mean of the maximum absolute
+#: difference of the coefficients of each entry (NaN if no entry can be
+#: compared).
+VarbcDeltaStats = namedtuple('VarbcDeltaStats',
+                             ('entries', 'created', 'deleted', 'updated', 'maxdiff', 'meandiff'))
+
+
+class VarbcDelta:
+    """The differences between two VarBC files (see :meth:`VarbcFile.diff`).
+
+    The entries are matched using their key. All the attributes are NumPy
+    arrays with one element per key (the keys of the reference file come
+    first, followed by the created ones):
+
+    * ``key``, ``type``: The key and the class of the entries;
+    * ``ix``, ``other_ix``: The ix number in the reference and in the other
+      file (0 if the entry is missing);
+    * ``created``, ``deleted``: The entries that are only present in the other
+      (resp. the reference) file;
+    * ``predictors``: The class or the predictors of the entry changed;
+    * ``params``: The coefficients changed (given the tolerances);
+    * ``updated``: ``predictors | params``;
+    * ``maxdiff``: The maximum absolute difference of the coefficients (NaN if
+      they can not be compared).
+
+    The number of data (``ndata``) is not compared.
+    """
+
+    def __init__(self, before, after, rtol=0., atol=0.):
+        """
+        :param VarbcFile before: The reference VarBC file
+        :param VarbcFile after: The (possibly) modified VarBC file
+        :param float rtol: The relative tolerance on the coefficients
+        :param float atol: The absolute tolerance on the coefficients
+        """
+        cb, ca = before.columns, after.columns
+        ib = np.fromiter(before._key2index.values(), dtype=np.intp, count=len(before._key2index))
+        jb = before._aligned(after)
+        ic = np.fromiter(after._key2index.values(), dtype=np.intp, count=len(after._key2index))
+        ic = ic[np.isin(ic, jb, invert=True)]
+        nb, nc = len(ib), len(ic)
+        self.key = np.concatenate((cb.key[ib], ca.key[ic]))
+        self.type = np.concatenate((cb.type[ib], ca.type[ic]))
+        self.ix = np.concatenate((cb.ix[ib], np.zeros(nc, dtype=np.int64)))
+        self.other_ix = np.concatenate((np.where(jb >= 0, ca.ix[jb], 0), ca.ix[ic]))
+        self.created = np.concatenate((np.zeros(nb, dtype=bool), np.ones(nc, dtype=bool)))
+        self.deleted = np.concatenate((jb < 0, np.zeros(nc, dtype=bool)))
+        self.predictors = np.zeros(nb + nc, dtype=bool)
+        self.params = np.zeros(nb + nc, dtype=bool)
+        self.maxdiff = np.full(nb + nc, np.nan)
+        # Compare the predictors and coefficients of the common entries
+        common = np.nonzero(jb >= 0)[0]
+        same = ((cb.type[ib[common]] == ca.type[jb[common]]) &
+                (cb.npred[ib[common]] == ca.npred[jb[common]]))
+        self.predictors[common[~same]] = True
+        common = common[same]
+        flat_b, offsets = _ragged_indices(cb.offsets, ib[common])
+        flat_a = _ragged_indices(ca.offsets, jb[common])[0]
+        self.predictors[common] = _segments_any(cb.predcs[flat_b] != ca.predcs[flat_a], offsets)
+        common = common[~self.predictors[common]]
+        flat_b, offsets = _ragged_indices(cb.offsets, ib[common])
+        flat_a = _ragged_indices(ca.offsets, jb[common])[0]
+        params_a = ca.params[flat_a].astype(np.float64)
+        absdiff = np.abs(cb.params[flat_b] - params_a)
+        self.params[common] = _segments_any(absdiff > atol + rtol * np.abs(params_a), offsets)
+        self.maxdiff[common] = _segments_max(absdiff, offsets)
+        self.updated = self.predictors | self.params
+
+    def __len__(self):
+        """The number of created, deleted or updated entries."""
+        return int(np.count_nonzero(self.created | self.deleted | self.updated))
+
+    def stats(self):
+        """Compute per-class statistics.
+
+        :return: A dictionary of :class:`VarbcDeltaStats` objects (for each class)
+        """
+        classes, inverse = np.unique(self.type, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        compared = ~np.isnan(self.maxdiff)
+        maxdiff = np.full(len(classes), -np.inf)
+        np.maximum.at(maxdiff, inverse[compared], self.maxdiff[compared])
+        maxdiff[np.isinf(maxdiff)] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            meandiff = (np.bincount(inverse[compared], weights=self.maxdiff[compared], minlength=len(classes)) /
+                        np.bincount(inverse[compared], minlength=len(classes)))
+        counts = [np.bincount(inverse[mask], minlength=len(classes)).tolist()
+                  for mask in (slice(None), self.created, self.deleted, self.updated)]
+        return {cls: VarbcDeltaStats(*items)
+                for cls, *items in zip(classes.tolist(), *counts, maxdiff.tolist(), meandiff.tolist())}
+
+
+def _ragged_indices(offsets, select):
+    """The flat indices of the **select** elements of a ragged array described by **offsets**."""
+    lengths = offsets[select + 1] - offsets[select]
+    newoffsets = np.concatenate(([0], np.cumsum(lengths)))
+    return (np.arange(newoffsets[-1], dtype=np.intp) -
+            np.repeat(newoffsets[:-1] - offsets[select], lengths)), newoffsets
+
+
+def _columns_concatenate(columns, other):
+    """Concatenate two :class:`VarbcColumns` objects."""
+    return VarbcColumns(*([np.concatenate((mine, theirs)) for mine, theirs in zip(columns[:-1], other[:-1])] +
+                          [np.concatenate((columns.offsets[:-1], other.offsets + columns.offsets[-1]))]))
+
+
+def _columns_take(columns, select):
+    """Select (and reorder) the entries of a :class:`VarbcColumns` object."""
+    flat, offsets = _ragged_indices(columns.offsets, select)
+    return VarbcColumns(columns.ix[select], columns.type[select], columns.key[select],
+                        columns.ndata[select], columns.npred[select],
+                        columns.predcs[flat], columns.params[flat], offsets)
+
+
+def _segments_any(mask, offsets):
+    """For each segment described by **offsets**, is any element of **mask** True ?"""
+    csum = np.concatenate(([0], np.cumsum(mask)))
+    return csum[offsets[1:]] > csum[offsets[:-1]]
+
+
+def _segments_max(values, offsets):
+    """For each segment described by **offsets**, the maximum of **values** (0 for empty segments)."""
+    result = np.zeros(len(offsets) - 1, dtype=values.dtype)
+    nonempty = offsets[1:] > offsets[:-1]
+    if np.any(nonempty):
+        result[nonempty] = np.maximum.reduceat(values, offsets[:-1][nonempty])
+    return result
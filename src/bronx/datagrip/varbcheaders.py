@@ -33,6 +33,14 @@ class VarbcHeadersFile(collections.abc.Mapping):
         >>> vbch['nentries']
         11
 
+    The header lines can be written back (possibly with a different number of
+    entries)::
+
+        >>> print(''.join(vbch.lines(nentries=12)), end='')
+        VARBC_cycle.version006
+        MINI  20200101         0
+                12     10980
+
     """
 
     DOCTEST_DATA = """VARBC_cycle.version006
@@ -58,15 +66,34 @@ other stuff..."""
                            Only the first 3 lines of the VarBC file will be used.
         """
         self._metadata = {}
+        self._lines = []
         l_iter = iter(varbclines)
-        mobj = self._serious_match(self._VBC_VERSION_RE, next(l_iter))
+        mobj = self._serious_match(self._VBC_VERSION_RE, self._next_line(l_iter))
         self._metadata['version'] = int(mobj.group(1))
-        mobj = self._serious_match(self._VBC_XPDATE_RE, next(l_iter))
+        mobj = self._serious_match(self._VBC_XPDATE_RE, self._next_line(l_iter))
         self._metadata['expver'] = mobj.group(1)
         self._metadata['date'] = Date('{:s}{:06d}'.format(mobj.group(2),
                                                           int(mobj.group(3))))
-        mobj = self._serious_match(self._VBC_LEN_RE, next(l_iter))
+        mobj = self._serious_match(self._VBC_LEN_RE, self._next_line(l_iter))
         self._metadata['nentries'] = int(mobj.group(1))
+        self._nentries_width = mobj.end()
+
+    def _next_line(self, l_iter):
+        """Read and record the next header line."""
+        line = next(l_iter)
+        self._lines.append(line.rstrip('\n'))
+        return line
+
+    def lines(self, nentries=None):
+        """The header lines, as read in the VarBC file.
+
+        :param int nentries: Update the number of entries of the VarBC file.
+        """
+        lines = list(self._lines)
+        if nentries is not None:
+            lines[2] = ('{:{:d}d}'.format(nentries, self._nentries_width) +
+                        lines[2][self._nentries_width:])
+        return [line + '\n' for line in lines]
 
     def __getitem__(self, item):
         return self._metadata[item]
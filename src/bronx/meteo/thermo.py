@@ -5,6 +5,10 @@ A brief description of the equations can be found in this document:
 `thermo.pdf <../_static/thermo.pdf>`_
 """
 
+import collections
+import functools
+import os
+
 import numpy as np
 
 from bronx.fancies import loggers
@@ -68,6 +72,80 @@ class ThermoError(Exception):
     """Errors in thermo."""
 
 
+def _methods_plan(table, available, target):
+    """Find out which methods :meth:`Thermo.get` needs to call in order to compute **target**.
+
+    The methods table is compiled into a graph (parameter -> methods that
+    compute it). Then, the search performed by the original recursive algorithm
+    is replayed symbolically: methods are tried in the order of the table (the
+    more accurate methods come first) and a method can't be used to compute its
+    own inputs (in order to prevent cyclic calls). Intermediate results are
+    memoized.
+
+    :param tuple table: An ``(output, inputs)`` tuple for each of the known methods
+    :param frozenset available: The parameters that are already known
+    :param str target: The parameter to compute
+    :return: The indices (in **table**) of the methods that need to be called
+        (in that order) and a boolean that tells whether **target** can be
+        computed (if not, the listed methods still compute some of the
+        intermediate parameters).
+    """
+    producers = collections.defaultdict(list)
+    for i, (output, _) in enumerate(table):
+        producers[output].append(i)
+    known = set(available)
+    steps = list()
+    memo = dict()
+
+    def _resolve(parameter, excluded):
+        if parameter in known:
+            return True
+        mkey = (parameter, frozenset(known), excluded)
+        if mkey in memo:
+            success, msteps = memo[mkey]
+            steps.extend(msteps)
+            known.update([table[i][0] for i in msteps])
+            return success
+        start = len(steps)
+        for i in producers.get(parameter, ()):
+            if parameter in known:
+                break
+            if i in excluded:
+                continue
+            subexcluded = excluded | {i}
+            if all(_resolve(dep, subexcluded) for dep in table[i][1]):
+                steps.append(i)
+                known.add(parameter)
+        memo[mkey] = (parameter in known, tuple(steps[start:]))
+        return parameter in known
+
+    success = _resolve(target, frozenset())
+    return tuple(steps), success
+
+
+def _is_arraylike(value):
+    """Is **value** an array (or an array-like object such as a netCDF4 variable) ?"""
+    return isinstance(value, np.ndarray) or (hasattr(value, 'shape') and
+                                             hasattr(value, '__getitem__') and
+                                             not isinstance(value, np.generic))
+
+
+def _chunk_get(cls, hydrometeors, esat, data, steps, parameter):
+    """Compute **parameter** on a chunk of **data** (see :meth:`Thermo.get_chunked`).
+
+    **steps** are the indices of the methods to call (see :func:`_methods_plan`).
+    """
+    obj = cls(hydrometeors=hydrometeors, data=data, esat=esat)
+    for i in steps:
+        output, inputs, method = obj._allKnownMethods[i]
+        obj._data[output] = method(*[obj._data[dep] for dep in inputs])
+    result = obj._data[parameter]
+    # Thermo objects are part of reference cycles (because of the methods
+    # table): free the intermediate results right now
+    obj._data.clear()
+    return result
+
+
 class Thermo:
     """This class aims at containing states parameter.
 
@@ -102,13 +180,20 @@ class Thermo:
     _known_liquid_hydrometeors = ['c', 'r']
     _known_solid_hydrometeors = ['i', 's', 'g', 'h']
 
-    def __init__(self, hydrometeors=None, data=None):
+    _plans = staticmethod(functools.lru_cache(maxsize=1024)(_methods_plan))
+
+    def __init__(self, hydrometeors=None, data=None, esat=None):
         """
         :param hydrometeors: lists the hydrometeors to consider.
             If None, only a subset of computations can be done.
             'v', 'c', 'r', 'i', 's', 'g' and 'h' are allowed.
         :param data: A dictionary. Alternatively, **data** can be omited and
             the :meth:`set`` method can be used.
+        :param esat: How saturation vapour pressures (and dew points) are
+            computed. If None, the exact formulas are used. Otherwise, an
+            :class:`EsatTable` object or ``'linear'``/``'cubic'`` (for default
+            tables, see :meth:`EsatTable.shared`): the saturation vapour
+            pressure over ice and the dew point are then interpolated.
 
         Example::
 
@@ -126,6 +211,16 @@ class Thermo:
             True
 
         """
+        if esat in ('linear', 'cubic'):
+            esat = EsatTable.shared(1 if esat == 'linear' else 3)
+        elif not (esat is None or isinstance(esat, EsatTable)):
+            raise ValueError("esat must be None, 'linear', 'cubic' or an EsatTable object.")
+        self._esat = esat
+        if esat is not None:
+            # The exact esatw formula (also used by Td2e) is as fast as the tables
+            self.T2esati = esat.T2esati
+            self.e2Td = esat.e2Td
+
         self._data = {}
         self._shape = None
         if data is not None:
@@ -165,9 +260,10 @@ class Thermo:
                                  (N_e, [N_Hui, N_esati], self.Hui_esati2e),
                                  (N_e, [N_rv, N_P], self.rv_P2e),
                                  (N_e, [N_qv, N_qt, N_P], self.qv_qt_P2e),
+                                 (N_e, [N_Td], self.Td2e),
                                  (N_Huw, [N_e, N_esatw], self.e_esatw2Huw),
                                  (N_Hui, [N_e, N_esati], self.e_esati2Hui),
-                                 (N_Td, [N_e], self.Td2e),
+                                 (N_Td, [N_e], self.e2Td),
                                  (N_R, [N_qv, N_qliquid, N_qice], self.qv_qliquid_qice2R),
                                  (N_Rstar, [N_rv], self.rv2Rstar),
                                  (N_qt, [N_qv, N_qliquid, N_qice], self.qv_qliquid_qice2qt),
@@ -187,12 +283,73 @@ class Thermo:
                                           (N_qice, qlist, self.q2qice),
                                           (N_rliquid, rlist, self.r2rliquid),
                                           (N_rice, rlist, self.r2rice)])
+        # The methods' table as seen by the planner (see :meth:`_plan`)
+        self._methods_table = tuple([(method[0], tuple(method[1])) for method in self._allKnownMethods])
 
     @property
     def hydrometeors(self):
         """The list of hydrometeors."""
         return self._hydrometeors
 
+    @property
+    def esat(self):
+        """The :class:`EsatTable` object in use (or ``None`` for the exact formulas)."""
+        return self._esat
+
+    @classmethod
+    def set_plans_cache(cls, maxsize=1024):
+        """Resize the cache of computation plans (for all :class:`Thermo` objects).
+
+        A plan is computed for each combination of methods table, available
+        parameters and requested parameter (see :meth:`plan`). The **maxsize**
+        most recently used plans are remembered (a bounded LRU cache is used).
+        The cache is disabled if **maxsize** is ``0`` or ``None``.
+        """
+        if maxsize:
+            plans = functools.lru_cache(maxsize=maxsize)(_methods_plan)
+        else:
+            plans = _methods_plan
+        Thermo._plans = staticmethod(plans)
+
+    @classmethod
+    def plans_cache_info(cls):
+        """Statistics on the cache of computation plans (see :meth:`set_plans_cache`).
+
+        Returns a :func:`functools.lru_cache` ``CacheInfo`` object (or ``None``
+        if the cache is disabled).
+        """
+        plans = Thermo._plans
+        return plans.cache_info() if hasattr(plans, 'cache_info') else None
+
+    def _plan(self, parameter, methods=None):
+        """Return the methods to call in order to compute **parameter** (see :func:`_methods_plan`)."""
+        if methods is None:
+            methods = self._allKnownMethods
+            table = self._methods_table
+        else:
+            table = tuple([(method[0], tuple(method[1])) for method in methods])
+        steps, success = self._plans(table, frozenset(self._data), parameter)
+        return [methods[i] for i in steps], success
+
+    def plan(self, parameter):
+        """The list of the (parameter, method's name) steps needed to compute **parameter**.
+
+        Example::
+
+            >>> data = Thermo(data={N_T: 280, N_P: 75000})
+            >>> data.plan(N_rsatw)
+            [('esatw', 'T2esatw'), ('rsatw', 'e_P2rv')]
+            >>> data.plan(N_rv)  # doctest: +IGNORE_EXCEPTION_DETAIL
+            Traceback (most recent call last):
+                ...
+            bronx.meteo.thermo.ThermoError: Parameter 'rv' cannot be computed.
+
+        """
+        steps, success = self._plan(parameter)
+        if not success:
+            raise ThermoError("Parameter '" + parameter + "' cannot be computed.")
+        return [(method[0], method[2].__name__) for method in steps]
+
     def _compute_new_T(self, target, precision):
         """
         This internal method computes the temperature obtained after exchanges
@@ -201,56 +358,57 @@ class Thermo:
 
         see the :meth:`evaporate` method for a description of **precision**
         """
-        T = self.get(N_T)
-        r = {s: self.get('r' + s) for s in self.hydrometeors}
         for s in self.hydrometeors:
             if s != 'v' and s not in target:
                 raise ValueError(str(s) + "must be in target.")
         assert 'v' not in target, 'v must not be in target'
+        return self._phase_change_T(self.get(N_T), {s: self.get('r' + s) for s in self.hydrometeors},
+                                    target, precision)
 
-        for i, s in enumerate(target):  # We loop over all the hydrometeors
-            if s in self._known_liquid_hydrometeors:
+    @classmethod
+    def _phase_change_T(cls, T, r, target, precision):
+        """
+        Vectorised kernel of :meth:`_compute_new_T`: **T** and the **r** mixing
+        ratios (dictionary indexed by hydrometeors) describe the initial state,
+        **target** gives the mixing ratios after the exchanges with vapour.
+
+        The contributions of all the species to Cph are gathered in a single
+        pass; then, since each transformation only moves water between the vapour
+        and one species, Cph is updated incrementally.
+        """
+        if precision not in ('full', 'standard'):
+            raise ValueError("Value of precision not known: " + str(precision))
+        rliquid = 0.
+        rsolid = 0.
+        for k, v in r.items():
+            if k == 'v':
+                pass
+            elif k in cls._known_liquid_hydrometeors:
+                rliquid = rliquid + v
+            elif k in cls._known_solid_hydrometeors:
+                rsolid = rsolid + v
+            else:
+                raise ValueError("Specie '" + str(k) + "' not known.")
+        Cph = csts.Cpd + csts.Cpv * r['v'] + csts.Cl * rliquid + csts.Ci * rsolid
+        T_init = T
+        for s in target:  # We loop over all the hydrometeors
+            if s in cls._known_liquid_hydrometeors:
                 Cx = csts.Cl
                 L0 = csts.Lv0
-            elif s in self._known_solid_hydrometeors:
+            elif s in cls._known_solid_hydrometeors:
                 Cx = csts.Ci
                 L0 = csts.Ls0
             else:
                 raise ValueError("Specie '" + str(s) + "' not known.")
-            if i == 0 or precision == 'full':
-                L_before = L0 + (csts.Cpv - Cx) * (T - csts.T0)
-                Cph_before = csts.Cpd + csts.Cpv * r['v']
-                Cph_after = csts.Cpd + csts.Cpv * (r['v'] + r[s] - target[s])
-                for k, v in r.iteritems():
-                    if k == 'v':
-                        pass
-                    elif k in self._known_liquid_hydrometeors:
-                        Cph_before += v * csts.Cl
-                        if k == s:
-                            Cph_after += target[s] * csts.Cl
-                        else:
-                            Cph_after += v * csts.Cl
-                    elif k in self._known_solid_hydrometeors:
-                        Cph_before += v * csts.Ci
-                        if k == s:
-                            Cph_after += target[s] * csts.Ci
-                        else:
-                            Cph_after += v * csts.Ci
-                    else:
-                        raise ValueError("Specie '" + str(k) + "' not known.")
-            elif precision != 'full':
-                L_before = L0 + (csts.Cpv - Cx) * (self.get(N_T) - csts.T0)
             if precision == 'standard':
                 # Explicit calcul, L and Cph are assumed to be constant during the transformation
                 # (they are taken equal to their initial values)
-                T = T + L_before * (target[s] - r[s]) / Cph_before
-            elif precision == 'full':
-                # Cp dT = Lv dqv integrated on the transformation. We have L+/L-=Cp-/Cp+
-                T = Cph_before / Cph_after * (L0 / (csts.Cpv - Cx) - csts.T0 + T) + csts.T0 - L0 / (csts.Cpv - Cx)
+                T = T + (L0 + (csts.Cpv - Cx) * (T_init - csts.T0)) * (target[s] - r[s]) / Cph
             else:
-                raise ValueError("Value of precision not known: " + str(precision))
-            r['v'] = r['v'] + r[s] - target[s]
-            r[s] = target[s]
+                # Cp dT = Lv dqv integrated on the transformation. We have L+/L-=Cp-/Cp+
+                Cph_after = Cph + (csts.Cpv - Cx) * (r[s] - target[s])
+                T = Cph / Cph_after * (L0 / (csts.Cpv - Cx) - csts.T0 + T) + csts.T0 - L0 / (csts.Cpv - Cx)
+                Cph = Cph_after
         return T
 
     def evaporate(self, species, extra_variables=(), precision='full'):
@@ -273,7 +431,7 @@ class Thermo:
               constant during evaporation
 
         """
-        result = self.__class__(hydrometeors=self.hydrometeors)
+        result = self.__class__(hydrometeors=self.hydrometeors, esat=self._esat)
         target = {s: self.get('r' + s) * (0. if s in species else 1.)
                   for s in [k for k in self.hydrometeors if k != 'v']}
         T = self._compute_new_T(target, precision)
@@ -289,7 +447,8 @@ class Thermo:
 
         return result
 
-    def adjust(self, species, mix_rule=None, iteration=1, extra_variables=(), precision='full'):
+    def adjust(self, species, mix_rule=None, iteration=1, extra_variables=(), precision='full',
+               tolerance=None):
         """
         This method returns a :class:`Thermo` instance in which **species** are
         adjusted with respect to water vapour (others are kept untouched).
@@ -310,7 +469,10 @@ class Thermo:
 
         Liquid/ice fraction is used to compute a weight-averaged saturation mixing
         ratio. Adjustment is an iterative process, **iteration** gives the number of
-        iteration we must perform.
+        iteration we must perform. If **tolerance** is given, **iteration** is only
+        a maximum: a point is left untouched as soon as the amount of water it
+        exchanges during an iteration is below **tolerance** (kg/kg), and
+        subsequent iterations are only performed on the remaining points.
 
         Only T and mixing ratios are set in the new object unless **extra_variables**
         is set. **extra_variables** is a list of variables to get from the
@@ -335,55 +497,77 @@ class Thermo:
             assert mix_rule in ['same', '0T-20'], "mix_rule must be 'same' or '0T-20'"
         else:
             raise ValueError("species can only contain 'c' and/or 'i'.")
-
-        tempo = self.__class__(hydrometeors=self.hydrometeors)
-        for var in [N_T, N_P] + ['r' + s for s in self.hydrometeors]:
-            tempo.set(var, self.get(var))
-
+        if precision not in ('full', 'standard'):
+            raise ValueError("Value of precision not known: " + str(precision))
+
+        # Flat working copies of the state (updated in place)
+        names = [N_T, N_P] + ['r' + s for s in self.hydrometeors]
+        shape = np.shape(self.get(N_T))
+        state = {var: np.array(np.broadcast_to(self.get(var), shape),
+                               dtype=np.result_type(self.get(var), 1.)).reshape(-1)
+                 for var in names}
+        rt = np.reshape(np.broadcast_to(self.get(N_rt), shape), -1)
+        condensates = [k for k in self.hydrometeors if k != 'v']
+
+        active = None  # All the points
         for myiter in range(iteration):
+            current = {var: (state[var] if active is None else state[var][active]) for var in names}
+            T = current[N_T]
             if species == ['c']:
                 ice_fraction = 0.
-                cond = tempo.get(N_rc)
-                rsat = tempo.get(N_rsatw)
+                cond = current[N_rc]
+                rsat = self.e_P2rv(self.T2esatw(T), current[N_P])
             elif species == ['i']:
                 ice_fraction = 1.
-                cond = tempo.get(N_ri)
-                rsat = tempo.get(N_rsati)
-            elif set(species) == {'c', 'i'}:
+                cond = current[N_ri]
+                rsat = self.e_P2rv(self.T2esati(T), current[N_P])
+            else:
                 if mix_rule == 'same':
-                    ice_fraction = np.where(tempo.get(N_rc) + tempo.get(N_ri) > 0.,
-                                            tempo.get(N_ri) / (tempo.get(N_rc) + tempo.get(N_ri)), 0.)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        ice_fraction = np.where(current[N_rc] + current[N_ri] > 0.,
+                                                current[N_ri] / (current[N_rc] + current[N_ri]), 0.)
                 else:
-                    ice_fraction = (csts.T0 - tempo.get(N_T)) / 20.
+                    ice_fraction = (csts.T0 - T) / 20.
                     ice_fraction = np.maximum(0., np.minimum(1, ice_fraction))
-                cond = tempo.get(N_rc) + tempo.get(N_ri)
-                rsat = ice_fraction * tempo.get(N_rsati) + (1. - ice_fraction) * tempo.get(N_rsatw)
-            else:
-                raise ValueError("species can only contain 'c' and/or 'i'.")
-
-            diff = np.maximum(-cond, tempo.get(N_rv) - rsat)  # if rv>rsat, diff is the part of rv that we
-            #                                                               must condensate on cloud
-            #                                                   if rv<rsat, diff is the content we must take
-            #                                                               to cloud to put it back to vapor
-            #                                                               (hence the maximum)
+                cond = current[N_rc] + current[N_ri]
+                rsat = (ice_fraction * self.e_P2rv(self.T2esati(T), current[N_P]) +
+                        (1. - ice_fraction) * self.e_P2rv(self.T2esatw(T), current[N_P]))
+
+            diff = np.maximum(-cond, current[N_rv] - rsat)  # if rv>rsat, diff is the part of rv that we
+            #                                                             must condensate on cloud
+            #                                                 if rv<rsat, diff is the content we must take
+            #                                                             to cloud to put it back to vapor
+            #                                                             (hence the maximum)
             cond = cond + 0.8 * diff  # Tuning factor to limit oscilations and non-convergence
-            target = {s: (tempo.get('r' + s)
+            target = {s: (current['r' + s]
                           if s not in species else cond * (ice_fraction if s == 'i' else (1 - ice_fraction)))
-                      for s in [k for k in tempo.hydrometeors if k != 'v']}
-            T = tempo._compute_new_T(target, precision)
-
-            result = self.__class__(hydrometeors=self.hydrometeors)
-            rv = self.get(N_rt)
+                      for s in condensates}
+            T = self._phase_change_T(T, {s: current['r' + s] for s in self.hydrometeors}, target, precision)
+            rv = rt if active is None else rt[active]
             for s in target:
-                result.set('r' + s, target[s])
                 rv = rv - target[s]
-            result.set(N_T, T)
-            result.set(N_rv, rv)
-
-            for var in extra_variables + ([N_P] if myiter < iteration - 1 else []):
-                result.set(var, self.get(var))
 
-            tempo = result  # in case of other iteration
+            updates = dict([(N_T, T), (N_rv, rv)] + [('r' + s, target[s]) for s in species])
+            if active is None:
+                state.update(updates)
+            else:
+                for var, value in updates.items():
+                    state[var][active] = value
+
+            if tolerance is not None:
+                # Convergence tracking: only unconverged points are dealt with afterwards
+                unconverged = np.abs(0.8 * diff) > tolerance
+                active = (np.flatnonzero(unconverged) if active is None else active[unconverged])
+                logger.debug('adjust: %d unconverged points after iteration %d', active.size, myiter + 1)
+                if not active.size:
+                    break
+
+        result = self.__class__(hydrometeors=self.hydrometeors, esat=self._esat)
+        for var in names[2:] + [N_T]:
+            value = np.asarray(state[var])
+            result.set(var, value[0] if not shape else value.reshape(shape))
+        for var in extra_variables:
+            result.set(var, self.get(var))
 
         return result
 
@@ -393,7 +577,7 @@ class Thermo:
 
     def set(self, parameter, value):
         """Sets or updates a value for parameter."""
-        valueShape = (1,) if not isinstance(value, np.ndarray) else value.shape
+        valueShape = value.shape if _is_arraylike(value) else (1,)
         if self._shape is None:
             self._shape = valueShape
         assert self._shape == valueShape, "All values must have the same shape"
@@ -408,34 +592,101 @@ class Thermo:
             self.set(param, self.get(param)[p])
 
     def get(self, parameter, methods=None):
-        """Gets or computes a value for parameter"""
+        """Gets or computes a value for parameter
+
+        The sequence of methods that need to be called is computed once for a
+        given set of available parameters (see :meth:`plan`).
+        """
         if parameter not in self._data:
             # To allow a better result, one must begin by the more accurate methods
-            listOfMethods = methods if methods is not None else self._allKnownMethods
-            for iMethod, method in enumerate(listOfMethods):
-                if parameter not in self._data and method[0] == parameter:
-                    # We try to call this method.
-                    # To prevent cyclic calls, we give it the remaining available methods
-                    # (excluding recursively the current one)
-                    m = list(listOfMethods)
-                    m.pop(iMethod)
-                    try:
-                        logger.debug("Trying to call " + method[2].__name__)
-                        args = []
-                        for dep in method[1]:
-                            logger.debug("Trying to obtain " + dep + " for calling " + method[2].__name__)
-                            args.append(self.get(dep, m))
-                            logger.debug(dep + " obtained for calling " + method[2].__name__)
-                        logger.debug(parameter + " is computed by " + method[2].__name__)
-                        self._data[parameter] = method[2](*list(args))
-                    except ThermoError:
-                        logger.debug("Call to " + method[2].__name__ + " not possible")
-                        pass
+            steps, _ = self._plan(parameter, methods)
+            for output, inputs, method in steps:
+                logger.debug(output + " is computed by " + method.__name__)
+                self._data[output] = method(*[self._data[dep] for dep in inputs])
         if parameter in self._data:
             return self._data[parameter]
         else:
             raise ThermoError("Parameter '" + parameter + "' is not set and cannot be computed.")
 
+    def get_chunked(self, parameter, chunksize=262144, out=None, executor=None):
+        """Computes a value for parameter block by block.
+
+        Only the blocks of the input parameters that are needed (see
+        :meth:`plan`) are read and intermediate parameters are computed (and
+        then discarded) block by block: the memory footprint is limited to a
+        few blocks whatever the size of the inputs. Consequently, input
+        parameters may be memory-mapped arrays (e.g. :class:`numpy.memmap`)
+        or netCDF4 variables.
+
+        The result is identical to the one of :meth:`get`. It is stored in
+        the present object (but the intermediate parameters are not).
+
+        :param str parameter: The parameter to compute
+        :param int chunksize: The approximate number of points in each block
+            (blocks are made of rows along the first axis)
+        :param out: An array where the result is written (it may be a
+            :class:`numpy.memmap` object). By default, a new array is created.
+        :param executor: A :class:`concurrent.futures.Executor` object (a
+            thread or process pool) used to compute the blocks concurrently.
+            If ``None``, the blocks are computed sequentially.
+
+        Example::
+
+            >>> data = Thermo(data={N_T: np.linspace(260., 300., 1000),
+            ...                     N_P: np.linspace(50000., 100000., 1000)})
+            >>> esat = data.get_chunked(N_rsatw, chunksize=100)
+            >>> data2 = Thermo(data={N_T: np.linspace(260., 300., 1000),
+            ...                      N_P: np.linspace(50000., 100000., 1000)})
+            >>> bool(np.array_equal(esat, data2.get(N_rsatw)))
+            True
+
+        """
+        if parameter in self._data:
+            return self._data[parameter]
+        isteps, success = self._plans(self._methods_table, frozenset(self._data), parameter)
+        if not success:
+            raise ThermoError("Parameter '" + parameter + "' is not set and cannot be computed.")
+        # The same steps will be executed on each block (see _chunk_get)
+        steps = [self._allKnownMethods[i] for i in isteps]
+        produced = {step[0] for step in steps}
+        inputs = {dep: self._data[dep] for step in steps for dep in step[1] if dep not in produced}
+        shape = self._shape
+        if not shape or not any(_is_arraylike(value) for value in inputs.values()):
+            # Scalars or 0-d arrays: there is nothing to split
+            return self.get(parameter)
+        rowsize = int(np.prod(shape[1:], dtype=np.int64))
+        nrows = max(1, chunksize // max(1, rowsize))
+        slices = [slice(start, min(start + nrows, shape[0])) for start in range(0, shape[0], nrows)]
+
+        def _chunk_data(chunk):
+            return {dep: value[chunk] if _is_arraylike(value) else value for dep, value in inputs.items()}
+
+        def _store(chunk, result, out):
+            if out is None:
+                out = np.empty(shape, dtype=np.asarray(result).dtype)
+            out[chunk] = result
+            return out
+
+        if executor is None:
+            for chunk in slices:
+                out = _store(chunk, _chunk_get(self.__class__, self._hydrometeors, self._esat,
+                                               _chunk_data(chunk), isteps, parameter), out)
+        else:
+            # Limit the number of pending blocks (to preserve memory)
+            maxpending = 2 * (os.cpu_count() or 1)
+            pending = collections.deque()
+            for chunk in slices:
+                pending.append((chunk, executor.submit(_chunk_get, self.__class__, self._hydrometeors, self._esat,
+                                                       _chunk_data(chunk), isteps, parameter)))
+                if len(pending) >= maxpending:
+                    chunk, future = pending.popleft()
+                    out = _store(chunk, future.result(), out)
+            while pending:
+                chunk, future = pending.popleft()
+                out = _store(chunk, future.result(), out)
+        self._data[parameter] = out
+        return out
+
     # Thermodynamic functions ######################################################
 
     @staticmethod
@@ -444,6 +695,17 @@ class Thermo:
         # By definition Td is computed over liquid water (Tf -frost temperature- is computed over ice)
         return Thermo.T_phase2esat(Td, 'L')
 
+    @staticmethod
+    def e2Td(e):
+        """Computes Td from e (using Newton's method to invert :meth:`Td2e`)"""
+        u = np.log(e)
+        # First guess: the gamw term is evaluated at the triple point temperature
+        Td = csts.betaw / (csts.alpw - csts.gamw * np.log(csts.T0) - u)
+        for _ in range(5):
+            Td = Td - ((csts.alpw - csts.betaw / Td - csts.gamw * np.log(Td) - u) /
+                       (csts.betaw / Td ** 2 - csts.gamw / Td))
+        return Td
+
     @staticmethod
     def T_P2Theta(T, P):
         """Computes Theta from T and P."""
@@ -640,6 +902,249 @@ class Thermo:
         return csts.Cpd + csts.Cpv * rv + csts.Cl * rliquid + csts.Ci * rice
 
 
+def _hermite_coefs(order, f0, f1, d0, d1):
+    """Coefficients (in increasing powers of s) of the polynomials that interpolate f on [0, 1].
+
+    **f0**, **f1** are the values at s=0 and s=1, **d0**, **d1** the
+    derivatives (only used for cubic Hermite interpolation).
+    """
+    if order == 1:
+        return (f0, f1 - f0)
+    else:
+        return (f0, d0, 3. * (f1 - f0) - 2. * d0 - d1, 2. * (f0 - f1) + d0 + d1)
+
+
+def _table_eval(table, values, exact, transform=None):
+    """Evaluate a piecewise polynomial **table** at **values**.
+
+    **table** is a ``(top, step, coefs)`` tuple: the k-th interval is
+    ``]top - (k + 1) * step, top - k * step]`` and ``coefs[i][k]`` is the
+    coefficient of ``s ** i`` where ``s = (top - x) / step - k``. Values are
+    processed by blocks that fit in the processor's cache. The **exact**
+    function is called for the values that fall outside of the table.
+    """
+    top, step, coefs = table
+    values = np.asarray(values)
+    if values.ndim == 0 or not values.size:
+        return exact(values)
+    flat = values.reshape(-1)
+    # Bounds of the table (x in [0, n[)
+    low = top - step * len(coefs[0])
+    if transform is not None:
+        low, top = np.exp(low), np.exp(top)
+    if not (flat.min() > low and flat.max() <= top):
+        # Some values are out of range (or NaNs)
+        inside = (flat > low) & (flat <= top)
+        out = np.empty(flat.shape, dtype=np.float64)
+        out[~inside] = exact(flat[~inside])
+        if inside.any():
+            out[inside] = _table_eval(table, flat[inside], exact, transform)
+        return out.reshape(values.shape)
+    top = table[0]
+    inv_step = 1. / step
+    out = np.empty(flat.shape, dtype=np.float64)
+    for start in range(0, flat.size, EsatTable.BLOCKSIZE):
+        v = flat[start:start + EsatTable.BLOCKSIZE]
+        o = out[start:start + EsatTable.BLOCKSIZE]
+        x = np.subtract(top, v if transform is None else transform(v), dtype=np.float64)
+        x *= inv_step
+        k = x.astype(np.intp)
+        x -= k
+        # mode='clip' deals with rounding errors near the bounds
+        coefs[-1].take(k, out=o, mode='clip')
+        for c in coefs[-2::-1]:
+            o *= x
+            o += c.take(k, mode='clip')
+    return out.reshape(values.shape)
+
+
+class EsatTable:
+    """Tabulated saturation vapour pressures (an alternative to the exact formulas).
+
+    The saturation vapour pressure over liquid water and over ice (see
+    :meth:`Thermo.T_phase2esat`), and the dew point temperature as a function of
+    the water vapour pressure (see :meth:`Thermo.e2Td`), are tabulated and
+    interpolated (piecewise linear or cubic Hermite polynomials). Such an
+    object can be given to the :class:`Thermo` constructor (**esat**
+    argument): the derived parameters (esati, rsati, Hui, Td, ...) are then
+    computed with the tables. Since the exact formula for the saturation
+    vapour pressure over liquid water is a single exponential, interpolating
+    it is not faster: :class:`Thermo` objects keep on using the exact formula
+    (the :meth:`T2esatw` and :meth:`Td2e` methods are still provided).
+
+    The steps of the tables are powers of two and the temperature grid
+    contains the 273.15K node where the ice formula switches to the liquid
+    water one. The steps are halved until the relative interpolation error
+    is below **rtol** over the whole temperature range. The interpolation
+    error of each interval is estimated at its middle (where it is maximal),
+    then a safety factor of 2 (that accounts for the variation of the
+    derivatives within each interval) and a few rounding errors are added. The
+    resulting bounds are available in the :attr:`error_bounds` dictionary.
+    Values outside the table are computed with the exact formulas.
+
+    Example::
+
+        >>> table = EsatTable(order=3, rtol=1e-8)
+        >>> T = np.array([250., 280., 300.])
+        >>> bool(np.all(np.abs(table.T2esatw(T) / Thermo.T2esatw(T) - 1.) <= table.error_bounds['esatw']))
+        True
+        >>> print(' '.join(['{:.3f}'.format(t) for t in table.e2Td(table.T2esatw(T))]))
+        250.000 280.000 300.000
+
+    """
+
+    #: Number of values processed at once
+    BLOCKSIZE = 8192
+
+    #: The maximum number of nodes in a table
+    MAX_NODES = 2 ** 21
+
+    _ICE_SWITCH = 273.15
+
+    def __init__(self, order=1, rtol=1e-6, tmin=150., tmax=350.):
+        """
+        :param order: 1 for piecewise linear interpolation or 3 for cubic
+            Hermite interpolation.
+        :param rtol: The maximum relative error of the interpolated values. A
+            :class:`ValueError` is raised if it cannot be reached because of
+            rounding errors or of the tables' size limit (see
+            :attr:`MAX_NODES`). With the default temperature range, the
+            practical limits are ~3e-10 for linear interpolation and ~1e-13
+            for cubic Hermite interpolation.
+        :param tmin: The lowest temperature (in K) in the tables.
+        :param tmax: The highest temperature (in K) in the tables.
+        """
+        if order not in (1, 3):
+            raise ValueError("order must be 1 or 3.")
+        if not 0. < rtol < 1.:
+            raise ValueError("rtol must be between 0 and 1.")
+        if not 0. < tmin < self._ICE_SWITCH < tmax <= 500.:
+            raise ValueError("The temperature range must include {:.2f}K (and tmax <= 500K)."
+                             .format(self._ICE_SWITCH))
+        self._order = order
+        self._rtol = rtol
+        self._trange = (tmin, tmax)
+        self._shared = None
+        self.error_bounds = dict()
+        self._esatw = self._build('esatw', tmax - tmin, self._temperature_table, self._esatw_nodes,
+                                  Thermo.T2esatw)
+        self._esati = self._build('esati', tmax - tmin, self._temperature_table, self._esati_nodes,
+                                  Thermo.T2esati)
+        umin, umax = np.log(Thermo.T2esatw(np.array([tmin, tmax])))
+        self._td = self._build('Td', umax - umin, functools.partial(self._logpressure_table, umax, umin),
+                               self._td_nodes, Thermo.e2Td, transform=np.log)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def shared(cls, order):
+        """Return a default table of the given **order** (that is built only once)."""
+        table = cls(order=order)
+        table._shared = order
+        return table
+
+    def __reduce__(self):
+        if self._shared is not None:
+            return (self.__class__.shared, (self._shared, ))
+        return super().__reduce__()
+
+    @property
+    def order(self):
+        """The interpolation order (1 or 3)."""
+        return self._order
+
+    @property
+    def rtol(self):
+        """The requested relative accuracy."""
+        return self._rtol
+
+    def __repr__(self):
+        return '<{:s} | order={:d} rtol={:g} T=[{:g}, {:g}]K sizes={:s}>'.format(
+            self.__class__.__name__, self._order, self._rtol, self._trange[0], self._trange[1],
+            '/'.join([str(len(t[2][0])) for t in (self._esatw, self._esati, self._td)]))
+
+    def _temperature_table(self, step):
+        """Temperature grid anchored on the 273.15K node."""
+        top = self._ICE_SWITCH + step * np.ceil((self._trange[1] - self._ICE_SWITCH) / step)
+        n = int(np.ceil((top - self._trange[0]) / step))
+        return top, top - step * np.arange(n + 1)
+
+    @staticmethod
+    def _logpressure_table(utop, umin, step):
+        """Regular grid of water vapour pressure logarithms."""
+        top = step * np.ceil(utop / step)
+        n = int(np.ceil((top - umin) / step))
+        return top, top - step * np.arange(n + 1)
+
+    def _esatw_nodes(self, nodes, step):
+        f = np.exp(csts.alpw - csts.betaw / nodes - csts.gamw * np.log(nodes))
+        d = - step * f * (csts.betaw / nodes ** 2 - csts.gamw / nodes)
+        return f[:-1], f[1:], d[:-1], d[1:]
+
+    def _esati_nodes(self, nodes, step):
+        f0, f1, d0, d1 = self._esatw_nodes(nodes, step)
+        fi = np.exp(csts.alpi - csts.betai / nodes - csts.gami * np.log(nodes))
+        di = - step * fi * (csts.betai / nodes ** 2 - csts.gami / nodes)
+        # Intervals below the 273.15K node use the ice formula
+        ice = nodes[1:] < self._ICE_SWITCH
+        return (np.where(ice, fi[:-1], f0), np.where(ice, fi[1:], f1),
+                np.where(ice, di[:-1], d0), np.where(ice, di[1:], d1))
+
+    def _td_nodes(self, nodes, step):
+        Td = Thermo.e2Td(np.exp(nodes))
+        d = - step / (csts.betaw / Td ** 2 - csts.gamw / Td)
+        return Td[:-1], Td[1:], d[:-1], d[1:]
+
+    def _build(self, name, span, grid, nodes_values, exact, transform=None):
+        """Halve the step until the error bound is below rtol.
+
+        A :class:`ValueError` is raised if rounding errors prevent the error
+        bound from decreasing before rtol is reached, or if the grid would
+        exceed :attr:`MAX_NODES` (the grids cover **span** plus at most two
+        steps).
+        """
+        step = 1.
+        previous = np.inf
+        while True:
+            if span / step + 3 > self.MAX_NODES:
+                raise ValueError("rtol={:g} cannot be reached for {:s} with less than {:d} nodes "
+                                 .format(self._rtol, name, self.MAX_NODES) +
+                                 "(the best error bound is {:g}).".format(previous))
+            top, nodes = grid(step)
+            table = (top, step, _hermite_coefs(self._order, *nodes_values(nodes, step)))
+            # Evaluate at the middle of each interval
+            middle = (nodes[:-1] + nodes[1:]) / 2.
+            if transform is not None:
+                middle = np.exp(middle)
+            ref = exact(middle)
+            error = np.max(np.abs(_table_eval(table, middle, exact, transform) / ref - 1.))
+            bound = 2. * error + 4. * np.finfo(np.float64).eps
+            if bound <= self._rtol:
+                self.error_bounds[name] = bound
+                return table
+            # The error should be divided by 4 (linear) or 16 (cubic)
+            if bound > previous / 2.:
+                raise ValueError("rtol={:g} cannot be reached for {:s} (the best error bound is {:g})."
+                                 .format(self._rtol, name, min(bound, previous)))
+            previous = bound
+            step /= 2.
+
+    def T2esatw(self, T):
+        """Computes the water vapor pressure at saturation with respect to liquid water from T"""
+        return _table_eval(self._esatw, T, Thermo.T2esatw)
+
+    def T2esati(self, T):
+        """Computes the water vapor pressure at saturation with respect to ice from T"""
+        return _table_eval(self._esati, T, Thermo.T2esati)
+
+    def Td2e(self, Td):
+        """Computes e from Td"""
+        return _table_eval(self._esatw, Td, Thermo.Td2e)
+
+    def e2Td(self, e):
+        """Computes Td from e"""
+        return _table_eval(self._td, e, Thermo.e2Td, transform=np.log)
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
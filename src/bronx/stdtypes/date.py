@@ -39,18 +39,33 @@ Formats hypothesis:
 
 """
 
+import bisect
 import calendar
 import datetime
 import functools
+import heapq
 import inspect
+import itertools
+import math
 import operator
 import re
 
 from bronx.syntax.decorators import secure_getattr
+from bronx.syntax.externalcode import ExternalCodeImportChecker
 
 #: No automatic export
 __all__ = []
 
+npchecker = ExternalCodeImportChecker('numpy')
+with npchecker as npregister:
+    import numpy as np
+    npregister.update(version=np.__version__)
+
+#: The resolution of NumPy's datetime64 and timedelta64 data (see :class:`DateArray`)
+_NP_UNIT = 'us'
+_NP_DATE_DTYPE = 'M8[' + _NP_UNIT + ']'
+_NP_PERIOD_DTYPE = 'm8[' + _NP_UNIT + ']'
+
 
 def today():
     """Return the date of the day, at 0 hour, 0 minute."""
@@ -182,6 +197,42 @@ def mkisodate(datestr):
     return ''.join(ldate)
 
 
+#: Fixed-width ISO 8601 dates (e.g. 2017-01-01, 2017-01-01T12:00 or 2017-01-01T12:00:00Z)
+_ISO_DATE_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})(?:T(\d{2}):(\d{2})(?::(\d{2}))?Z?)?$')
+
+#: The length of fixed-width compact dates (yyyymmdd[hh[mn[ss]]])
+_COMPACT_DATE_LENGTHS = frozenset((8, 10, 12, 14))
+
+
+def _date_string_fields(datestr, year=None):
+    """Convert the ``datestr`` string into a tuple of :class:`datetime.datetime` fields.
+
+    Compact (yyyymmdd[hh[mn[ss]]]) and canonical ISO 8601 strings are processed
+    directly. Otherwise, the string is reshaped using :func:`mkisodate` (and
+    the eventual time deltas are taken into account).
+
+    :param str datestr: The string to convert
+    :param int year: The year used to replace a leading YYYY (if omitted, the
+                     current year is used)
+    """
+    if len(datestr) in _COMPACT_DATE_LENGTHS and datestr.isdigit() and datestr.isascii():
+        return ((int(datestr[0:4]), int(datestr[4:6]), int(datestr[6:8])) +
+                tuple([int(datestr[i:i + 2]) for i in range(8, len(datestr), 2)]))
+    isomatch = _ISO_DATE_RE.match(datestr)
+    if isomatch:
+        return tuple([int(x) for x in isomatch.groups() if x is not None])
+    s_top = datestr.split('/')
+    top = s_top[0].upper()
+    if top.startswith('YYYY'):
+        top = str(max(0, int(today().year if year is None else year))) + top[4:]
+    ld = [int(x) for x in re.split('[-:HTZ]+', mkisodate(top)) if re.match(r'\d+$', x)]
+    if ld and len(s_top) > 1:
+        delta = sum([Period(d) for d in s_top[1:]], Period(0))
+        dt = datetime.datetime(*ld) + datetime.timedelta(delta.days, delta.seconds)
+        ld = [dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second]
+    return tuple(ld)
+
+
 def stardates():
     """Nice dump of predefined dates functions."""
     for k, v in sorted(local_date_functions.items()):
@@ -243,18 +294,24 @@ def daterange(start, end=None, step='P1D'):
     if step.total_seconds() < 0:
         step = Period(step.length)
 
-    rollingdate = start
-    while rollingdate <= end:
+    # Compare epochs (same result as Date comparisons but much cheaper)
+    rollingdate, endepoch = start, end.epoch
+    while rollingdate.epoch <= endepoch:
         yield rollingdate
         rollingdate += step
 
 
-def daterangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
+def daterangex(start, end=None, step=None, shift=None, fmt=None, prefix=None, asarray=False):
     """Extended date range expansion (returns a list).
 
     Except when ``fmt`` or ``prefix`` are specified, a list of :class:`Date`
     objects is returned.
 
+    If ``asarray`` is *True*, a :class:`DateArray` object is returned instead
+    of a list (the range is computed using NumPy and no :class:`Date` object
+    is created): it can not be combined with ``fmt`` or ``prefix`` (but the
+    :class:`DateArray` object provides vectorised formatting accessors).
+
     :func:`daterangex` accepts many arguments combinations::
 
         >>> daterangex('2017010100', '2017013100', 'P14D')
@@ -308,8 +365,67 @@ def daterangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
          ...'loop2017060100', ...'loop2017061500', ...'loop2017062900', ...'loop2017122500']
 
     """
+    if asarray and (fmt is not None or prefix is not None):
+        raise ValueError("The 'asarray' option can not be combined with 'fmt' or 'prefix'")
+
     rangevalues = list()
 
+    if fmt is not None and fmt.startswith('%'):
+        fmt = '{0:' + fmt[1:] + '}'
+    formatter = _rangex_formatter(fmt, prefix)
+
+    for realstart, realend, realstep in _daterangex_subranges(start, end, step, shift):
+
+        if asarray:
+            rangevalues.append(DateArray.range(realstart, realend, realstep))
+            continue
+
+        pvalues = daterange(realstart, realend, realstep)
+
+        if formatter is not None:
+            pvalues = [formatter(x, i) for i, x in enumerate(pvalues)]
+
+        rangevalues.extend(pvalues)
+
+    if asarray:
+        return DateArray.concatenate(rangevalues).uniq()
+    return sorted(set(rangevalues))
+
+
+def idaterangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
+    """Extended date range expansion (lazy version of :func:`daterangex`).
+
+    The arguments are the same as for :func:`daterangex` but a generator is
+    returned: the various sub-ranges are merged on the fly and duplicates are
+    dropped. Consequently, the first value is available immediately and the
+    memory footprint does not depend on the length of the range::
+
+        >>> idaterangex('2017010100-2017013100-P14D,2017011500')  # doctest: +ELLIPSIS
+        <generator object idaterangex at 0x...>
+        >>> list(idaterangex('2017010100-2017013100-P14D,2017011500'))
+        [Date(2017, 1, 1, 0, 0), Date(2017, 1, 15, 0, 0), Date(2017, 1, 29, 0, 0)]
+        >>> list(idaterangex('2017010100-2017013100-P14D,2017011500', fmt='ymdh', prefix='loop'))
+        ['loop2017010100', 'loop2017011500', 'loop2017012900']
+
+    Values are always yielded in chronological order and duplicates are
+    looked for among consecutive values. Consequently, the result only differs
+    from :func:`daterangex`'s one when the formatted strings do not sort like
+    the dates they represent (e.g. when the ``{1:d}`` counter is used in the
+    ``fmt`` format string or when the year is not part of the string).
+    """
+    if fmt is not None and fmt.startswith('%'):
+        fmt = '{0:' + fmt[1:] + '}'
+    formatter = _rangex_formatter(fmt, prefix)
+    yield from _rangex_merge([((x.epoch, x) for x in daterange(realstart, realend, realstep))
+                              for realstart, realend, realstep in _daterangex_subranges(start, end, step, shift)],
+                             formatter)
+
+
+def _daterangex_subranges(start, end=None, step=None, shift=None):
+    """Split and parse a :func:`daterangex` range definition.
+
+    :return: A generator of (start, end, step) tuples (one per sub-range).
+    """
     pstarts = ([str(s) for s in start]
                if isinstance(start, (list, tuple)) else str(start).split(','))
 
@@ -336,35 +452,60 @@ def daterangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
             realstart += realshift
             realend += realshift
 
-        pvalues = daterange(realstart, realend, realstep)
+        yield realstart, realend, realstep
 
-        if pvalues:
 
-            if fmt is not None:
-                if fmt.startswith('%'):
-                    fmt = '{0:' + fmt[1:] + '}'
-                if '{' in fmt and '}' in fmt:
-                    pvalues = [fmt.format(x, i + 1, type(x).__name__)
-                               for i, x in enumerate(pvalues)]
-                else:
-                    pvalues = [getattr(x, fmt) for x in pvalues]
-                    if callable(pvalues[0]):
-                        pvalues = [x() for x in pvalues]
+def _rangex_formatter(fmt=None, prefix=None):
+    """Return a function that formats the i-th item of a range (``None`` if no formatting is requested)."""
+    if fmt is None and prefix is None:
+        return None
 
-            if prefix is not None:
-                pvalues = [prefix + str(x) for x in pvalues]
+    def formatter(x, i):
+        if fmt is not None:
+            if '{' in fmt and '}' in fmt:
+                x = fmt.format(x, i + 1, type(x).__name__)
+            else:
+                x = getattr(x, fmt)
+                if callable(x):
+                    x = x()
+        if prefix is not None:
+            x = prefix + str(x)
+        return x
 
-        rangevalues.extend(pvalues)
+    return formatter
 
-    return sorted(set(rangevalues))
 
+def _rangex_merge(subranges, formatter=None):
+    """Lazily merge the sorted sub-ranges of a range expansion, dropping duplicates.
+
+    :param subranges: A list of iterables of (sortkey, item) tuples (each of
+                      them sorted according to *sortkey*).
+    :param formatter: A function that formats each item (see :func:`_rangex_formatter`).
 
-def timerangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
+    When no *formatter* is provided, duplicates are detected using *sortkey*,
+    otherwise the formatted values are compared.
+    """
+    if formatter is not None:
+        subranges = [((sortkey, formatter(x, i)) for i, (sortkey, x) in enumerate(subrange))
+                     for subrange in subranges]
+    last = sentinel = object()
+    for sortkey, x in heapq.merge(*subranges, key=operator.itemgetter(0)):
+        token = sortkey if formatter is None else x
+        if last is sentinel or token != last:
+            last = token
+            yield x
+
+
+def timerangex(start, end=None, step=None, shift=None, fmt=None, prefix=None, asarray=False):
     """Extended time range expansion (returns a list).
 
     Except when ``fmt`` or ``prefix`` are specified, a list of :class:`Time`
     objects is returned.
 
+    If ``asarray`` is *True*, a :class:`PeriodArray` object is returned instead
+    of a list (the range is computed using NumPy and no :class:`Time` object
+    is created): it can not be combined with ``fmt`` or ``prefix``.
+
     When ``start`` is already a complex definition (as a string), ``end`` and
     ``step`` only apply as default when the sub-definition in ``start`` does not
     contain any ``end`` or ``step`` value.
@@ -408,12 +549,71 @@ def timerangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
         [Time(0, 0), Time(3, 0), Time(6, 0), Time(9, 0), Time(12, 0), Time(18, 0),
          Time(24, 0), Time(30, 0), Time(36, 0), Time(48, 0)]
     """
+    if asarray and (fmt is not None or prefix is not None):
+        raise ValueError("The 'asarray' option can not be combined with 'fmt' or 'prefix'")
+
     rangevalues = list()
 
     # Very strange case of an empty range
     if start is None:
-        return list()
+        return PeriodArray() if asarray else list()
+
+    formatter = _rangex_formatter(fmt, prefix)
+
+    for realstart, realend, realstep in _timerangex_subranges(start, end, step, shift):
+
+        if asarray:
+            rangevalues.append(_timerange_asarray(realstart, realend, realstep))
+            continue
+
+        signstep = int(realstep > 0) * 2 - 1
+        pvalues = [realstart, ]
+        while signstep * (pvalues[-1] - realend) < 0:
+            pvalues.append(pvalues[-1] + realstep)
+        if signstep * (pvalues[-1] - realend) > 0:
+            pvalues.pop()
+
+        pvalues.sort()
+
+        if formatter is not None:
+            pvalues = [formatter(x, i) for i, x in enumerate(pvalues)]
+
+        rangevalues.extend(pvalues)
+
+    if asarray:
+        return PeriodArray.concatenate(rangevalues).uniq()
+    return sorted(set(rangevalues))
+
+
+def itimerangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
+    """Extended time range expansion (lazy version of :func:`timerangex`).
+
+    The arguments are the same as for :func:`timerangex` but a generator is
+    returned: the various sub-ranges are merged on the fly and duplicates are
+    dropped. Consequently, the first value is available immediately and the
+    memory footprint does not depend on the length of the range::
+
+        >>> list(itimerangex('0-12-3,18-36-6,48'))  # doctest: +NORMALIZE_WHITESPACE
+        [Time(0, 0), Time(3, 0), Time(6, 0), Time(9, 0), Time(12, 0), Time(18, 0),
+         Time(24, 0), Time(30, 0), Time(36, 0), Time(48, 0)]
+        >>> list(itimerangex(3, 0,'-0:30'))
+        [Time(0, 0), Time(0, 30), Time(1, 0), Time(1, 30), Time(2, 0), Time(2, 30), Time(3, 0)]
+
+    Values are always yielded in chronological order (see :func:`idaterangex`).
+    """
+    if start is None:
+        return
+    formatter = _rangex_formatter(fmt, prefix)
+    yield from _rangex_merge([((m, _minutes2time(m)) for m in _timerange_minutes(realstart, realend, realstep))
+                              for realstart, realend, realstep in _timerangex_subranges(start, end, step, shift)],
+                             formatter)
+
+
+def _timerangex_subranges(start, end=None, step=None, shift=None):
+    """Split and parse a :func:`timerangex` range definition.
 
+    :return: A generator of (start, end, step) tuples (one per sub-range).
+    """
     pstarts = ([str(s) for s in start]
                if isinstance(start, (list, tuple)) else str(start).split(','))
     for pstart in pstarts:
@@ -450,30 +650,34 @@ def timerangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
             realstart += realshift
             realend += realshift
 
-        signstep = int(realstep > 0) * 2 - 1
-        pvalues = [realstart, ]
-        while signstep * (pvalues[-1] - realend) < 0:
-            pvalues.append(pvalues[-1] + realstep)
-        if signstep * (pvalues[-1] - realend) > 0:
-            pvalues.pop()
+        yield realstart, realend, realstep
 
-        pvalues.sort()
 
-        if fmt is not None:
-            if '{' in fmt and '}' in fmt:
-                pvalues = [fmt.format(x, i + 1, type(x).__name__)
-                           for i, x in enumerate(pvalues)]
-            else:
-                pvalues = [getattr(x, fmt) for x in pvalues]
-                if callable(pvalues[0]):
-                    pvalues = [x() for x in pvalues]
+def _minutes2time(minutes):
+    """Create a :class:`Time` object from a number of minutes."""
+    hours = abs(minutes) // 60 * (1 if minutes >= 0 else -1)
+    return Time(hours, minutes - hours * 60)
 
-        if prefix is not None:
-            pvalues = [prefix + str(x) for x in pvalues]
 
-        rangevalues.extend(pvalues)
+def _timerange_minutes(start, end, step):
+    """The sorted values (in minutes) of a basic :func:`timerangex` range (returns a :class:`range` object)."""
+    start, end, step = int(start), int(end), int(step)
+    if not step:
+        return range(start, start + int(start == end))
+    nsteps = (end - start) // step
+    if nsteps < 0:
+        return range(0)
+    first, last = sorted((start, start + nsteps * step))
+    return range(first, last + 1, abs(step))
 
-    return sorted(set(rangevalues))
+
+def _timerange_asarray(start, end, step):
+    """The vectorised version of a basic :func:`timerangex` range (returns a :class:`PeriodArray`)."""
+    start, end, step = [np.timedelta64(Period(t), _NP_UNIT).astype(np.int64) for t in (start, end, step)]
+    if not step:
+        raise ValueError('The range step can not be null')
+    nitems = max(0, (end - start) // step + 1)
+    return PeriodArray._from_values((start + step * np.arange(nitems, dtype=np.int64)).astype(_NP_PERIOD_DTYPE))
 
 
 def timeintrangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
@@ -530,18 +734,7 @@ def timeintrangex(start, end=None, step=None, shift=None, fmt=None, prefix=None)
         >>> timeintrangex('0-12-3,18-36-6,48')
         [0, 3, 6, 9, 12, 18, 24, 30, 36, 48]
     """
-    pstarts = ([str(s) for s in start]
-               if isinstance(start, (list, tuple)) else str(start).split(','))
-    auto_prefix = None
-    auto_pstarts = list()
-    for pstart in pstarts:
-        if re.search('_', pstart):
-            auto_prefix, realstart = pstart.split('_')
-            auto_prefix += '_'
-            auto_pstarts.append(realstart)
-    if auto_prefix:
-        prefix = auto_prefix
-        start = auto_pstarts
+    start, prefix = _timeintrangex_autoprefix(start, prefix)
 
     trx = timerangex(start, end=end, step=step, shift=shift)
 
@@ -566,12 +759,72 @@ def timeintrangex(start, end=None, step=None, shift=None, fmt=None, prefix=None)
     return sorted(pvalues)
 
 
+def itimeintrangex(start, end=None, step=None, shift=None, fmt=None, prefix=None):
+    """Extended range expansion (lazy version of :func:`timeintrangex`).
+
+    The arguments are the same as for :func:`timeintrangex` but a generator is
+    returned: the various sub-ranges are merged on the fly and duplicates are
+    dropped. Consequently, the first value is available immediately and the
+    memory footprint does not depend on the length of the range::
+
+        >>> list(itimeintrangex('0-12-3,18-36-6,48'))
+        [0, 3, 6, 9, 12, 18, 24, 30, 36, 48]
+        >>> print(', '.join(itimeintrangex(-3, 0,'0:30')))
+        -0003:00, -0002:30, -0002:00, -0001:30, -0001:00, -0000:30, 0000:00
+
+    Values are always yielded in chronological order. Consequently, the
+    result differs from :func:`timeintrangex`'s one when the strings do not
+    sort like the times they represent (e.g. with negative 'hhhh:mm' values
+    or when the ``{1:d}`` counter is used in the ``fmt`` format string).
+    """
+    start, prefix = _timeintrangex_autoprefix(start, prefix)
+    subranges = [_timerange_minutes(realstart, realend, realstep)
+                 for realstart, realend, realstep in _timerangex_subranges(start, end, step, shift)]
+    # Plain integers are returned if all the values are round hours
+    isint = all(r.start % 60 == 0 and (len(r) < 2 or r.step % 60 == 0) for r in subranges if r)
+    if fmt is not None and fmt.startswith('%'):
+        fmt = '{0:' + fmt[1:] + '}'
+    for i, m in enumerate(_rangex_merge([((m, m) for m in r) for r in subranges])):
+        x = m // 60 if isint else TimeInt(_minutes2time(m)).str_time
+        if fmt is not None:
+            x = fmt.format(x, i + 1, type(x).__name__)
+        if prefix is not None:
+            x = prefix + str(x)
+        yield x
+
+
+def _timeintrangex_autoprefix(start, prefix=None):
+    """Look for an automatic prefix in a :func:`timeintrangex` range definition.
+
+    :return: The (start, prefix) tuple that should actually be used.
+    """
+    pstarts = ([str(s) for s in start]
+               if isinstance(start, (list, tuple)) else str(start).split(','))
+    auto_prefix = None
+    auto_pstarts = list()
+    for pstart in pstarts:
+        if re.search('_', pstart):
+            auto_prefix, realstart = pstart.split('_')
+            auto_prefix += '_'
+            auto_pstarts.append(realstart)
+    if auto_prefix:
+        prefix = auto_prefix
+        start = auto_pstarts
+    return start, prefix
+
+
 class Period(datetime.timedelta):
     """
     Standard period objects, extending :class:`datetime.timedelta` features
     with iso8601 capabilities.
+
+    :class:`Period` objects do not have an instance dictionary (``__slots__``)
+    and commonly used periods (e.g. whole hours or quarters of an hour up to a
+    few days) are interned: ``Period('PT6H') is Period(21600)``.
     """
 
+    __slots__ = ()
+
     _my_re = re.compile(
         r'(?P<X>[+-]?P)(?P<Y>[0-9]+([,.][0-9]+)?Y)?'
         r'(?P<M>[0-9]+([,.][0-9]+)?M)?'
@@ -596,17 +849,21 @@ class Period(datetime.timedelta):
         ('Y', 365, 'D'),
     ]
 
+    # The number of seconds in each unit (computed once from _const_times)
+    _unit_seconds = dict(s=1)
+    for _key1, _factor, _key2 in _const_times:
+        _unit_seconds[_key1] = _factor * _unit_seconds[_key2]
+    del _key1, _factor, _key2
+
     @staticmethod
     def _adder(key, value):
-        if key == 's':
-            return value
-        else:
-            for key1, factor, key2 in Period._const_times:
-                if key == key1:
-                    return Period._adder(key2, factor * value)
+        try:
+            return Period._unit_seconds[key] * value
+        except KeyError:
             raise KeyError("Unknown key in Period string: %s" % key)
 
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def _parse(string):
         """Find out time duration that could be extracted from string argument."""
         if not isinstance(string, str):
@@ -618,25 +875,21 @@ class Period(datetime.timedelta):
         if not match:
             raise ValueError("Badly formed string %s" % string)
 
-        values = match.groupdict()
-        values.pop('T')
-        sign = values.pop('X')
-        if sign.startswith('-'):
-            sign = -1
-        else:
-            sign = 1
+        secs = 0
+        for k, factor in Period._unit_seconds.items():
+            v = match.group(k)
+            if v:
+                secs += factor * int(v[:-1])
 
-        for k, v in values.items():
-            if not v:
-                values[k] = 0
-            else:
-                values[k] = int(v[:-1])
+        return -secs if match.group('X').startswith('-') else secs
 
-        secs = 0
-        for k, v in values.items():
-            secs += Period._adder(k, v)
+    # Interned Period objects (see _interned_period)
+    _interned = dict()
 
-        return sign * secs
+    @staticmethod
+    def _internable(days, seconds, microseconds):
+        """Whole quarters of an hour, from -10 days to +31 days, are interned."""
+        return not microseconds and not seconds % 900 and -10 <= days <= 31
 
     def __new__(cls, *args, **kw):
         """
@@ -683,21 +936,34 @@ class Period(datetime.timedelta):
         if not args:
             raise ValueError("No initial value provided for Period")
         top = args[0]
-        ld = list()
-        if isinstance(top, datetime.timedelta):
-            ld = [top.days, top.seconds, top.microseconds]
-        elif isinstance(top, Time):
-            ld = [0, top.hour * 3600 + top.minute * 60]
-        elif len(args) < 2 and (isinstance(top, int) or isinstance(top, float)):
-            ld = [0, top]
-        elif isinstance(top, int) and len(args) > 1:
-            ld = list(args)
-        elif isinstance(top, str):
-            ld = [0, Period._parse(top)]
-        if not ld:
+        ld = None
+        if len(args) == 1:
+            # The most common cases first
+            if isinstance(top, str):
+                ld = (0, Period._parse(top))
+            elif isinstance(top, datetime.timedelta):
+                ld = (top.days, top.seconds, top.microseconds)
+            elif isinstance(top, (int, float)):
+                ld = (0, top)
+            elif isinstance(top, Time):
+                ld = (0, top.hour * 3600 + top.minute * 60)
+        elif isinstance(top, int):
+            ld = args
+        if ld is None:
             raise ValueError("Initial Period value unknown")
+        if cls is Period:
+            return Period._interned_period(*ld)
         return datetime.timedelta.__new__(cls, *ld)
 
+    @staticmethod
+    def _interned_period(*ld):
+        """Create a :class:`Period` object (possibly, an interned one)."""
+        new = datetime.timedelta.__new__(Period, *ld)
+        key = (new.days, new.seconds, new.microseconds)
+        if Period._internable(*key):
+            return Period._interned.setdefault(key, new)
+        return new
+
     def __reduce__(self):
         """Return a compatible args sequence for the Period constructor (used by :mod:`pickle`)."""
         return self.__class__, (self.days, self.seconds, self.microseconds)
@@ -711,6 +977,9 @@ class Period(datetime.timedelta):
         memo[id(self)] = newinstance
         return newinstance
 
+    def __copy__(self):
+        return type(self)(self)
+
     def __len__(self):
         return self.days * 86400 + self.seconds
 
@@ -719,6 +988,8 @@ class Period(datetime.timedelta):
         Add to a Period object the specified ``delta`` which could be either
         a string or a :class:`datetime.timedelta` or an ISO 6801 Period.
         """
+        if isinstance(delta, _TemporalArray):
+            return NotImplemented
         if not isinstance(delta, datetime.timedelta):
             delta = Period(delta)
         return Period(super().__add__(datetime.timedelta(delta.days, delta.seconds)))
@@ -728,6 +999,8 @@ class Period(datetime.timedelta):
         Substract to a Period object the specified ``delta`` which could be either
         a string or a :class:`datetime.timedelta` or an ISO 6801 Period.
         """
+        if isinstance(delta, _TemporalArray):
+            return NotImplemented
         if not isinstance(delta, datetime.timedelta):
             delta = Period(delta)
         return Period(super().__sub__(datetime.timedelta(delta.days, delta.seconds)))
@@ -825,29 +1098,66 @@ class Period(datetime.timedelta):
                                                                             name))
 
 
+def _getattr_plan_builder(cls, name):
+    """Call the :meth:`_GetattrCalculatorMixin._getattr_plan` method of **cls**."""
+    return cls._getattr_plan(name)
+
+
 class _GetattrCalculatorMixin:
     """This Mixin class adds the capability to do computations using fake methods.
 
     This can be useful during the footprint's replacement process.
+
+    The plan associated with each dynamic attribute name is computed once and
+    stored in a bounded class-wide cache (see :meth:`set_getattr_plans_cache`).
     """
 
+    __slots__ = ()
+
+    _getattr_plans = staticmethod(functools.lru_cache(maxsize=2048)(_getattr_plan_builder))
+
     _getattr_re = re.compile(r'^(?P<basics>(?:(?:add|sub)(?![^_]*(add|sub)[^_]*_)[^_]+_?)+)(?:_(?P<fmt>[^_]+))?(?<!_)$')
     _getattr_basic_re = re.compile(r'^(?P<op>add|sub)(?P<operand>[^_]+)')
     _getattr_proxyclass = None
 
-    def _basic_calculator_proxy(self, name):
+    @classmethod
+    def set_getattr_plans_cache(cls, maxsize=2048):
+        """Resize the cache of dynamic attribute plans (for all classes).
+
+        The **maxsize** most recently used attribute names are remembered (a
+        bounded LRU cache is used). The cache is disabled if **maxsize** is
+        ``0`` or ``None``.
+        """
+        if maxsize:
+            plans = functools.lru_cache(maxsize=maxsize)(_getattr_plan_builder)
+        else:
+            plans = _getattr_plan_builder
+        _GetattrCalculatorMixin._getattr_plans = staticmethod(plans)
+
+    @classmethod
+    def getattr_plans_info(cls):
+        """Statistics on the cache of dynamic attribute plans (see :meth:`set_getattr_plans_cache`).
+
+        Returns a :func:`functools.lru_cache` ``CacheInfo`` object (or ``None``
+        if the cache is disabled).
+        """
+        plans = _GetattrCalculatorMixin._getattr_plans
+        return plans.cache_info() if hasattr(plans, 'cache_info') else None
+
+    @classmethod
+    def _basic_calculator_proxy(cls, name):
         """Return something that may (or not) create a _getattr_proxyclass object.
 
         The sign of the _getattr_proxyclass object depends on the chosen operation.
         If _getattr_proxyclass is None, the current object's class is used.
         """
         # The match should always succeed because _getattr_re was called before
-        dmatch = self._getattr_basic_re.match(name).groupdict()
+        dmatch = cls._getattr_basic_re.match(name).groupdict()
         factor = dict(add=1, sub=-1)[dmatch['op']]
-        if self._getattr_proxyclass is None:
-            proxyclass = self.__class__
+        if cls._getattr_proxyclass is None:
+            proxyclass = cls
         else:
-            proxyclass = self._getattr_proxyclass
+            proxyclass = cls._getattr_proxyclass
         # Determine if the operand is a valid period (like PT6H)
         try:
             p = proxyclass(dmatch['operand'])
@@ -866,6 +1176,28 @@ class _GetattrCalculatorMixin:
                 return factor * proxyclass(t)
             return _calculator_op_proxy
 
+    @classmethod
+    def _getattr_plan(cls, name):
+        """Compile the **name** dynamic attribute.
+
+        :return: ``None`` if **name** is not a valid dynamic attribute name.
+                 Otherwise, a (fancy, proxies, fmt) tuple where *fmt* is the
+                 name of the final format accessor (or ``None``) and *proxies*
+                 is either the total delta to apply (if *fancy* is ``False``)
+                 or a tuple of deltas and functions that compute deltas (see
+                 :meth:`_basic_calculator_proxy`).
+        """
+        match = cls._getattr_re.match(name)
+        if match is None:
+            return None
+        dmatch = match.groupdict()
+        basics = dmatch['basics'].rstrip('_').split('_')
+        proxies = tuple([cls._basic_calculator_proxy(basic) for basic in basics])
+        fancy = any([callable(proxy) for proxy in proxies])
+        if not fancy:
+            proxies = functools.reduce(operator.add, proxies)
+        return fancy, proxies, dmatch['fmt']
+
     @secure_getattr
     def __getattr__(self, name):
         """Proxy to additions and subtractions (used in footprint's replacement).
@@ -877,36 +1209,36 @@ class _GetattrCalculatorMixin:
             * It is possible to combine several add and sub, like in:
               self.addterm_subPT3H_ymdh
         """
-        match = self._getattr_re.match(name)
-        if match is not None:
-            dmatch = match.groupdict()
-            basics = dmatch['basics'].rstrip('_').split('_')
-            fmt = dmatch['fmt']
-            proxies = [self._basic_calculator_proxy(basic) for basic in basics]
-            fancy = any([callable(proxy) for proxy in proxies])
-            if fancy:
-                def _combi_proxy(guess, extra):
-                    newobj = self
-                    for proxy in proxies:
-                        newobj += proxy(guess, extra) if callable(proxy) else proxy
-                    return newobj if fmt is None else getattr(newobj, fmt)
-                return _combi_proxy
-            else:
-                newobj = self + functools.reduce(operator.add, proxies)
-                return newobj if fmt is None else getattr(newobj, fmt)
-        else:
+        plan = self._getattr_plans(type(self), name)
+        if plan is None:
             raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__,
                                                                             name))
+        fancy, proxies, fmt = plan
+        if fancy:
+            def _combi_proxy(guess, extra):
+                newobj = self
+                for proxy in proxies:
+                    newobj += proxy(guess, extra) if callable(proxy) else proxy
+                return newobj if fmt is None else getattr(newobj, fmt)
+            return _combi_proxy
+        else:
+            newobj = self + proxies
+            return newobj if fmt is None else getattr(newobj, fmt)
 
 
 class Date(datetime.datetime, _GetattrCalculatorMixin):
     """
     Standard date objects, extending :class:`datetime.datetime` features with
     iso8601 capabilities.
+
+    :class:`Date` objects do not have an instance dictionary (``__slots__``).
     """
 
+    __slots__ = ()
+
     _origin = datetime.datetime(1970, 1, 1, 0, 0, 0)
     _getattr_proxyclass = Period
+    _strings_memo = None
 
     def __new__(cls, *args, **kw):
         if kw and not args:
@@ -914,7 +1246,6 @@ class Date(datetime.datetime, _GetattrCalculatorMixin):
         if not args:
             raise ValueError("No initial value provided for Date")
         top = args[0]
-        deltas = []
         ld = list()
         if isinstance(top, str) and top in local_date_functions:
             try:
@@ -930,20 +1261,17 @@ class Date(datetime.datetime, _GetattrCalculatorMixin):
             top = Date._origin + datetime.timedelta(0, top)
             ld = [top.year, top.month, top.day, top.hour, top.minute, top.second]
         elif isinstance(top, str):
-            s_top = top.split('/')
-            top = s_top[0]
-            top = re.sub('^YYYY', str(max(0, int(kw.pop('year', today().year)))), top.upper())
-            deltas = s_top[1:]
-            ld = [int(x) for x in re.split('[-:HTZ]+', mkisodate(top)) if re.match(r'\d+$', x)]
+            year = kw.pop('year', None)
+            if Date._strings_memo is not None and year is None and top[:4].upper() != 'YYYY':
+                ld = Date._strings_memo(top)
+            else:
+                ld = _date_string_fields(top, year)
         else:
             ld = [int(x) for x in args
                   if isinstance(x, (int, float)) or (isinstance(x, str) and re.match(r'\d+$', x))]
         if not ld:
             raise ValueError("Initial Date value unknown (args: {!s}, kw: {!s})".format(args, kw))
-        newdate = datetime.datetime.__new__(cls, *ld)
-        if deltas:
-            newdate += sum([Period(d) for d in deltas], Period(0))
-        return newdate
+        return datetime.datetime.__new__(cls, *ld)
 
     def __init__(self, *args, **kw):  # @UnusedVariable
         """
@@ -1039,8 +1367,41 @@ class Date(datetime.datetime, _GetattrCalculatorMixin):
         validity date of a a resource that defines a *term*).
         """
         super().__init__()
-        delta_o = self - Date._origin
-        self._epoch = delta_o.days * 86400 + delta_o.seconds
+
+    @classmethod
+    def set_strings_memo(cls, maxsize=4096):
+        """Memoize the conversion of strings into dates (for all :class:`Date` objects).
+
+        The **maxsize** most recently used strings are remembered (a bounded
+        LRU cache is used). The memoization is disabled if **maxsize** is ``0``
+        or ``None``.
+
+        :note: Strings that start with YYYY are never memoized.
+
+            >>> Date.set_strings_memo(1024)
+            >>> Date('2017010112')
+            Date(2017, 1, 1, 12, 0)
+            >>> Date('2017010112')
+            Date(2017, 1, 1, 12, 0)
+            >>> Date.strings_memo_info()
+            CacheInfo(hits=1, misses=1, maxsize=1024, currsize=1)
+            >>> Date.set_strings_memo(0)
+        """
+        if maxsize:
+            Date._strings_memo = functools.lru_cache(maxsize=maxsize)(_date_string_fields)
+        else:
+            Date._strings_memo = None
+
+    @classmethod
+    def strings_memo_info(cls):
+        """Statistics on the memoization of strings (see :meth:`set_strings_memo`).
+
+        Returns a :func:`functools.lru_cache` ``CacheInfo`` object (or ``None``
+        if the memoization is disabled).
+        """
+        if Date._strings_memo is None:
+            return None
+        return Date._strings_memo.cache_info()
 
     def __reduce__(self):
         """Return a compatible args sequence for the Date constructor (used by :mod:`pickle`)."""
@@ -1067,7 +1428,8 @@ class Date(datetime.datetime, _GetattrCalculatorMixin):
     @property
     def epoch(self):
         """Seconds since the beginning of epoch... the first of january, 1970."""
-        return self._epoch
+        delta_o = datetime.datetime.__sub__(self, Date._origin)
+        return delta_o.days * 86400 + delta_o.seconds
 
     def iso8601(self):
         """Plain ISO 8601 representation."""
@@ -1198,6 +1560,8 @@ class Date(datetime.datetime, _GetattrCalculatorMixin):
         Add to a Date object the specified ``delta`` which could be either
         a string or a :class:`datetime.timedelta` or an ISO 6801 Period.
         """
+        if isinstance(delta, _TemporalArray):
+            return NotImplemented
         if not isinstance(delta, datetime.timedelta):
             delta = Period(delta)
         return Date(super().__add__(datetime.timedelta(delta.days, delta.seconds)))
@@ -1211,6 +1575,8 @@ class Date(datetime.datetime, _GetattrCalculatorMixin):
         Subtract to a Date object the specified ``delta`` which could be either
         a string or a :class:`datetime.timedelta` or an ISO 6801 Period.
         """
+        if isinstance(delta, _TemporalArray):
+            return NotImplemented
         if not isinstance(delta, datetime.datetime) and not isinstance(delta, datetime.timedelta):
             delta = guess(delta)
         substract = super().__sub__(delta)
@@ -1364,9 +1730,12 @@ class Date(datetime.datetime, _GetattrCalculatorMixin):
 class Time(_GetattrCalculatorMixin):
     """Basic object to handle hh:mm information.
 
-    Extended arithmetic is supported.
+    Extended arithmetic is supported. :class:`Time` objects do not have an
+    instance dictionary (``__slots__``).
     """
 
+    __slots__ = ('_hour', '_minute')
+
     def __init__(self, *args, **kw):
         """
         The object can be constructed from:
@@ -1496,9 +1865,9 @@ class Time(_GetattrCalculatorMixin):
         # If minute > 60 do something...
         if abs(self._minute) >= 60:
             thesign = int(self._minute > 0) * 2 - 1
-            while abs(self._minute) >= 60:
-                self._hour += thesign
-                self._minute -= thesign * 60
+            extra_hours = thesign * (abs(self._minute) // 60)
+            self._hour += extra_hours
+            self._minute -= extra_hours * 60
         # Apply deltas
         if deltas:
             new_time = self + sum([Period(d) for d in deltas], Period(0))
@@ -2023,6 +2392,672 @@ class Month:
         return rc
 
 
+def _progression_size(progression):
+    """The number of items in a (first, last, step) arithmetic progression."""
+    first, last, step = progression
+    return (last - first) // step + 1
+
+
+def _progression_includes(p1, p2):
+    """Check if all the items of the *p2* arithmetic progression belong to *p1*."""
+    (f1, l1, s1), (f2, l2, s2) = p1, p2
+    return (f1 <= f2 and l2 <= l1 and not (f2 - f1) % s1 and
+            (f2 == l2 or not s2 % s1))
+
+
+def _modular_inverse(a, m):
+    """The inverse of **a** modulo **m** (**a** and **m** must be coprime)."""
+    # Extended Euclidean algorithm (pow(a, -1, m) requires Python >= 3.8)
+    r0, r1, x0, x1 = a % m, m, 1, 0
+    while r1:
+        q = r0 // r1
+        r0, r1, x0, x1 = r1, r0 - q * r1, x1, x0 - q * x1
+    return x0 % m
+
+
+def _progressions_intersection(p1, p2):
+    """The intersection of two (first, last, step) arithmetic progressions (``None`` if empty)."""
+    (f1, l1, s1), (f2, l2, s2) = p1, p2
+    gcd = math.gcd(s1, s2)
+    if (f2 - f1) % gcd:
+        return None
+    lcm = s1 // gcd * s2
+    # Solve f1 + s1 * k = f2 (mod s2)
+    k = (f2 - f1) // gcd * _modular_inverse(s1 // gcd, s2 // gcd) if s2 // gcd > 1 else 0
+    lo, hi = max(f1, f2), min(l1, l2)
+    first = lo + (f1 + s1 * k - lo) % lcm
+    if first > hi:
+        return None
+    return first, first + (hi - first) // lcm * lcm, lcm
+
+
+#: The maximum number of inclusion-exclusion terms computed by :func:`_progressions_union_size`
+_UNION_SIZE_MAX_TERMS = 4096
+
+
+class _TooManyTerms(Exception):
+    """Raised when the inclusion-exclusion computation is too costly."""
+    pass
+
+
+def _progressions_merge(progressions):
+    """Merge the progressions with the same step that overlap or follow each other."""
+    merged = list()
+    for first, last, step in sorted(progressions, key=lambda p: (p[2], p[0] % p[2], p[0])):
+        if merged and merged[-1][2] == step and not (first - merged[-1][0]) % step and first <= merged[-1][1] + step:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last), step)
+        else:
+            merged.append((first, last, step))
+    return merged
+
+
+def _progressions_groups(progressions):
+    """Split sorted progressions into groups whose [first, last] intervals overlap."""
+    groups = list()
+    reach = None
+    for progression in progressions:
+        if reach is None or progression[0] > reach:
+            groups.append([progression, ])
+        else:
+            groups[-1].append(progression)
+        reach = progression[1] if reach is None else max(reach, progression[1])
+    return groups
+
+
+def _progressions_union_size(progressions):
+    """The number of distinct items in a collection of arithmetic progressions.
+
+    The progressions are merged when possible and split into groups of
+    overlapping progressions. The size of each group is computed using the
+    inclusion-exclusion principle (empty intersections are pruned). Since the
+    number of terms may grow exponentially with the number of progressions,
+    when more than :data:`_UNION_SIZE_MAX_TERMS` terms are needed, the items of
+    the group are counted instead (the cost is then proportional to the number
+    of items).
+    """
+    total = 0
+    for group in _progressions_groups(sorted(_progressions_merge(progressions))):
+        nterms = [0, ]
+
+        def _size(istart, current, sign):
+            subtotal = 0
+            for i in range(istart, len(group)):
+                inter = (group[i] if current is None
+                         else _progressions_intersection(current, group[i]))
+                if inter is not None:
+                    nterms[0] += 1
+                    if nterms[0] > _UNION_SIZE_MAX_TERMS:
+                        raise _TooManyTerms()
+                    subtotal += sign * _progression_size(inter) + _size(i + 1, inter, - sign)
+            return subtotal
+
+        try:
+            total += _size(0, None, 1)
+        except _TooManyTerms:
+            previous = None
+            for item in heapq.merge(*[range(first, last + 1, step) for first, last, step in group]):
+                if item != previous:
+                    total += 1
+                    previous = item
+    return total
+
+
+class RangeExpression:
+    """Abstract class for compiled range expressions.
+
+    A range expression (see :func:`daterangex` or :func:`timerangex`) is
+    parsed once and compiled into an immutable plan made of arithmetic
+    progressions of integers (one per sub-range). Consequently:
+
+        * The object is hashable and two expressions are equal if their
+          compiled plans are identical (e.g. '0-12-6,6' and '0-12-6');
+        * The ``len`` of the expression and membership tests (``in``) are
+          computed arithmetically (the range is never expanded). A membership
+          test only looks at the sub-ranges that contain the item's position
+          (found by bisection). The ``len`` is computed by inclusion-exclusion
+          on groups of overlapping sub-ranges (large groups of overlapping
+          sub-ranges are counted item by item);
+        * Expanding the expression (with various *shift*, *fmt* and *prefix*
+          values) does not require any parsing.
+
+    Any time-dependent value (e.g. ``today``) is resolved once and for all
+    when the expression is compiled.
+    """
+
+    def __init__(self, start, end=None, step=None):
+        """
+        :param start: The range definition (see :func:`daterangex` or :func:`timerangex`).
+        :param end: The default end of sub-ranges.
+        :param step: The default step of sub-ranges.
+        """
+        self._source = (start, end, step)
+        # The step of single item sub-ranges does not matter (and would prevent
+        # identical items from being detected)
+        plan = set([(first, last, step if first != last else 1)
+                    for first, last, step in self._compile(start, end, step)])
+        # Sub-ranges that are included in another one are useless
+        self._plan = tuple(sorted([p for p in plan
+                                   if not any(q != p and _progression_includes(q, p) for q in plan)]))
+
+    def _compile(self, start, end, step):
+        """Generate the (first, last, step) integer progressions of each sub-range."""
+        raise NotImplementedError()
+
+    def _to_int(self, value):
+        """Convert an item of the range into an integer."""
+        raise NotImplementedError()
+
+    def _from_int(self, value):
+        """Convert an integer into an item of the range."""
+        raise NotImplementedError()
+
+    def _shift_to_int(self, shift):
+        """Convert a *shift* value into an integer."""
+        raise NotImplementedError()
+
+    def _fmt_prepare(self, fmt):
+        """Possibly, alter the *fmt* formating string."""
+        return fmt
+
+    @property
+    def plan(self):
+        """The compiled plan (a tuple of (first, last, step) integer progressions)."""
+        return self._plan
+
+    def shifted(self, shift):
+        """Return a new range expression where all the items are shifted by **shift**."""
+        ishift = self._shift_to_int(shift)
+        new = self.__class__.__new__(self.__class__)
+        new._source = self._source + (shift, ) if len(self._source) == 3 else self._source
+        new._plan = tuple([(first + ishift, last + ishift, step) for first, last, step in self._plan])
+        return new
+
+    def _reach(self):
+        """For each sub-range of the plan, the largest last item of this sub-range and of the previous ones."""
+        reach = self.__dict__.get('_reach_cache', None)
+        if reach is None:
+            reach = list(itertools.accumulate([last for _, last, _ in self._plan], max))
+            self._reach_cache = reach
+        return reach
+
+    def _progressions(self, shift=None):
+        ishift = 0 if shift is None else self._shift_to_int(shift)
+        return [range(first + ishift, last + ishift + 1, step) for first, last, step in self._plan]
+
+    def expand(self, shift=None, fmt=None, prefix=None):
+        """Expand the range (returns a sorted list without duplicates).
+
+        The result is the same as the one of the corresponding "rangex" function.
+        """
+        progressions = self._progressions(shift)
+        formatter = _rangex_formatter(self._fmt_prepare(fmt), prefix)
+        if formatter is None:
+            return [self._from_int(i) for i in sorted(set(itertools.chain(*progressions)))]
+        return sorted(set([formatter(self._from_int(i), n)
+                           for progression in progressions for n, i in enumerate(progression)]))
+
+    def iter(self, shift=None, fmt=None, prefix=None):
+        """Lazily expand the range (returns a generator).
+
+        The result is the same as the one of the corresponding "irangex" function.
+        """
+        formatter = _rangex_formatter(self._fmt_prepare(fmt), prefix)
+        return _rangex_merge([((i, self._from_int(i)) for i in progression)
+                              for progression in self._progressions(shift)],
+                             formatter)
+
+    def __iter__(self):
+        return self.iter()
+
+    def __len__(self):
+        return _progressions_union_size(self._plan)
+
+    def __contains__(self, item):
+        try:
+            i = self._to_int(item)
+        except (ValueError, TypeError):
+            return False
+        # Only look at sub-ranges that start before i, going backward until
+        # none of the previous sub-ranges reaches i
+        j = bisect.bisect_right(self._plan, (i, math.inf, math.inf))
+        reach = self._reach()
+        while j and reach[j - 1] >= i:
+            j -= 1
+            first, last, step = self._plan[j]
+            if i <= last and not (i - first) % step:
+                return True
+        return False
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._plan == other.plan
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((type(self).__name__, self._plan))
+
+    def __repr__(self):
+        return '{:s}({:s})'.format(self.__class__.__name__,
+                                   ', '.join([repr(a) for a in self._source]))
+
+
+class DateRangeExpression(RangeExpression):
+    """A compiled :func:`daterangex` range expression.
+
+    ::
+
+        >>> rexpr = DateRangeExpression('2017010100-2017013100-P14D,2017011500')
+        >>> len(rexpr)
+        3
+        >>> Date(2017, 1, 15) in rexpr, '2017011600' in rexpr
+        (True, False)
+        >>> rexpr.expand()
+        [Date(2017, 1, 1, 0, 0), Date(2017, 1, 15, 0, 0), Date(2017, 1, 29, 0, 0)]
+        >>> rexpr.expand(shift='PT6H', fmt='ymdh')
+        ['2017010106', '2017011506', '2017012906']
+        >>> rexpr == DateRangeExpression('2017012900-2017010100-P14D')
+        True
+
+    Items are dealt with using a one second resolution.
+    """
+
+    def _compile(self, start, end, step):
+        for realstart, realend, realstep in _daterangex_subranges(start, end, step):
+            first, last = sorted((realstart.epoch, realend.epoch))
+            istep = abs(int(realstep.total_seconds()))
+            if not istep:
+                raise ValueError('The range step can not be null')
+            yield first, first + (last - first) // istep * istep, istep
+
+    def _to_int(self, value):
+        return (value if isinstance(value, Date) else Date(value)).epoch
+
+    def _from_int(self, value):
+        return Date(float(value))
+
+    def _shift_to_int(self, shift):
+        return int(Period(shift).total_seconds())
+
+    def _fmt_prepare(self, fmt):
+        if fmt is not None and fmt.startswith('%'):
+            fmt = '{0:' + fmt[1:] + '}'
+        return fmt
+
+
+class TimeRangeExpression(RangeExpression):
+    """A compiled :func:`timerangex` range expression.
+
+    ::
+
+        >>> rexpr = TimeRangeExpression('0-12-3,18-36-6,48')
+        >>> len(rexpr)
+        10
+        >>> Time(24, 0) in rexpr, 25 in rexpr
+        (True, False)
+        >>> rexpr.expand(shift=24, fmt='{0.hour:03d}')  # doctest: +NORMALIZE_WHITESPACE
+        ['024', '027', '030', '033', '036', '042', '048', '054', '060', '072']
+
+    Items are dealt with using a one minute resolution.
+    """
+
+    def _compile(self, start, end, step):
+        if start is None:
+            return
+        for realstart, realend, realstep in _timerangex_subranges(start, end, step):
+            minutes = _timerange_minutes(realstart, realend, realstep)
+            if minutes:
+                yield minutes[0], minutes[-1], minutes.step
+
+    def _to_int(self, value):
+        return int(value if isinstance(value, Time) else Time(value))
+
+    def _from_int(self, value):
+        return _minutes2time(value)
+
+    def _shift_to_int(self, shift):
+        return int(Time(shift))
+
+
+def _as_datetime64(value):
+    """Convert **value** (a single date or a collection of dates) into NumPy's datetime64 data."""
+    if isinstance(value, DateArray):
+        return value.values
+    elif isinstance(value, (np.ndarray, np.generic)) and value.dtype.kind == 'M':
+        return value.astype(_NP_DATE_DTYPE)
+    elif isinstance(value, datetime.datetime):
+        return np.datetime64(value, _NP_UNIT)
+    elif isinstance(value, (str, float, tuple)):
+        return np.datetime64(Date(value), _NP_UNIT)
+    else:
+        return np.array([x if isinstance(x, datetime.datetime) else Date(x) for x in value],
+                        dtype=_NP_DATE_DTYPE)
+
+
+def _as_timedelta64(value):
+    """Convert **value** (a single period or a collection of periods) into NumPy's timedelta64 data."""
+    if isinstance(value, PeriodArray):
+        return value.values
+    elif isinstance(value, (np.ndarray, np.generic)) and value.dtype.kind == 'm':
+        return value.astype(_NP_PERIOD_DTYPE)
+    elif isinstance(value, (np.ndarray, np.generic)) and value.dtype.kind in 'iu':
+        # A number of seconds (as with Period objects)
+        return (value.astype(np.int64) * 1000000).astype(_NP_PERIOD_DTYPE)
+    elif isinstance(value, datetime.timedelta):
+        return np.timedelta64(value, _NP_UNIT)
+    elif isinstance(value, (str, int, float, Time)):
+        return np.timedelta64(Period(value), _NP_UNIT)
+    else:
+        return np.array([x if isinstance(x, datetime.timedelta) else Period(x) for x in value],
+                        dtype=_NP_PERIOD_DTYPE)
+
+
+class _TemporalArray:
+    """Common features of the :class:`DateArray` and :class:`PeriodArray` classes."""
+
+    _np_dtype = None
+
+    def __init__(self, values=()):
+        self._values = self._convert(values)
+        if self._values.ndim != 1:
+            self._values = self._values.reshape((-1, ))
+
+    @staticmethod
+    def _convert(values):
+        raise NotImplementedError()
+
+    def _box(self, value):
+        """Convert a single NumPy item into the corresponding Python object."""
+        raise NotImplementedError()
+
+    @classmethod
+    def _from_values(cls, values):
+        """Create a new object from an existing NumPy array (no check and no copy)."""
+        new = cls.__new__(cls)
+        new._values = values
+        return new
+
+    @property
+    def values(self):
+        """The underlying :class:`numpy.ndarray` object."""
+        return self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        for value in self._values.tolist():
+            yield self._box(value)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self._box(self._values[item].item())
+        return self._from_values(self._values[item])
+
+    def __repr__(self):
+        return '{:s}([{:s}])'.format(self.__class__.__name__,
+                                     ', '.join([str(x) for x in self[:3]] +
+                                               (['...', ] if len(self) > 3 else [])))
+
+    def __eq__(self, other):
+        return self._values == self._convert(other)
+
+    def __ne__(self, other):
+        return self._values != self._convert(other)
+
+    def __lt__(self, other):
+        return self._values < self._convert(other)
+
+    def __le__(self, other):
+        return self._values <= self._convert(other)
+
+    def __gt__(self, other):
+        return self._values > self._convert(other)
+
+    def __ge__(self, other):
+        return self._values >= self._convert(other)
+
+    __hash__ = None
+
+    def copy(self):
+        """Return a copy of the present object."""
+        return self._from_values(self._values.copy())
+
+    def sort(self):
+        """Sort the present object (in place)."""
+        self._values.sort()
+
+    def uniq(self):
+        """Return a new object with the unique sorted items of the present object."""
+        return self._from_values(np.unique(self._values))
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """Join a sequence of objects."""
+        return cls._from_values(np.concatenate([a.values for a in arrays] +
+                                               [np.array([], dtype=cls._np_dtype), ]))
+
+
+@npchecker.disabled_if_unavailable
+class DateArray(_TemporalArray):
+    """A columnar collection of dates backed by a NumPy datetime64 array.
+
+    Items are stored with a microsecond resolution: the conversion from/to
+    :class:`Date` objects is lossless. Arithmetic, comparisons and the
+    formatting accessors (:data:`ymdh`, :data:`ymd`, :meth:`compact`, ...)
+    are vectorised: the formatting accessors return arrays of strings.
+
+    :param values: A collection of :class:`Date` objects (or anything that can
+                   be converted to a :class:`Date` object) or a NumPy
+                   datetime64 array.
+    """
+
+    _np_dtype = _NP_DATE_DTYPE
+
+    @staticmethod
+    def _convert(values):
+        return _as_datetime64(values)
+
+    def _box(self, value):
+        return Date(value.year, value.month, value.day,
+                    value.hour, value.minute, value.second, value.microsecond)
+
+    @classmethod
+    def range(cls, start, end=None, step='P1D'):
+        """The vectorised equivalent of :func:`daterange`."""
+        start = start if isinstance(start, Date) else Date(start)
+        end = start + Period('P10D') if end is None else (end if isinstance(end, Date) else Date(end))
+        start, end = sorted((start, end))
+        step = step if isinstance(step, Period) else Period(step)
+        step = np.timedelta64(abs(step), _NP_UNIT)
+        return cls._from_values(np.arange(np.datetime64(start, _NP_UNIT),
+                                          np.datetime64(end, _NP_UNIT) + np.timedelta64(1, _NP_UNIT),
+                                          step))
+
+    def to_dates(self):
+        """Return the list of the corresponding :class:`Date` objects."""
+        return list(self)
+
+    def __add__(self, delta):
+        return DateArray._from_values(self._values + _as_timedelta64(delta))
+
+    def __radd__(self, delta):
+        return self.__add__(delta)
+
+    def __sub__(self, delta):
+        """Subtract a period (returns a :class:`DateArray`) or a date (returns a :class:`PeriodArray`)."""
+        isdate = isinstance(delta, (np.ndarray, np.generic)) and delta.dtype.kind == 'M'
+        if isdate or isinstance(delta, (DateArray, datetime.datetime)):
+            return PeriodArray._from_values(self._values - _as_datetime64(delta))
+        if isinstance(delta, str):
+            delta = guess(delta)
+            if isinstance(delta, Date):
+                return PeriodArray._from_values(self._values - _as_datetime64(delta))
+        return DateArray._from_values(self._values - _as_timedelta64(delta))
+
+    def __rsub__(self, other):
+        return PeriodArray._from_values(_as_datetime64(other) - self._values)
+
+    def _fields(self):
+        """Return the year, month, day, hour, minute and second of each item."""
+        days = self._values.astype('M8[D]')
+        months = days.astype('M8[M]')
+        seconds = (self._values - days).astype('m8[s]').astype(np.int64)
+        return (months.astype('M8[Y]').astype(np.int64) + 1970,
+                months.astype(np.int64) % 12 + 1,
+                (days - months).astype(np.int64) + 1,
+                seconds // 3600,
+                seconds // 60 % 60,
+                seconds % 60)
+
+    def _format(self, *components):
+        """Concatenate zero-padded integer components (given as (values, width) pairs)."""
+        number = np.zeros(len(self), dtype=np.int64)
+        width = 0
+        for values, cwidth in components:
+            number = number * 10 ** cwidth + values
+            width += cwidth
+        return np.char.zfill(number.astype('U'), width)
+
+    @property
+    def y(self):
+        """YYYY formated strings."""
+        return self._format((self._fields()[0], 4))
+
+    @property
+    def ymd(self):
+        """YYYYMMDD formated strings."""
+        f = self._fields()
+        return self._format((f[0], 4), (f[1], 2), (f[2], 2))
+
+    @property
+    def yymd(self):
+        """YYMMDD formated strings."""
+        f = self._fields()
+        return self._format((f[0] % 100, 2), (f[1], 2), (f[2], 2))
+
+    @property
+    def ymdh(self):
+        """YYYYMMDDHH formated strings."""
+        f = self._fields()
+        return self._format((f[0], 4), (f[1], 2), (f[2], 2), (f[3], 2))
+
+    @property
+    def yymdh(self):
+        """YYMMDDHH formated strings."""
+        f = self._fields()
+        return self._format((f[0] % 100, 2), (f[1], 2), (f[2], 2), (f[3], 2))
+
+    @property
+    def ymdhm(self):
+        """YYYYMMDDHHMM formated strings."""
+        f = self._fields()
+        return self._format((f[0], 4), (f[1], 2), (f[2], 2), (f[3], 2), (f[4], 2))
+
+    @property
+    def ymdhms(self):
+        """YYYYMMDDHHMMSS formated strings."""
+        f = self._fields()
+        return self._format((f[0], 4), (f[1], 2), (f[2], 2), (f[3], 2), (f[4], 2), (f[5], 2))
+
+    @property
+    def mmddhh(self):
+        """MMDDHH formated strings."""
+        f = self._fields()
+        return self._format((f[1], 2), (f[2], 2), (f[3], 2))
+
+    @property
+    def mm(self):
+        """MM (month) formated strings."""
+        return self._format((self._fields()[1], 2))
+
+    @property
+    def dd(self):
+        """DD formated strings."""
+        return self._format((self._fields()[2], 2))
+
+    @property
+    def hh(self):
+        """HH formated strings."""
+        return self._format((self._fields()[3], 2))
+
+    @property
+    def hm(self):
+        """HHMM formated strings."""
+        f = self._fields()
+        return self._format((f[3], 2), (f[4], 2))
+
+    def compact(self):
+        """Compact concatenation of date values, up to the second (YYYYMMDDHHMMSS)."""
+        return self.ymdhms
+
+
+@npchecker.disabled_if_unavailable
+class PeriodArray(_TemporalArray):
+    """A columnar collection of periods backed by a NumPy timedelta64 array.
+
+    Items are stored with a microsecond resolution: the conversion from/to
+    :class:`Period` objects is lossless. Arithmetic and comparisons are
+    vectorised.
+
+    :param values: A collection of :class:`Period` objects (or anything that can
+                   be converted to a :class:`Period` object) or a NumPy
+                   timedelta64 array.
+    """
+
+    _np_dtype = _NP_PERIOD_DTYPE
+
+    @staticmethod
+    def _convert(values):
+        return _as_timedelta64(values)
+
+    def _box(self, value):
+        return Period(value)
+
+    def to_periods(self):
+        """Return the list of the corresponding :class:`Period` objects."""
+        return list(self)
+
+    def __add__(self, delta):
+        if isinstance(delta, (DateArray, datetime.datetime)):
+            return DateArray._from_values(_as_datetime64(delta) + self._values)
+        return PeriodArray._from_values(self._values + _as_timedelta64(delta))
+
+    def __radd__(self, delta):
+        return self.__add__(delta)
+
+    def __sub__(self, delta):
+        return PeriodArray._from_values(self._values - _as_timedelta64(delta))
+
+    def __rsub__(self, other):
+        if isinstance(other, datetime.datetime):
+            return DateArray._from_values(_as_datetime64(other) - self._values)
+        return PeriodArray._from_values(_as_timedelta64(other) - self._values)
+
+    def __mul__(self, factor):
+        return PeriodArray._from_values(self._values * np.asarray(factor, dtype=np.int64))
+
+    def __rmul__(self, factor):
+        return self.__mul__(factor)
+
+    def __neg__(self):
+        return PeriodArray._from_values(- self._values)
+
+    def total_seconds(self):
+        """The periods expressed in seconds (floats)."""
+        return self._values / np.timedelta64(1, 's')
+
+    @property
+    def pseconds(self):
+        """The periods expressed in seconds (integers)."""
+        return self.total_seconds().astype(np.int64)
+
+    @property
+    def length(self):
+        """Absolute lengths in seconds."""
+        return np.abs(self.pseconds)
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
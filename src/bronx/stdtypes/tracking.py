@@ -223,7 +223,12 @@ class MappingTracker(Tracker):
             raise ValueError('The after argument must be some kind of mapping (got {!s}).'
                              .format(type(before)))
         super().__init__(before, after, sectionlabel='Item')
-        super()._set_updated([k for k in self.unchanged if after[k] != before[k]])
+        super()._set_updated([k for k in self.unchanged if self._differ(before[k], after[k])])
+
+    @staticmethod
+    def _differ(item_before, item_after):
+        """Tells whether **item_before** and **item_after** are different."""
+        return item_after != item_before
 
     deleted = property(Tracker._get_deleted, None, None, "The set of deleted items.")
 
@@ -303,10 +308,15 @@ class RecursiveMappingTracker(MappingTracker):
                 self._updated_data[k_changed] = Tracker(k_before, k_after, sectionlabel="Set's item")
             elif (isinstance(k_before, collections.abc.Mapping) and
                   isinstance(k_after, collections.abc.Mapping)):
-                self._updated_data[k_changed] = RecursiveMappingTracker(k_before, k_after)
+                self._updated_data[k_changed] = self._mapping_tracker(k_before, k_after)
             else:
                 self._updated_data[k_changed] = SimpleDifference(k_before, k_after)
 
+    @staticmethod
+    def _mapping_tracker(before, after):
+        """The tracker object that describes the differences between two sub-mappings."""
+        return RecursiveMappingTracker(before, after)
+
     @property
     def created_data(self):
         """A mapping of created items (present in **after** but not in **before**)."""
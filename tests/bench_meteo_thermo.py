@@ -0,0 +1,78 @@
+"""
+Benchmark of the saturation and phase-change computations of :mod:`bronx.meteo.thermo`.
+
+The benchmark runs on a synthetic (but realistic) 3D field: a standard
+atmosphere lapse rate with some noise, a relative humidity between 50 and 110%
+and 30% of cloudy points containing 5 hydrometeor species.
+
+It is not run by the test suite. Launch it from the repository root::
+
+    $ PYTHONPATH=src python tests/bench_meteo_thermo.py --shape 60 150 150
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from bronx.meteo import thermo
+
+HYDROMETEORS = ['v', 'c', 'r', 'i', 's', 'g']
+
+
+def make_fields(shape, seed=3):
+    """Generate the T, P and mixing ratios fields."""
+    rng = np.random.default_rng(seed)
+    z = np.linspace(0., 12000., shape[0]).reshape((-1, ) + (1, ) * (len(shape) - 1))
+    T = 295. - 6.5e-3 * z + rng.normal(0., 1.5, shape)
+    P = 101325. * np.exp(-z / 8000.) * np.ones(shape)
+    rsat = thermo.Thermo.e_P2rv(thermo.Thermo.T2esatw(T), P)
+    data = {thermo.N_T: T, thermo.N_P: P, thermo.N_rv: rsat * rng.uniform(.5, 1.1, shape)}
+    cloudy = rng.random(shape) < .3
+    for h in HYDROMETEORS[1:]:
+        data['r' + h] = np.where(cloudy, 2e-4 * rng.random(shape), 0.)
+    return data
+
+
+def timeit(function, repeat):
+    """The best elapsed time (in seconds) out of **repeat** calls to **function**."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shape', type=int, nargs='+', default=[60, 150, 150],
+                        help='The shape of the 3D fields (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of repetitions (the best time is kept)')
+    args = parser.parse_args()
+
+    data = make_fields(tuple(args.shape))
+    T = data[thermo.N_T]
+
+    def new():
+        return thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(data))
+
+    benchmarks = [
+        ('T2esatw', lambda: thermo.Thermo.T2esatw(T)),
+        ('T2esati', lambda: thermo.Thermo.T2esati(T)),
+        ('evaporate(c, r, i, s, g)', lambda: new().evaporate(HYDROMETEORS[1:])),
+        ("adjust(c + i, '0T-20', 10 iterations)", lambda: new().adjust(['c', 'i'], '0T-20', 10)),
+        ("adjust(c + i, '0T-20', <= 10 iterations, tolerance=1e-7)",
+         lambda: new().adjust(['c', 'i'], '0T-20', 10, tolerance=1e-7)),
+    ]
+    print('{:d} points ({:s})'.format(T.size, ' x '.join([str(n) for n in T.shape])))
+    for label, function in benchmarks:
+        print('{:60s} {:8.3f}s'.format(label, timeit(function, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
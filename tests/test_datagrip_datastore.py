@@ -1,8 +1,13 @@
+import multiprocessing
+import os
+import pickle
 import tempfile
+import threading
 import shutil
 import unittest
 
-from bronx.datagrip.datastore import DataStore
+from bronx.datagrip.datastore import DataStore, DataStoreRange, DataStorePrefix
+from bronx.datagrip.datastore import ThreadSafeDataStore, SharedDataStore, BoundedDataStore
 
 
 class Parasite:
@@ -14,6 +19,23 @@ class Parasite:
         self.mydata = other.mydata
 
 
+class Counted:
+
+    unpickled = 0
+
+    def __init__(self, value):
+        self.value = value
+
+    def __setstate__(self, state):
+        Counted.unpickled += 1
+        self.__dict__.update(state)
+
+
+class SmallJournalDataStore(DataStore):
+
+    _JOURNAL_COMPACTION_MIN = 8
+
+
 class TestDataStore(unittest.TestCase):
 
     def setUp(self):
@@ -107,6 +129,431 @@ class TestDataStore(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             ds2.insert('parasite', dict(), Parasite(toto='is here'))
 
+    def test_datastore_grep_index(self):
+        # Enough entries to get both sparse and dense postings
+        for i in range(1000):
+            self.ds.insert('field' if i % 10 else 'config',
+                           dict(term=i % 24, member=i % 5, name='n{:03d}'.format(i)),
+                           i, readonly=False)
+
+        def reference(kind, check):
+            return {k: v for k, v in self.ds if k.kind == kind and check(k)}
+
+        # The representation of the postings is chosen when they are searched
+        self.assertFalse(self.ds._index._kinds['field'].dense)
+        self.assertEqual(self.ds.grep('field', dict()),
+                         reference('field', lambda k: True))
+        self.assertTrue(self.ds._index._kinds['field'].dense)
+        self.assertEqual(self.ds.grep('field', dict(member=3)),
+                         reference('field', lambda k: k.member == 3))
+        self.assertEqual(self.ds.grep('config', dict(member=0, term=6)),
+                         reference('config', lambda k: k.member == 0 and k.term == 6))
+        self.assertEqual(self.ds.grep('field', dict(name='n001')),
+                         reference('field', lambda k: k.name == 'n001'))
+        self.assertEqual(self.ds.grep('field', dict(name='n001', member=2)), dict())
+        self.assertEqual(self.ds.grep('field', dict(unknown=1)), dict())
+        self.assertEqual(self.ds.grep('unknown', dict()), dict())
+        # Predicates
+        self.assertEqual(self.ds.grep('field', dict(term=DataStoreRange(3, 5), member=1)),
+                         reference('field', lambda k: 3 <= k.term <= 5 and k.member == 1))
+        self.assertEqual(self.ds.grep('field', dict(term=DataStoreRange(end=2))),
+                         reference('field', lambda k: k.term <= 2))
+        self.assertEqual(self.ds.grep('field', dict(name=DataStorePrefix('n01'))),
+                         reference('field', lambda k: k.name.startswith('n01')))
+        self.assertEqual(self.ds.grep('field', dict(name=DataStoreRange(5, 6))), dict())
+        self.assertEqual(self.ds.grep('field', dict(term=DataStorePrefix('n'))), dict())
+        # Streaming
+        streamed = self.ds.grep_iter('config', dict(member=0))
+        self.assertNotIsInstance(streamed, dict)
+        self.assertEqual(dict(streamed), reference('config', lambda k: k.member == 0))
+        with self.assertRaises(ValueError):
+            list(self.ds.grep_iter('config', [1, ]))
+        # Deletions (the index shrinks) and insertions (ids are recycled)
+        self.ds.grep_delete('field', dict(term=DataStoreRange(1, 23)))
+        self.assertEqual(len(self.ds), 100 + 33)
+        self.assertEqual(self.ds.grep('field', dict()),
+                         reference('field', lambda k: True))
+        self.ds.insert('field', dict(term=99, member=1, name='new'), 'new')
+        self.assertEqual(self.ds.grep('field', dict(term=DataStoreRange(50))),
+                         reference('field', lambda k: k.term == 99))
+        self.assertEqual(self.ds.grep('field', dict(member=1)),
+                         reference('field', lambda k: k.member == 1))
+        # Modifications while streaming
+        for k, _ in self.ds.grep_iter('config', dict()):
+            self.ds.delete(k.kind, k.extras)
+            self.ds.insert('field', dict(term=-1, member=0, name=k.name), None)
+        self.assertEqual(self.ds.grep('config', dict()), dict())
+        self.assertEqual(len(self.ds.grep('field', dict(term=-1))), 100)
+        # Deletions and insertions (of recycled ids) before any search
+        ds = DataStore()
+        for i in range(1000):
+            ds.insert('field', dict(member=i % 5, uid=i), i, readonly=False)
+        for i in range(0, 1000, 3):
+            ds.delete('field', dict(member=i % 5, uid=i))
+        for i in range(0, 1000, 6):
+            ds.insert('field', dict(member=i % 5, uid=-i), -i, readonly=False)
+        self.assertEqual(len(ds), 1000 - 334 + 167)
+        self.assertEqual(ds.grep('field', dict(member=2)), {k: v for k, v in ds if k.member == 2})
+        self.assertEqual(ds.grep('field', dict(uid=-6)), {ds._build_key('field', dict(member=1, uid=-6)): -6})
+        # Unsortable values
+        self.ds.insert('mixed', dict(value=1), 1)
+        self.ds.insert('mixed', dict(value='a1'), 2)
+        self.assertEqual(list(self.ds.grep('mixed', dict(value=DataStorePrefix('a'))).values()), [2, ])
+        self.assertEqual(list(self.ds.grep('mixed', dict(value=DataStoreRange(0, 2))).values()), [1, ])
+
+    def assertSameStore(self, ds1, ds2):
+        self.assertSetEqual(set(ds1.keys()), set(ds2.keys()))
+        for k, v in ds1:
+            v2 = ds2.get(k.kind, k.extras)
+            if isinstance(v, Counted):
+                self.assertEqual(v.value, v2.value)
+            else:
+                self.assertEqual(v, v2)
+
+    def test_datastore_journal(self):
+        for i in range(20):
+            self.ds.insert('counted', dict(i=i), Counted(i), readonly=bool(i % 2))
+        self.ds.insert('vortex_free_store', dict(storage='alose.meteo.fr'), dict(blabla=4))
+        tmpdir = tempfile.mkdtemp(suffix='test_datastore_journal')
+        try:
+            jfile = os.path.join(tmpdir, 'toto.journal')
+            self.ds.journal_checkpoint(jfile)
+            self.assertTrue(os.path.exists(jfile + '.index'))
+            size = os.path.getsize(jfile)
+            # Checkpoints only append the changes
+            self.ds.insert('counted', dict(i=0), Counted(-1), readonly=False)
+            self.ds.delete('counted', dict(i=2))
+            self.ds.insert('new', dict(), 'new')
+            self.ds.journal_checkpoint(jfile)
+            self.assertLess(os.path.getsize(jfile), 2 * size)
+            self.ds.journal_checkpoint(jfile)
+            # Lazy load
+            Counted.unpickled = 0
+            ds2 = DataStore(default_journalfile=jfile)
+            ds2.journal_load()
+            self.assertEqual(Counted.unpickled, 0)
+            self.assertEqual(len(ds2), 21)
+            self.assertEqual(len(ds2.grep('counted', dict())), 19)
+            self.assertEqual(len(ds2.grep('counted', dict(i=2))), 0)
+            self.assertEqual(Counted.unpickled, 19)
+            self.assertEqual(ds2.get('counted', dict(i=0)).value, -1)
+            self.assertSameStore(self.ds, ds2)
+            with self.assertRaises(RuntimeError):
+                ds2.insert('counted', dict(i=1), 'readonly is preserved')
+            ds2.insert('counted', dict(i=0), 'readwrite is preserved')
+            # Changes on the reloaded DataStore
+            ds2.delete('new', dict(), force=True)
+            ds2.journal_checkpoint()
+            # A truncated/corrupted record at the end of the journal is ignored
+            with open(jfile, 'ab') as fhj:
+                fhj.write(pickle.dumps(('i', next(iter(ds2.keys())), False, 10), protocol=4)[:-5])
+            ds3 = DataStore()
+            ds3.journal_load(jfile)
+            self.assertSameStore(ds2, ds3)
+            ds3.insert('new', dict(again=True), 'new')
+            ds3.journal_checkpoint(jfile)
+            # Something that is not a record at the end of the journal is ignored
+            with open(jfile, 'ab') as fhj:
+                fhj.write(pickle.dumps(42, protocol=4))
+            # Without the index snapshot, the whole journal is replayed
+            os.remove(jfile + '.index')
+            ds4 = DataStore()
+            ds4.journal_load(jfile)
+            self.assertSameStore(ds3, ds4)
+            self.assertEqual(len(ds4.grep('new', dict(again=True))), 1)
+            # Compaction
+            size = os.path.getsize(jfile)
+            ds4.journal_compact(jfile)
+            self.assertLess(os.path.getsize(jfile), size)
+            ds5 = DataStore()
+            ds5.journal_load(jfile)
+            self.assertSameStore(ds4, ds5)
+            # The journal may be moved elsewhere (lazy payloads are copied)
+            jfile2 = os.path.join(tmpdir, 'titi.journal')
+            ds5.journal_checkpoint(jfile2)
+            ds6 = DataStore()
+            ds6.journal_load(jfile2)
+            self.assertSameStore(ds4, ds6)
+            self.assertEqual(len(ds6.grep('counted', dict(i=DataStoreRange(5, 9)))), 5)
+            # The journal file is compacted by another DataStore: lazy payloads can't be read
+            ds_other = DataStore()
+            ds_other.journal_load(jfile2)
+            ds6.journal_compact(jfile2)
+            with self.assertRaises(RuntimeError):
+                ds_other.get('counted', dict(i=0))
+            ds_other.insert('new', dict(other=True), 'new')
+            with self.assertRaises(RuntimeError):
+                ds_other.journal_checkpoint(jfile2)
+            ds_other.journal_load(jfile2)
+            self.assertSameStore(ds6, ds_other)
+            # Automatic compaction
+            ds7 = SmallJournalDataStore()
+            ds7.journal_checkpoint(jfile)
+            for i in range(20):
+                ds7.insert('stuff', dict(), i, readonly=False)
+                ds7.journal_checkpoint(jfile)
+            self.assertLess(os.path.getsize(jfile), 2 * size)
+            ds8 = DataStore()
+            ds8.journal_load(jfile)
+            self.assertSameStore(ds7, ds8)
+            # Inplace overwrite
+            ds7.insert('parasite', dict(), Parasite(toto='is here'))
+            ds7.journal_checkpoint(jfile)
+            para_one = ds8.insert('parasite', dict(), Parasite(toto='is not here'))
+            ds8.journal_load(jfile)
+            self.assertIs(ds8.get('parasite', dict()), para_one)
+            self.assertEqual(para_one.mydata, dict(toto='is here'))
+            # Not a journal
+            self.ds.pickle_dump(jfile)
+            with self.assertRaises(ValueError):
+                ds8.journal_load(jfile)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class TestThreadSafeDataStore(TestDataStore):
+
+    def setUp(self):
+        self.ds = ThreadSafeDataStore()
+
+    def test_datastore_threads(self):
+
+        def worker(n):
+            for i in range(200):
+                self.ds.get('stuff', dict(i=i % 50), default_payload=[i, ], readonly=True)
+                self.ds.insert('mine', dict(worker=n, i=i), i, readonly=False)
+                self.assertEqual(len(self.ds.grep('mine', dict(worker=n, i=DataStoreRange(i, i)))), 1)
+                if i % 2:
+                    self.ds.delete('mine', dict(worker=n, i=i))
+            self.ds.grep_delete('mine', dict(worker=n, i=DataStoreRange(0, 99)))
+
+        threads = [threading.Thread(target=worker, args=(n, )) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.ds.grep('stuff', dict())), 50)
+        for n in range(4):
+            self.assertEqual(sorted(self.ds.grep('mine', dict(worker=n)).values()),
+                             list(range(100, 200, 2)))
+
+
+class TestBoundedDataStore(TestDataStore):
+
+    def setUp(self):
+        self.ds = BoundedDataStore()
+
+    def assertKinds(self, ds, kinds):
+        self.assertEqual(sorted([k.kind for k in ds.keys()]), sorted(kinds))
+
+    def test_boundeddatastore_lru(self):
+        ds = BoundedDataStore(maxitems=3)
+        for kind in 'abc':
+            ds.insert(kind, dict(), kind, readonly=False)
+        ds.get('a', dict())
+        ds.insert('d', dict(), 'd', readonly=False)
+        self.assertKinds(ds, 'acd')
+        # Read-write entries are evicted first
+        ds.insert('e', dict(), 'e', readonly=True)
+        ds.insert('f', dict(), 'f', readonly=True)
+        self.assertKinds(ds, 'def')
+        ds.insert('g', dict(), 'g', readonly=True)
+        self.assertKinds(ds, 'efg')
+        # Stats
+        self.assertEqual(ds.get('h', dict(), default_payload='h'), 'h')
+        self.assertKinds(ds, 'fgh')
+        with self.assertRaises(KeyError):
+            ds.get('a', dict())
+        self.assertEqual(ds.stats(), (1, 2, 5, 0, 3, ds.stats().size))
+        ds.reset_stats()
+        self.assertEqual(ds.stats().hits, 0)
+        # Read-only entries may be preserved
+        ds = BoundedDataStore(maxitems=2, evict_readonly=False)
+        for kind in 'abc':
+            ds.insert(kind, dict(), kind, readonly=True)
+        self.assertEqual(len(ds), 3)
+        ds.insert('d', dict(), 'd', readonly=False)
+        self.assertKinds(ds, 'abc')
+        with self.assertRaises(ValueError):
+            BoundedDataStore(policy='unknown')
+        with self.assertRaises(ValueError):
+            BoundedDataStore(maxitems=-1)
+
+    def test_boundeddatastore_lfu(self):
+        ds = BoundedDataStore(maxitems=3, policy='lfu')
+        for kind in 'abc':
+            ds.insert(kind, dict(), kind, readonly=False)
+        for _ in range(3):
+            ds.get('a', dict())
+        ds.get('b', dict())
+        ds.get('c', dict())
+        ds.get('c', dict())
+        ds.insert('d', dict(), 'd', readonly=False)
+        self.assertKinds(ds, 'acd')
+        ds.insert('e', dict(), 'e', readonly=False)
+        self.assertKinds(ds, 'ace')
+        for _ in range(200):
+            ds.get('e', dict())
+        ds.insert('f', dict(), 'f', readonly=False)
+        self.assertKinds(ds, 'aef')
+        self.assertEqual(ds.policy, 'lfu')
+
+    def test_boundeddatastore_quotas_size(self):
+        ds = BoundedDataStore(maxsize=10, quotas=dict(config=2), sizer=len)
+        for i in range(4):
+            ds.insert('config', dict(i=i), 'c', readonly=False)
+        self.assertEqual(sorted([k.i for k in ds.grep('config', dict())]), [2, 3])
+        ds.insert('field', dict(), '12345678', readonly=False)
+        self.assertEqual(ds.stats().size, 10)
+        ds.insert('field', dict(), '123456789', readonly=False)
+        self.assertEqual(ds.stats().size, 10)
+        self.assertKinds(ds, ['config', 'field'])
+        ds.insert('field', dict(big=True), '12345678901', readonly=False)
+        self.assertEqual(len(ds), 0)
+        self.assertEqual(ds.stats().evictions, 6)
+        # The default sizer
+        ds = BoundedDataStore(maxsize=100000)
+        ds.insert('a', dict(), ['x' * 40000, ], readonly=False)
+        ds.insert('b', dict(), dict(y='x' * 40000), readonly=False)
+        ds.insert('c', dict(), Parasite(data='x' * 40000), readonly=False)
+        self.assertKinds(ds, 'bc')
+
+    def test_boundeddatastore_ttl(self):
+        now = [0.]
+        ds = BoundedDataStore(ttl=10)
+        ds._clock = lambda: now[0]
+        ds.insert('a', dict(), 'a', readonly=False)
+        now[0] = 5.
+        ds.insert('b', dict(), 'b', readonly=True)
+        now[0] = 9.
+        self.assertEqual(ds.get('a', dict()), 'a')
+        now[0] = 11.
+        self.assertFalse(ds.check('a', dict()))
+        self.assertTrue(ds.check('b', dict()))
+        ds.insert('a', dict(), 'a', readonly=False)
+        now[0] = 16.
+        self.assertKinds(ds, 'a')
+        self.assertEqual(ds.stats().expirations, 2)
+        ds = BoundedDataStore(ttl=10, evict_readonly=False)
+        ds._clock = lambda: now[0]
+        ds.insert('a', dict(), 'a', readonly=True)
+        ds.insert('b', dict(), 'b', readonly=False)
+        now[0] = 30.
+        self.assertKinds(ds, 'a')
+
+    def test_boundeddatastore_load(self):
+        tmpdir = tempfile.mkdtemp(suffix='test_boundeddatastore_load')
+        try:
+            for i in range(10):
+                self.ds.insert('stuff', dict(i=i), i, readonly=False)
+            self.ds.journal_checkpoint(os.path.join(tmpdir, 'toto.journal'))
+            self.ds.pickle_dump(os.path.join(tmpdir, 'toto.pickled'))
+            ds = BoundedDataStore(maxitems=5)
+            ds.journal_load(os.path.join(tmpdir, 'toto.journal'))
+            self.assertEqual(len(ds), 5)
+            self.assertEqual(ds.stats().evictions, 5)
+            ds = BoundedDataStore(quotas=dict(stuff=3))
+            ds.pickle_load(os.path.join(tmpdir, 'toto.pickled'))
+            self.assertEqual(len(ds), 3)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _shared_worker(args):
+    ds, n = args
+    for i in range(20):
+        ds.get('stuff', dict(i=i), default_payload=n, readonly=True)
+        ds.insert('mine', dict(worker=n, i=i), i, readonly=False)
+    return len(ds.grep('mine', dict(worker=n)))
+
+
+class TestSharedDataStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='test_shared_datastore')
+        self.ds = SharedDataStore(os.path.join(self.tmpdir, 'test.db'))
+
+    def tearDown(self):
+        self.ds.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_shareddatastore_basics(self):
+        hst1 = self.ds.insert('vortex_free_store', dict(storage='alose.meteo.fr'),
+                              dict(scrontch=4), readonly=True)
+        self.assertIs(self.ds.get('vortex_free_store', dict(storage='alose.meteo.fr')), hst1)
+        with self.assertRaises(RuntimeError):
+            self.ds.insert('vortex_free_store', dict(storage='alose.meteo.fr'), 'anything')
+        with self.assertRaises(KeyError):
+            self.ds.get('vortex_free_store', dict(storage='hendrix.meteo.fr'))
+        with self.assertRaises(ValueError):
+            self.ds.get('vortex_free_store', ['storage', ])
+        hst2 = self.ds.get('vortex_free_store', dict(storage='hendrix.meteo.fr'),
+                           default_payload=dict(blabla=9), readonly=False)
+        self.assertEqual(hst2, dict(blabla=9))
+        self.assertTrue(self.ds.check('vortex_free_store', dict(storage='hendrix.meteo.fr')))
+        self.assertFalse(self.ds.check('vortex_free_store', dict()))
+        self.ds.insert('vortex_free_store', dict(storage='hendrix.meteo.fr'), dict(blabla=8))
+        for i in range(10):
+            self.ds.insert('numbered', dict(i=i, parity=i % 2, name='n{:d}'.format(i)), i,
+                           readonly=bool(i % 2))
+        self.assertEqual(len(self.ds), 12)
+        self.assertEqual(len(self.ds.keys()), 12)
+        self.assertEqual(len(list(self.ds)), 12)
+        self.assertIn('read-only', str(self.ds))
+        # Another view on the same database
+        ds2 = SharedDataStore(self.ds.dbfile)
+        self.assertEqual(ds2.get('vortex_free_store', dict(storage='hendrix.meteo.fr')),
+                         dict(blabla=8))
+        self.assertSetEqual(set(ds2.keys()), set(self.ds.keys()))
+        self.assertEqual(sorted(ds2.grep('numbered', dict(parity=1)).values()), [1, 3, 5, 7, 9])
+        self.assertEqual(sorted(ds2.grep('numbered', dict(i=DataStoreRange(2, 4))).values()), [2, 3, 4])
+        self.assertEqual(sorted(ds2.grep('numbered', dict(parity=0, i=DataStoreRange(5))).values()), [6, 8])
+        self.assertEqual(ds2.grep('numbered', dict(name=DataStorePrefix('n1'))),
+                         {k: 1 for k in ds2.grep('numbered', dict(i=1))})
+        self.assertEqual(ds2.grep('numbered', dict(unknown=1)), dict())
+        self.assertEqual(ds2.grep('unknown', dict()), dict())
+        # Deletions
+        with self.assertRaises(RuntimeError):
+            ds2.delete('numbered', dict(i=1, parity=1, name='n1'))
+        with self.assertRaises(KeyError):
+            ds2.delete('numbered', dict(i=1))
+        ds2.delete('numbered', dict(i=1, parity=1, name='n1'), force=True)
+        with self.assertRaises(RuntimeError):
+            ds2.grep_delete('numbered', dict())
+        self.assertEqual(len(ds2), 11)
+        self.assertEqual(sorted(ds2.grep_delete('numbered', dict(parity=0)).values()), [0, 2, 4, 6, 8])
+        self.assertEqual(sorted(self.ds.grep('numbered', dict()).values()), [3, 5, 7, 9])
+        ds2.close()
+
+    def test_shareddatastore_canonical_keys(self):
+        # Equal keys are identified whatever the identity of the objects...
+        x = 'ab' * 3
+        y = ''.join(['ab'] * 3)
+        self.ds.insert('k', dict(a=x, b=x), 1, readonly=False)
+        self.assertTrue(self.ds.check('k', dict(a=x, b=y)))
+        self.assertEqual(self.ds.get('k', dict(a=y, b=y)), 1)
+        self.ds.insert('k', dict(a=x, b=y), 2, readonly=False)
+        self.assertEqual(len(self.ds), 1)
+        self.assertEqual(list(self.ds.grep('k', dict(a=y)).values()), [2, ])
+        # ...or the iteration order of frozensets
+        fs1 = frozenset([1, 2 ** 61])
+        fs2 = frozenset([2 ** 61, 1])
+        self.assertNotEqual(list(fs1), list(fs2))
+        self.ds.insert('k', dict(a=(fs1, x)), 3, readonly=False)
+        self.assertTrue(self.ds.check('k', dict(a=(fs2, y))))
+        self.assertEqual(list(self.ds.grep('k', dict(a=(fs2, y))).values()), [3, ])
+        self.assertEqual(len(self.ds), 2)
+        key = self.ds.grep('k', dict(a=(fs2, y))).popitem()[0]
+        self.assertIs(type(key.a[0]), frozenset)
+        self.assertEqual(key.a, (fs1, x))
+
+    def test_shareddatastore_processes(self):
+        with multiprocessing.Pool(3) as pool:
+            self.assertEqual(pool.map(_shared_worker, [(self.ds, n) for n in range(6)]), [20, ] * 6)
+        self.assertEqual(len(self.ds.grep('stuff', dict())), 20)
+        self.assertEqual(len(self.ds.grep('mine', dict())), 120)
+        self.assertTrue(set(self.ds.grep('stuff', dict()).values()) <= set(range(6)))
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -1,8 +1,15 @@
+import copy
 from decimal import Decimal
 import io
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
 from unittest import TestCase, skipUnless, main
 
 from bronx.datagrip import namelist
+from bronx.stdtypes import tracking
 import re
 
 
@@ -191,6 +198,49 @@ class UtFortranNamelist(TestCase):
         self._encode_tester(np.complex128(complex(0.01258963557898965, 0.01258963557898965)),
                             '(0.0125896355789896,0.0125896355789896)')
 
+    @skipUnless(namelist.npchecker.is_available(), 'NumPy is not available.')
+    def test_encode_np_array(self):
+        import numpy as np
+        reals = [0., -0., 1., -100., 1e15, 1e16, 1e-5, 1e-4, 1e-30, 1e30, 222.5125,
+                 0.01258963557898961, 1.2345432123454321e-06, 999999999999999.9]
+        for dtype in (np.float32, np.float64, np.complex64, np.complex128):
+            values = np.array(reals, dtype=dtype)
+            if values.dtype.kind == 'c':
+                values += 1j * values[::-1]
+            self.assertEqual(self.lp.encode_array(values),
+                             ','.join([self.lp.encode(v) for v in values]))
+        values = np.array([0., -0., 1., -100., 1e-5, 1e-4, 0.01258963557898961, 222.5, 1000.],
+                          dtype=np.float16)
+        self.assertEqual(self.lp.encode_array(values),
+                         ','.join([self.lp.encode(v) for v in values]))
+        for dtype in (np.int8, np.int64, np.uint16):
+            values = np.arange(20, dtype=dtype)
+            self.assertEqual(self.lp.encode_array(values),
+                             ','.join([self.lp.encode(v) for v in values]))
+        self.assertEqual(self.lp.encode_array(np.array([True, False])), '.TRUE.,.FALSE.')
+        self.assertEqual(self.lp.encode_array(np.array(['a', "b'c"])), "'a',\"b'c\"")
+        self.assertEqual(self.lp.encode_array(np.array([[1, 2], [3, 4]])), '1,3,2,4')
+
+    @skipUnless(namelist.npchecker.is_available(), 'NumPy is not available.')
+    def test_parse_np_array(self):
+        import numpy as np
+        values = self.lp.parse_array(' 1, +2 ,\n-3_8 ')
+        self.assertEqual(values.dtype, np.int64)
+        self.assertListEqual(values.tolist(), [1, 2, -3])
+        values = self.lp.parse_array('1., -.5d0 ,3E2_8,1D-2')
+        self.assertEqual(values.dtype, np.float64)
+        self.assertListEqual(values.tolist(), [1., -.5, 300., 0.01])
+        values = self.lp.parse_array('T, .false., .TRUE._4, F')
+        self.assertEqual(values.dtype, bool)
+        self.assertListEqual(values.tolist(), [True, False, True, False])
+        for badrun in ('1, 2.', '1,,2', 'a', ''):
+            with self.assertRaises(ValueError):
+                self.lp.parse_array(badrun)
+        with self.assertRaises(ValueError):
+            self.lp.parse_real_array('1, 2')
+        with self.assertRaises(ValueError):
+            self.lp.parse_integer_array('1., 2.')
+
     def test_namblock(self):
         np = namelist.NamelistParser(macros=('MYMACRO1', 'MYMACRO2'))
         nb_res = np.parse(NAMBLOCK1).as_dict()['MYNAMELISTTEST']
@@ -359,6 +409,383 @@ C='Trash',
         self.assertTrue(re.search('M2=MYMACRO2,', nset.dumps()))
         self.assertTrue(re.search('M3=__SOMETHINGNEW__,', nset.dumps()))
 
+    def test_namparser_large(self):
+        # A large synthetic namelist: the tokenizer should cope with it easily
+        nset = namelist.NamelistSet()
+        for ib in range(50):
+            nb = nset.newblock('NAMBLOCK{:03d}'.format(ib))
+            for iv in range(100):
+                nb['I{:d}'.format(iv)] = list(range(iv, iv + 5))
+                nb['R{:d}'.format(iv)] = Decimal('{:d}.5'.format(iv))
+                nb['S{:d}(1)'.format(iv)] = 'String/{:d}'.format(iv)
+                nb['L{:d}'.format(iv)] = bool(iv % 2)
+                nb['M{:d}'.format(iv)] = '__MYMACRO__'
+            nb.todelete('GRUIK')
+        source = nset.dumps().replace('/\n', '! comment\n   GRUIK=--,\n /\n')
+        np = namelist.NamelistParser()
+        nset_bis = np.parse(source)
+        self.assertEqual(list(nset_bis.keys()), list(nset.keys()))
+        for bname, nb in nset.items():
+            nb_bis = nset_bis[bname]
+            self.assertEqual(list(nb_bis.keys()), list(nb.keys()))
+            self.assertEqual(nb_bis.pool(), nb.pool())
+            self.assertSetEqual(nb_bis.rmkeys(), {'GRUIK'})
+            self.assertSetEqual(set(nb_bis.macros()), {'MYMACRO'})
+        self.assertEqual(nset_bis.dumps(), nset.dumps())
+        # The remaining part of the source is still available at the block level
+        nb, remaining = np._namelist_block_parse('&NAM1 A=1, /end &NAM2 B=2 /')
+        self.assertEqual(nb.A, 1)
+        self.assertEqual(remaining, ' &NAM2 B=2 /')
+        with self.assertRaises(ValueError):
+            np.parse('&NAM1 A=1, B=?, /')
+
+    def test_namparser_buffer(self):
+        np = namelist.NamelistParser(macros=('NBPROC', ))
+        nset_ref = np.parse(DIRTYNAM)
+        for buf in (DIRTYNAM.encode('utf-8'), bytearray(DIRTYNAM.encode('utf-8'))):
+            nset = np.parse(buf)
+            self.assertEqual(nset.dumps(), CLEANEDNAM)
+            self.assertEqual(nset, nset_ref)
+        nset = np.parse_buffer("&NAMUTF8 S='Température', A=2*1 /".encode('utf-8'))
+        self.assertEqual(nset['NAMUTF8'].S, 'Température')
+        self.assertEqual(nset['NAMUTF8'].A, [1, 1])
+        with self.assertRaises(ValueError):
+            np.parse_buffer(b'&NAM1 A=1, B=?, /')
+        with self.assertRaises(ValueError):
+            np.parse_buffer(DIRTYNAM)
+        # Memory-mapped files
+        tmpdir = tempfile.mkdtemp(prefix='test_namparser_buffer_')
+        try:
+            nam_path = os.path.join(tmpdir, 'namelist')
+            with open(nam_path, 'w', encoding='utf-8') as fhnam:
+                fhnam.write(DIRTYNAM)
+            self.assertEqual(np.parse_mmap(nam_path).dumps(), CLEANEDNAM)
+            with open(nam_path, 'rb') as fhnam:
+                self.assertEqual(np.parse_mmap(fhnam).dumps(), CLEANEDNAM)
+            empty_path = os.path.join(tmpdir, 'empty')
+            with open(empty_path, 'w'):
+                pass
+            self.assertEqual(len(np.parse_mmap(empty_path)), 0)
+            # The cache key does not depend on the source type
+            cache = namelist.NamelistParserCache()
+            np = namelist.NamelistParser(macros=('NBPROC', ), cache=cache)
+            np.parse(DIRTYNAM)
+            self.assertEqual(np.parse_mmap(nam_path).dumps(), CLEANEDNAM)
+            self.assertEqual(cache.hits, 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_namparser_cache(self):
+        tmpdir = tempfile.mkdtemp(suffix='test_namelist_cache')
+        try:
+            cache = namelist.NamelistParserCache(maxsize=2, cachedir=tmpdir)
+            np = namelist.NamelistParser(macros=('NBPROC', ), cache=cache)
+            self.assertIs(np.cache, cache)
+            nset = np.parse(DIRTYNAM)
+            self.assertEqual(cache.stats(), dict(size=1, hits=0, disk_hits=0, misses=1))
+            nset['MySecondOne'].C = False
+            nset_bis = np.parse(DIRTYNAM)
+            self.assertEqual(cache.stats(), dict(size=1, hits=1, disk_hits=0, misses=1))
+            self.assertIsNot(nset_bis, nset)
+            self.assertIs(nset_bis['MySecondOne'].C, True)
+            self.assertFalse(nset_bis.dumps_needs_update)
+            self.assertEqual(nset_bis.dumps(), CLEANEDNAM)
+            # File objects and physical files are dealt with the same way
+            nset_bis = np.parse(io.StringIO(DIRTYNAM))
+            self.assertEqual(cache.hits, 2)
+            tmpfile = os.path.join(tmpdir, 'namelist_file')
+            with open(tmpfile, 'w') as fhn:
+                fhn.write(DIRTYNAM)
+            nset_bis = np.parse(tmpfile)
+            self.assertEqual(cache.hits, 3)
+            # The parser's configuration matters
+            np.addmacro('ANOTHERONE')
+            np.parse(DIRTYNAM)
+            np_bis = namelist.NamelistParser(macros=('NBPROC', ), re_comma=r"[ \n]*,", cache=cache)
+            np_bis.parse(DIRTYNAM)
+            self.assertEqual(cache.stats(), dict(size=2, hits=3, disk_hits=0, misses=3))
+            # LRU eviction... but entries are still available on disk
+            namelist.NamelistParser(macros=('NBPROC', ), cache=cache).parse(DIRTYNAM)
+            self.assertEqual(cache.stats(), dict(size=2, hits=3, disk_hits=1, misses=3))
+            # A new cache object may re-use the on-disk cache
+            cache = namelist.NamelistParserCache(cachedir=tmpdir)
+            nset_bis = namelist.namparse(DIRTYNAM, macros=('NBPROC', ), cache=cache)
+            self.assertEqual(cache.stats(), dict(size=1, hits=0, disk_hits=1, misses=0))
+            self.assertEqual(nset_bis.dumps(), CLEANEDNAM)
+            cache.clear(disk=True)
+            self.assertEqual(len(cache), 0)
+            namelist.namparse(DIRTYNAM, macros=('NBPROC', ), cache=cache)
+            self.assertEqual(cache.misses, 1)
+            # Temporary files are cleaned up when something goes wrong
+            cache.clear(disk=True)
+            with self.assertRaises(TypeError):
+                cache._disk_save('failing', 'not a bytes object')
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['namelist_file'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_namparser_parse_many(self):
+        tmpdir = tempfile.mkdtemp(suffix='test_namelist_parse_many')
+        try:
+            tmpfile = os.path.join(tmpdir, 'namelist_file')
+            with open(tmpfile, 'w') as fhn:
+                fhn.write(DIRTYNAM)
+            objs = [DIRTYNAM, tmpfile, io.StringIO(DIRTYNAM), '&NAM1 A=1, / &NAM2 B=2 /']
+            with open(tmpfile, 'rb') as fhn, mmap.mmap(fhn.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                for workers in (1, 3):
+                    np = namelist.NamelistParser(macros=('NBPROC', ))
+                    nsets = np.parse_many(objs + [DIRTYNAM.encode(), buf], workers=workers)
+                    self.assertEqual(len(nsets), 6)
+                    for nset in nsets[:3] + nsets[4:]:
+                        self.assertFalse(nset.dumps_needs_update)
+                        self.assertEqual(nset.dumps(), CLEANEDNAM)
+                    self.assertEqual(nsets[3]['NAM2'].B, 2)
+                    # Duplicates are parsed once but each of them gets its own object
+                    self.assertIsNot(nsets[0], nsets[1])
+                    nsets[0]['MySecondOne'].C = False
+                    self.assertIs(nsets[1]['MySecondOne'].C, True)
+                    self.assertIsNot(nsets[4], nsets[5])
+            for workers in (1, 3):
+                np = namelist.NamelistParser(macros=('NBPROC', ))
+                # Errors are reported file by file
+                with self.assertRaises(namelist.NamelistBatchParsingError) as cm:
+                    np.parse_many(objs + [os.path.join(tmpdir, 'missing'), '&NAM1 A=?, /'],
+                                  workers=workers)
+                self.assertListEqual(list(cm.exception.errors.keys()), [4, 5])
+                self.assertIsInstance(cm.exception.errors[4], OSError)
+                self.assertIsInstance(cm.exception.errors[5], ValueError)
+                self.assertEqual(cm.exception.results[3]['NAM1'].A, 1)
+                self.assertIs(cm.exception.results[4], None)
+            # With a cache
+            cache = namelist.NamelistParserCache()
+            np = namelist.NamelistParser(macros=('NBPROC', ), cache=cache)
+            np.parse(DIRTYNAM)
+            nsets = np.parse_many(objs + [DIRTYNAM.encode()], workers=2)
+            self.assertEqual(cache.stats(), dict(size=2, hits=2, disk_hits=0, misses=2))
+            self.assertEqual(nsets[2].dumps(), CLEANEDNAM)
+            self.assertEqual(nsets[4].dumps(), CLEANEDNAM)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_namset_dumps_cache(self):
+        np = namelist.NamelistParser(macros=('NBPROC', ))
+        nset = np.parse(DIRTYNAM)
+        self.assertEqual(nset.dumps(), CLEANEDNAM)
+        nb = nset['MyNamelistTest']
+        # The cache must not be fooled by any kind of modification
+        nb.A = 1
+        self.assertIn('   A=1,\n', nset.dumps())
+        nb.A = True
+        self.assertIn('   A=.TRUE.,\n', nset.dumps())
+        nb.pool()['A'].append(2)
+        self.assertIn('   A=.TRUE.,2,\n', nset.dumps())
+        nb.pool()['A'][1] = 3
+        self.assertIn('   A=.TRUE.,3,\n', nset.dumps())
+        del nb.A
+        self.assertNotIn('   A=', nset.dumps())
+        nset.setmacro('NBPROC', 16)
+        self.assertIn('   STEST=16,\n', nset.dumps())
+        nb.set_name('MYNEWNAME')
+        self.assertIn(' &MYNEWNAME\n', nb.dumps())
+        nb.set_name('MyNamelistTest')
+        nb.clear()
+        self.assertEqual(nb.dumps(), ' &MYNAMELISTTEST\n /\n')
+        delta = namelist.NamelistBlock('MyNamelistTest')
+        delta.B = 5
+        nb.merge(delta)
+        self.assertEqual(nb.dumps(), ' &MYNAMELISTTEST\n   B=5,\n /\n')
+        # Sorting options are taken into account
+        nset = np.parse(DIRTYNAM)
+        self.assertEqual(nset.dumps(), CLEANEDNAM)
+        self.assertEqual(nset.dumps(sorting=namelist.FIRST_ORDER_SORTING), CLEANEDNAM_SORTED1)
+        self.assertEqual(nset.dumps(sorting=namelist.SECOND_ORDER_SORTING), CLEANEDNAM_SORTED2)
+        self.assertEqual(nset.dumps(), CLEANEDNAM)
+        # In place modifications that do not change the value (in the Python sense)
+        nb = namelist.namparse('&NAM1 A=1, B=2 /')['NAM1']
+        self.assertIn('   A=1,\n', nb.dumps())
+        nb.pool()['A'][0] = True
+        self.assertIn('   A=.TRUE.,\n', nb.dumps())
+        nb.pool()['A'][0] = 1
+        self.assertIn('   A=1,\n', nb.dumps())
+        nb.pool()['A'][0] = 1.
+        self.assertIn('   A=1.,\n', nb.dumps())
+        self.assertTrue(nb.dumps_needs_update)
+        # Streaming to a File-like object
+        fhout = io.StringIO()
+        nset.dump(fhout, sorting=namelist.FIRST_ORDER_SORTING)
+        self.assertEqual(fhout.getvalue(), CLEANEDNAM_SORTED1)
+        fhout = io.StringIO()
+        nset.dump(fhout, block_sorting=False)
+        self.assertEqual(fhout.getvalue(),
+                         ''.join([nset[b].dumps() for b in ('MYSECONDONE', 'MYNAMELISTTEST')]))
+
+    def test_namset_diff(self):
+        np = namelist.NamelistParser(macros=('NBPROC', ))
+        ref = np.parse(DIRTYNAM)
+        other = np.parse(DIRTYNAM)
+        delta = ref.diff(other)
+        self.assertEqual(len(delta), 0)
+        self.assertSetEqual(delta.unchanged, {'MYSECONDONE', 'MYNAMELISTTEST'})
+        # Various modifications
+        nb = other['MyNamelistTest']
+        nb.A = [25, 31]
+        nb.NEWVAR = 'New'
+        del nb.X
+        nb.addmacro('NBPROC', 4)
+        del other['MySecondOne']
+        other.newblock('MyThirdOne').D = 1
+        delta = ref.diff(other)
+        self.assertSetEqual(delta.deleted, {'MYSECONDONE'})
+        self.assertSetEqual(delta.created, {'MYTHIRDONE'})
+        self.assertSetEqual(delta.updated, {'MYNAMELISTTEST'})
+        self.assertIs(delta.created_data['MYTHIRDONE'], other['MyThirdOne'])
+        btracker = delta.updated_data['MYNAMELISTTEST']
+        self.assertSetEqual(btracker.created, {'NEWVAR'})
+        self.assertSetEqual(btracker.deleted, {'X'})
+        self.assertSetEqual(btracker.updated, {'A'})
+        self.assertEqual(btracker.updated_data['A'], ([25, 30], [25, 31]))
+        # Same result as the "generic" recursive tracker
+        generic = tracking.RecursiveMappingTracker(ref.as_dict(), other.as_dict())
+        self.assertEqual(delta.dump_str('updated'), generic.dump_str('updated'))
+        # The delta can be merged
+        ref.merge(delta)
+        self.assertEqual(ref.dumps(), other.dumps())
+        self.assertEqual(len(ref.diff(other)), 0)
+        fresh = np.parse(DIRTYNAM)
+        fresh.merge(delta.as_namelistset(), rmblocks=delta.deleted)
+        self.assertEqual(fresh.dumps(), other.dumps())
+        # Macros values and keys to be deleted are also compared
+        ref = np.parse(DIRTYNAM)
+        other = np.parse(DIRTYNAM)
+        other.setmacro('NBPROC', 8)
+        delta = ref.diff(other)
+        self.assertSetEqual(delta.updated, {'MYNAMELISTTEST'})
+        self.assertEqual(len(delta.updated_data['MYNAMELISTTEST']), 0)
+        ref.merge(delta.as_namelistset())
+        self.assertIn('   STEST=8,\n', ref.dumps())
+        self.assertEqual(ref.dumps(), other.dumps())
+        self.assertEqual(len(ref.diff(other)), 0)
+        other['MySecondOne'].todelete('Z')
+        delta = ref.diff(other)
+        self.assertSetEqual(delta.updated, {'MYSECONDONE'})
+        ref.merge(delta.as_namelistset())
+        self.assertSetEqual(ref['MySecondOne'].rmkeys(), {'Z'})
+        self.assertEqual(len(ref.diff(other)), 0)
+
+    @skipUnless(namelist.npchecker.is_available(), 'NumPy is not available.')
+    def test_namset_diff_np_array(self):
+        import numpy as np
+        ref = namelist.NamelistSet()
+        ref.newblock('NAMARRAYS').R = np.arange(10.)
+        other = copy.deepcopy(ref)
+        self.assertEqual(len(ref.diff(other)), 0)
+        other['NAMARRAYS'].R[2] = 0.
+        other['NAMARRAYS'].INTS = np.arange(10)
+        delta = ref.diff(other)
+        self.assertSetEqual(delta.updated_data['NAMARRAYS'].updated, {'R'})
+        self.assertSetEqual(delta.updated_data['NAMARRAYS'].created, {'INTS'})
+        ref.merge(delta)
+        self.assertEqual(ref.dumps(), other.dumps())
+        other['NAMARRAYS'].R[2] = 5.
+        self.assertEqual(ref['NAMARRAYS'].R[2], 0.)
+
+    def test_namparser_repeat(self):
+        source = """\
+&NAMREPEAT
+  R=3*1.5, 2*'ab',
+  N=1,,3, Z=2*,
+  L=2*T, 1
+  M=NBPROC,NBPROC,4*1,
+/
+"""
+        np = namelist.NamelistParser(macros=('NBPROC', ))
+        nset = np.parse(source)
+        nb = nset['NAMREPEAT']
+        self.assertListEqual(nb.R, [Decimal('1.5'), ] * 3 + ['ab', 'ab'])
+        self.assertListEqual(nb.N, [1, namelist.NULL, 3])
+        self.assertListEqual(nb.Z, [namelist.NULL, namelist.NULL])
+        self.assertListEqual(nb.L, [True, True, 1])
+        with self.assertRaises(ValueError):
+            np.parse("&NAMREPEAT R=0*1.5 /")
+        self.assertEqual(nset.dumps(), """\
+ &NAMREPEAT
+   R=1.5,1.5,1.5,'ab','ab',
+   N=1,,3,
+   Z=,,
+   L=.TRUE.,.TRUE.,1,
+   M=NBPROC,NBPROC,1,1,1,1,
+ /
+""")
+        # Compressed output (macros are never compressed)
+        compressed = nset.dumps(compress=True)
+        self.assertEqual(compressed, """\
+ &NAMREPEAT
+   R=3*1.5,2*'ab',
+   N=1,,3,
+   Z=,,
+   L=2*.TRUE.,1,
+   M=NBPROC,NBPROC,4*1,
+ /
+""")
+        self.assertEqual(nset.dumps(), np.parse(compressed).dumps())
+        nset.setmacro('NBPROC', 2)
+        self.assertIn('   M=2,2,4*1,\n', nset.dumps(compress=True))
+        fhout = io.StringIO()
+        nset.dump(fhout, compress=True)
+        self.assertEqual(fhout.getvalue(), nset.dumps(compress=True))
+        # Null values survive a pickle or a deepcopy
+        self.assertIs(copy.deepcopy(nb.N)[1], namelist.NULL)
+        self.assertIs(pickle.loads(pickle.dumps(nb.N))[1], namelist.NULL)
+        # Large constant arrays
+        nb.BIG = [0.] * 1000 + [1.] * 1000
+        self.assertIn('   BIG=1000*0.,1000*1.,\n', nset.dumps(compress=True))
+        self.assertEqual(len(np.parse(nset.dumps(compress=True))['NAMREPEAT'].BIG), 2000)
+
+    @skipUnless(namelist.npchecker.is_available(), 'NumPy is not available.')
+    def test_namparser_np_array(self):
+        import numpy as np
+        source = """\
+&NAMARRAYS
+  R=1.5, 2.5,
+    3.5, 4.5, I=1,2,3, 4,
+  L=T,T,F,T, SHORT=1.,2., MIXED=1.,2.,3,4,
+  COMMENTED=1.,2., ! Comment
+    3., 4.
+/
+"""
+        nset_ref = namelist.NamelistParser().parse(source)
+        np_parser = namelist.NamelistParser(array_threshold=4)
+        nset = np_parser.parse(source)
+        nb = nset['NAMARRAYS']
+        self.assertIsInstance(nb.R, np.ndarray)
+        self.assertListEqual(nb.R.tolist(), [1.5, 2.5, 3.5, 4.5])
+        self.assertEqual(nb.I.dtype, np.int64)
+        self.assertListEqual(nb.I.tolist(), [1, 2, 3, 4])
+        self.assertEqual(nb.L.dtype, bool)
+        for key in ('SHORT', 'MIXED', 'COMMENTED'):
+            self.assertEqual(nb[key], nset_ref['NAMARRAYS'][key])
+        self.assertFalse(nset.dumps_needs_update)
+        self.assertEqual(nset.dumps(), nset_ref.dumps())
+        # In place modifications are detected
+        nb.R[0] = 5.
+        self.assertTrue(nset.dumps_needs_update)
+        self.assertIn('   R=5.,2.5,3.5,4.5,\n', nset.dumps())
+        # Arrays can be stored directly in a namelist block
+        nb.COEFS = np.linspace(0., 1., 5, dtype=np.float32)
+        self.assertIsInstance(nb.COEFS, np.ndarray)
+        self.assertIn('   COEFS=0.,0.25,0.5,0.75,1.,\n', nset.dumps())
+        nb.ONE = np.array(1)
+        self.assertEqual(nb.ONE, 1)
+        # Compressed output
+        nb.ZEROS = np.zeros((10, 10), dtype=np.float32)
+        self.assertIn('   ZEROS=100*0.,\n', nset.dumps(compress=True))
+        # Pickling is fine
+        cache = namelist.NamelistParserCache()
+        namelist.NamelistParser(array_threshold=4, cache=cache).parse(source)
+        nset = namelist.NamelistParser(array_threshold=4, cache=cache).parse(source)
+        self.assertEqual(cache.hits, 1)
+        self.assertListEqual(nset['NAMARRAYS'].R.tolist(), [1.5, 2.5, 3.5, 4.5])
+
 
 if __name__ == '__main__':
     main(verbosity=2)
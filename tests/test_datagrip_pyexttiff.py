@@ -0,0 +1,152 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from bronx.syntax.externalcode import ExternalCodeImportChecker
+
+# Numpy is not mandatory
+npchecker = ExternalCodeImportChecker('numpy')
+with npchecker as npregister:
+    import numpy as np
+
+if npchecker.is_available():
+    from bronx.datagrip import pyexttiff
+
+
+def _tiff_bytes(images, endian='<', rows_per_strip=None, gap=0, description='bronx', photometric=None):
+    """Build a minimal uncompressed TIFF file (**gap** bytes are inserted before each strip)."""
+    data = bytearray((b'II' if endian == '<' else b'MM') + struct.pack(endian + 'HI', 42, 0))
+    ifd_offsets = []
+    for image in images:
+        length, width = image.shape[:2]
+        spp = image.shape[2] if image.ndim == 3 else 1
+        rps = rows_per_strip or length
+        raw = image.astype(image.dtype.newbyteorder(endian)).tobytes()
+        rowbytes = len(raw) // length
+        offsets, counts = [], []
+        for row in range(0, length, rps):
+            data += b'\xff' * gap
+            offsets.append(len(data))
+            counts.append(len(raw[row * rowbytes:(row + rps) * rowbytes]))
+            data += raw[row * rowbytes:(row + rps) * rowbytes]
+        interpretation = (2 if spp == 3 else 1) if photometric is None else photometric
+        tags = [(256, 4, [width]), (257, 4, [length]), (258, 3, [image.dtype.itemsize * 8] * spp),
+                (259, 3, [1]), (262, 3, [interpretation]), (270, 2, description.encode() + b'\x00'),
+                (273, 4, offsets), (277, 3, [spp]), (278, 4, [rps]), (279, 4, counts), (284, 3, [1]),
+                (339, 3, [dict(u=1, i=2, f=3)[image.dtype.kind]])]
+        entries = b''
+        for tag, entrytype, values in tags:
+            payload = values if entrytype == 2 else struct.pack(endian + dict([(3, 'H'), (4, 'I')])[entrytype] *
+                                                                len(values), *values)
+            if len(payload) <= 4:
+                field = payload.ljust(4, b'\x00')
+            else:
+                data += b'\x00' * (len(data) % 2)
+                field = struct.pack(endian + 'I', len(data))
+                data += payload
+            entries += struct.pack(endian + 'HHI', tag, entrytype, len(values)) + field
+        data += b'\x00' * (len(data) % 2)
+        ifd_offsets.append(len(data))
+        data += struct.pack(endian + 'H', len(tags)) + entries + struct.pack(endian + 'I', 0)
+    # Chain the IFDs
+    struct.pack_into(endian + 'I', data, 4, ifd_offsets[0])
+    for previous, following in zip(ifd_offsets[:-1], ifd_offsets[1:]):
+        n = struct.unpack_from(endian + 'H', data, previous)[0]
+        struct.pack_into(endian + 'I', data, previous + 2 + 12 * n, following)
+    return bytes(data)
+
+
+@unittest.skipUnless(npchecker.is_available(), 'NumPy is not available.')
+class TestTiffFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(suffix='test_pyexttiff')
+        self.images = [np.arange(60 * 40, dtype=np.uint16).reshape((60, 40)),
+                       np.linspace(-1, 1, 60 * 40, dtype=np.float32).reshape((60, 40)),
+                       np.arange(60 * 40 * 3, dtype=np.uint8).reshape((60, 40, 3)),
+                       np.arange(-1200, 1200, dtype=np.int16).reshape((60, 40))]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, fname, *kargs, **kwargs):
+        fname = os.path.join(self.tmpdir, fname)
+        with open(fname, 'wb') as fhout:
+            fhout.write(_tiff_bytes(*kargs, **kwargs))
+        return fname
+
+    def test_tiff_lazy(self):
+        for endian in ('<', '>'):
+            for rows_per_strip, gap in ((None, 0), (7, 0), (7, 3)):
+                fname = self._write('lazy.tif', self.images, endian=endian,
+                                    rows_per_strip=rows_per_strip, gap=gap)
+                for method in (1, 2):
+                    tif = pyexttiff.TiffFile(fname, method=method, lazy=True)
+                    self.assertEqual(tif.endian, 'little' if endian == '<' else 'big')
+                    self.assertEqual(len(tif.IFDs), len(self.images))
+                    for ifd, image in zip(tif.IFDs, self.images):
+                        self.assertTrue(ifd.has_image())
+                        self.assertEqual(ifd.get_tags(), [256, 257, 258, 259, 262, 270,
+                                                          273, 277, 278, 279, 284, 339])
+                        self.assertEqual(ifd.get_value(256), 40)
+                        self.assertEqual(ifd.get_value(257), 60)
+                        self.assertEqual(ifd.get_value(270), 'bronx')
+                        self.assertEqual(ifd.get_entry(270).get_tagName(), 'ImageDescription')
+                        self.assertEqual(len(ifd.get_value(273, human=False)), -(-60 // (rows_per_strip or 60)))
+                        decoded = ifd.get_image()
+                        self.assertEqual(decoded.dtype.kind, image.dtype.kind)
+                        np.testing.assert_array_equal(decoded, image)
+                        # Contiguous strips are not copied
+                        self.assertEqual(np.shares_memory(decoded, tif.get_data()), not gap)
+                        self.assertIs(ifd.get_image(), decoded)
+                    del tif
+
+    def test_tiff_buffers(self):
+        fname = self._write('buffers.tif', self.images[:1])
+        with open(fname, 'rb') as fhin:
+            content = fhin.read()
+        tif = pyexttiff.TiffFile(fname, method=2, lazy=True)
+        self.assertEqual(bytes(tif.get_buffer()), content)
+        self.assertEqual(tif.get_stringio().read(), content)
+        del tif
+
+    @unittest.skipUnless(npchecker.is_available() and pyexttiff.pilchecker.is_available(),
+                         'PIL is not available.')
+    def test_tiff_eager(self):
+        images = [self.images[0], self.images[2]]
+        fname = self._write('eager.tif', images, rows_per_strip=7, gap=3)
+        for method in (1, 2):
+            eager = pyexttiff.TiffFile(fname, method=method)
+            lazy = pyexttiff.TiffFile(fname, method=method, lazy=True)
+            for e_ifd, l_ifd, image in zip(eager.IFDs, lazy.IFDs, images):
+                np.testing.assert_array_equal(e_ifd.get_image(), image)
+                np.testing.assert_array_equal(l_ifd.get_image(), image)
+                self.assertEqual(e_ifd.get_tags(), l_ifd.get_tags())
+                for tag in e_ifd.get_tags():
+                    e_value, l_value = e_ifd.get_value(tag), l_ifd.get_value(tag)
+                    if tag == 273:
+                        self.assertEqual(len(e_value), len(l_value))
+                        for e_strip, l_strip in zip(e_value, l_value):
+                            np.testing.assert_array_equal(e_strip, l_strip)
+                    else:
+                        np.testing.assert_array_equal(e_value, l_value)
+            del eager, lazy
+
+    @unittest.skipUnless(npchecker.is_available() and pyexttiff.pilchecker.is_available(),
+                         'PIL is not available.')
+    def test_tiff_photometric(self):
+        # WhiteIsZero images are inverted by PIL: they can't be returned as is
+        image = np.arange(60 * 40, dtype=np.uint8).reshape((60, 40))
+        fname = self._write('whiteiszero.tif', [image, ], rows_per_strip=7, photometric=0)
+        eager = pyexttiff.TiffFile(fname)
+        lazy = pyexttiff.TiffFile(fname, lazy=True)
+        self.assertEqual(lazy.IFDs[0].get_value(262), 0)
+        np.testing.assert_array_equal(lazy.IFDs[0].get_image(), eager.IFDs[0].get_image())
+        np.testing.assert_array_equal(lazy.IFDs[0].get_image(), 255 - image)
+        del eager, lazy
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
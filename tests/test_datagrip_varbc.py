@@ -1,6 +1,8 @@
 """Tests both :mod:`bronx.datagrip.varbc` and :mod:`bronx.datagrip.varbcheaders`."""
 
 import copy
+import io
+import mmap
 import os
 import unittest
 
@@ -72,10 +74,125 @@ class TestVarbcFile(unittest.TestCase):
             with self.assertRaises(ValueError):
                 varbc.VarbcFile(fhvbc)
 
+    def _assert_ok_columns(self, vbc):
+        cols = vbc.columns
+        self.assertListEqual(cols.ix.tolist(), [1, 2, 3])
+        self.assertListEqual(cols.type.tolist(), ['rad', 'rad', 'sfcobs'])
+        self.assertListEqual(cols.key.tolist(), ['4 3 4', '4 3 5', 'SARLROBH 16012128    NULL   227'])
+        self.assertListEqual(cols.ndata.tolist(), [0, 5789, 0])
+        self.assertListEqual(cols.npred.tolist(), [8, 10, 3])
+        self.assertListEqual(cols.offsets.tolist(), [0, 8, 18, 21])
+        self.assertEqual(cols.predcs.dtype, np.uint8)
+        self.assertEqual(cols.params.dtype, np.float32)
+        self.assertListEqual(cols.predcs[8:18].tolist(), [0, 1, 2, 8, 9, 10, 15, 16, 17, 18])
+        self.assertTrue(np.all(cols.params[8:18] == vbc['4 3 5'].params))
+        # Entries are created on demand (and cached)
+        self.assertIs(vbc.getix(2), vbc['4 3 5'])
+        self.assertIsNot(vbc.getix(2).params, cols.params[8:18])
+        with self.assertRaises(KeyError):
+            vbc.getix(0)
+        with self.assertRaises(IndexError):
+            vbc.getix(4)
+        self._assert_ok_headers(vbc.metadata)
+
+    def test_varbc_columns(self):
+        fname = _find_testfile('varbc.arpege-traj.txt.li')
+        with open(fname) as fhvbc:
+            self._assert_ok_columns(varbc.VarbcFile(fhvbc))
+        with open(fname) as fhvbc:
+            lines = fhvbc.readlines()
+        self._assert_ok_columns(varbc.VarbcFile(lines))
+        self._assert_ok_columns(varbc.VarbcFile(fname))
+        with open(fname, 'rb') as fhvbc:
+            rawdata = fhvbc.read()
+            with mmap.mmap(fhvbc.fileno(), 0, access=mmap.ACCESS_READ) as mmvbc:
+                self._assert_ok_columns(varbc.VarbcFile(mmvbc))
+        self._assert_ok_columns(varbc.VarbcFile(rawdata))
+        self._assert_ok_columns(varbc.VarbcFile(rawdata.replace(b'\n', b'\r\n')))
+        # Unusual files are processed line by line (with the same result)
+        self._assert_ok_columns(varbc.VarbcFile(lines[:6] + ['ix=9 (not an entry)\n', ] + lines[6:]))
+        self._assert_ok_columns(varbc.VarbcFile(io.StringIO(''.join(lines).replace('key=', 'key=\u2003'))))
+        self._assert_ok_columns(varbc.VarbcFile(lines[:-1] + [lines[-1].rstrip('\n') + '\n2.5\n', ]))
+        for ko in ('varbc.arpege-traj.txt.li.ko1', 'varbc.arpege-traj.txt.li.ko2'):
+            with self.assertRaises(ValueError):
+                varbc.VarbcFile(_find_testfile(ko))
+        with self.assertRaises(ValueError):
+            varbc.VarbcFile(lines[:12] + lines[13:])
+        empty = varbc.VarbcFile(lines[:3])
+        self.assertEqual(len(empty), 0)
+        self.assertListEqual(empty.columns.offsets.tolist(), [0])
+
+    def test_varbc_dump(self):
+        fname = _find_testfile('varbc.arpege-traj.txt.li')
+        with open(fname) as fhvbc:
+            text = fhvbc.read()
+        for source in (fname, text.encode(), text.replace('\n', '\r\n').encode(),
+                       text.splitlines(keepends=True), io.StringIO(text)):
+            self.assertEqual(varbc.VarbcFile(source).dumps(), text)
+        vbc = varbc.VarbcFile(text.rstrip('\n').encode())
+        self.assertEqual(vbc.dumps(), text.rstrip('\n'))
+        fhout = io.StringIO()
+        vbc.dump(fhout)
+        self.assertEqual(fhout.getvalue(), vbc.dumps())
+
+    def test_varbc_diff_merge(self):
+        fname = _find_testfile('varbc.arpege-traj.txt.li')
+        with open(fname) as fhvbc:
+            text = fhvbc.read()
+        ref = varbc.VarbcFile(fname)
+        other = varbc.VarbcFile(text
+                                .replace('ix=1\n', 'ix=0001\n')
+                                .replace('key=4 3 5', 'key=4 3 6')
+                                .replace('predcs=0 8 9 10', 'predcs=0 8 9 11')
+                                .replace('params= 0.000E+00  0.000E+00  0.000E+00\n',
+                                         'params= 1.000E-03  0.000E+00  0.000E+00\n')
+                                .encode())
+        delta = ref.diff(other)
+        self.assertListEqual(delta.key.tolist(), ['4 3 4', '4 3 5', 'SARLROBH 16012128    NULL   227', '4 3 6'])
+        self.assertListEqual(delta.ix.tolist(), [1, 2, 3, 0])
+        self.assertListEqual(delta.other_ix.tolist(), [1, 0, 3, 2])
+        self.assertListEqual(delta.created.tolist(), [False, False, False, True])
+        self.assertListEqual(delta.deleted.tolist(), [False, True, False, False])
+        self.assertListEqual(delta.predictors.tolist(), [True, False, False, False])
+        self.assertListEqual(delta.params.tolist(), [False, False, True, False])
+        self.assertListEqual(delta.updated.tolist(), [True, False, True, False])
+        self.assertTrue(np.all(np.isnan(delta.maxdiff[[0, 1, 3]])))
+        self.assertAlmostEqual(delta.maxdiff[2], 1e-3)
+        self.assertEqual(len(delta), 4)
+        stats = delta.stats()
+        self.assertListEqual(list(stats), ['rad', 'sfcobs'])
+        self.assertEqual(stats['rad'][:4], (3, 1, 1, 1))
+        self.assertTrue(np.isnan(stats['rad'].maxdiff))
+        self.assertEqual(stats['sfcobs'][:4], (1, 0, 0, 1))
+        self.assertAlmostEqual(stats['sfcobs'].maxdiff, 1e-3)
+        self.assertAlmostEqual(stats['sfcobs'].meandiff, 1e-3)
+        delta = ref.diff(other, atol=2e-3)
+        self.assertListEqual(delta.params.tolist(), [False, False, False, False])
+        self.assertEqual(len(ref.diff(ref)), 0)
+        # Merge
+        merged = ref.merge(other)
+        self.assertEqual(merged.metadata['nentries'], 4)
+        self.assertListEqual(list(merged.keys()), ['4 3 4', '4 3 5', 'SARLROBH 16012128    NULL   227', '4 3 6'])
+        self.assertListEqual(merged.columns.ix.tolist(), [1, 2, 3, 4])
+        self.assertTrue(merged['4 3 4'] == other['4 3 4'])
+        self.assertTrue(merged['4 3 5'] == ref['4 3 5'])
+        self.assertTrue(merged['4 3 6'] == other['4 3 6'])
+        self.assertEqual(merged.getix(4).key, '4 3 6')
+        self.assertTrue(ref.merge(other, overwrite=False)['4 3 4'] == ref['4 3 4'])
+        # Write the merged file
+        mtext = merged.dumps()
+        self.assertTrue(mtext.startswith(text.replace('         3     45207', '         4     45207')
+                                         .split('ix=1\n')[0] + 'ix=0001\n'))
+        self.assertIn('\nix=4\npdate=20200123\nclass=rad\nkey=4 3 6\n', mtext)
+        self.assertEqual(len(varbc.VarbcFile(mtext.splitlines(keepends=True)).diff(merged)), 0)
+
     def test_varbc_headers(self):
         with open(_find_testfile('varbc.arpege-traj.txt.li')) as fhvbc:
             vbc = varbcheaders.VarbcHeadersFile(fhvbc)
         self._assert_ok_headers(vbc)
+        self.assertListEqual(vbc.lines(nentries=12345),
+                             ['VARBC_cycle.version006\n', 'TRAJ  20200123     60000\n',
+                              '     12345     45207\n'])
         with self.assertRaises(StopIteration):
             varbcheaders.VarbcHeadersFile(['VARBC_cycle.version006', ])
         with self.assertRaises(ValueError):
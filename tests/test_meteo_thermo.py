@@ -0,0 +1,370 @@
+"""Tests for :mod:`bronx.meteo.thermo`."""
+
+import concurrent.futures
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from bronx.syntax.externalcode import ExternalCodeImportChecker
+
+# Numpy is not mandatory
+npchecker = ExternalCodeImportChecker('numpy')
+with npchecker as npregister:
+    import numpy as np
+
+if npchecker.is_available():
+    from bronx.meteo import thermo
+
+
+HYDROMETEORS = ['v', 'c', 'r', 'i', 's', 'g']
+
+
+def _recursive_get(obj, parameter, methods=None):
+    """The recursive search that was used by Thermo.get (for reference)."""
+    if parameter not in obj._data:
+        listOfMethods = methods if methods is not None else obj._allKnownMethods
+        for iMethod, method in enumerate(listOfMethods):
+            if parameter not in obj._data and method[0] == parameter:
+                m = list(listOfMethods)
+                m.pop(iMethod)
+                try:
+                    args = [_recursive_get(obj, dep, m) for dep in method[1]]
+                    obj._data[parameter] = method[2](*args)
+                except thermo.ThermoError:
+                    pass
+    if parameter in obj._data:
+        return obj._data[parameter]
+    else:
+        raise thermo.ThermoError("Parameter '" + parameter + "' is not set and cannot be computed.")
+
+
+def _reference_new_T(obj, target, precision):
+    """The temperature computation that was used by Thermo._compute_new_T (for reference)."""
+    T = obj.get(thermo.N_T)
+    r = {s: obj.get('r' + s) for s in obj.hydrometeors}
+    csts = thermo.csts
+    for i, s in enumerate(target):
+        Cx, L0 = ((csts.Cl, csts.Lv0) if s in obj._known_liquid_hydrometeors
+                  else (csts.Ci, csts.Ls0))
+        if i == 0 or precision == 'full':
+            L_before = L0 + (csts.Cpv - Cx) * (T - csts.T0)
+            Cph_before = csts.Cpd + csts.Cpv * r['v']
+            Cph_after = csts.Cpd + csts.Cpv * (r['v'] + r[s] - target[s])
+            for k, v in r.items():
+                if k != 'v':
+                    Cx_k = csts.Cl if k in obj._known_liquid_hydrometeors else csts.Ci
+                    Cph_before += v * Cx_k
+                    Cph_after += (target[s] if k == s else v) * Cx_k
+        else:
+            L_before = L0 + (csts.Cpv - Cx) * (obj.get(thermo.N_T) - csts.T0)
+        if precision == 'standard':
+            T = T + L_before * (target[s] - r[s]) / Cph_before
+        else:
+            T = Cph_before / Cph_after * (L0 / (csts.Cpv - Cx) - csts.T0 + T) + csts.T0 - L0 / (csts.Cpv - Cx)
+        r['v'] = r['v'] + r[s] - target[s]
+        r[s] = target[s]
+    return T
+
+
+@unittest.skipUnless(npchecker.is_available(), 'NumPy is not available.')
+class TestThermoPlans(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.data = {thermo.N_T: 250. + 40. * rng.random(10),
+                     thermo.N_P: 50000. + 50000. * rng.random(10)}
+        for h in HYDROMETEORS:
+            self.data['r' + h] = 1e-3 * rng.random(10)
+
+    def assertSameState(self, data1, data2):
+        self.assertSetEqual(set(data1), set(data2))
+        for k in data1:
+            self.assertTrue(np.array_equal(data1[k], data2[k], equal_nan=True))
+
+    def test_plans_vs_recursive(self):
+        params = sorted({m[0] for m in thermo.Thermo(hydrometeors=HYDROMETEORS)._allKnownMethods})
+        for available in ([thermo.N_T, thermo.N_P] + ['r' + h for h in HYDROMETEORS],
+                          [thermo.N_T, thermo.N_P],
+                          [thermo.N_Theta, thermo.N_P, thermo.N_e],
+                          [thermo.N_u, thermo.N_v, thermo.N_T]):
+            data = {k: self.data.get(k, self.data[thermo.N_T] / 1000.) for k in available}
+            for target in params:
+                new = thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(data))
+                ref = thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(data))
+                with np.errstate(all='ignore'):
+                    try:
+                        _recursive_get(ref, target)
+                    except thermo.ThermoError:
+                        with self.assertRaises(thermo.ThermoError):
+                            new.get(target)
+                    else:
+                        new.get(target)
+                # Same results and same intermediate values
+                self.assertSameState(new._data, ref._data)
+
+    def test_plans_methods(self):
+        data = thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(self.data))
+        self.assertListEqual(data.plan(thermo.N_Theta), [(thermo.N_Theta, 'T_P2Theta')])
+        self.assertListEqual(data.plan(thermo.N_T), [])
+        self.assertEqual(data.plan(thermo.N_Huw)[-1], (thermo.N_Huw, 'e_esatw2Huw'))
+        with self.assertRaises(thermo.ThermoError):
+            data.plan(thermo.N_ff)
+        # Explicit list of methods
+        methods = [m for m in data._allKnownMethods if m[0] != thermo.N_Theta]
+        with self.assertRaises(thermo.ThermoError):
+            data.get(thermo.N_Theta, methods)
+        self.assertTrue(np.array_equal(data.get(thermo.N_Theta),
+                                       thermo.Thermo.T_P2Theta(self.data[thermo.N_T],
+                                                               self.data[thermo.N_P])))
+
+    def test_plans_cache(self):
+        try:
+            thermo.Thermo.set_plans_cache(16)
+            self.assertEqual(thermo.Thermo.plans_cache_info().currsize, 0)
+            for _ in range(3):
+                data = thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(self.data))
+                data.get(thermo.N_rho)
+            self.assertEqual(thermo.Thermo.plans_cache_info().hits, 2)
+            thermo.Thermo.set_plans_cache(0)
+            self.assertIsNone(thermo.Thermo.plans_cache_info())
+            data = thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(self.data))
+            data.get(thermo.N_rho)
+        finally:
+            thermo.Thermo.set_plans_cache()
+
+
+@unittest.skipUnless(npchecker.is_available(), 'NumPy is not available.')
+class TestThermoChunked(unittest.TestCase):
+
+    TARGETS = ('Theta', 'rho', 'Huw', 'Hui', 'ThetaV', 'TV', 'Cph', 'qc', 'rsatw')
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        shape = (7, 13, 5)
+        self.data = {thermo.N_T: 250. + 40. * rng.random(shape),
+                     thermo.N_P: 50000. + 50000. * rng.random(shape)}
+        for h in HYDROMETEORS:
+            self.data['r' + h] = 1e-3 * rng.random(shape)
+
+    def _new(self, data=None):
+        return thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(data or self.data))
+
+    def assertChunked(self, **kwargs):
+        for target in self.TARGETS:
+            ref = self._new().get(target)
+            obj = self._new()
+            result = obj.get_chunked(target, **kwargs)
+            self.assertTrue(np.array_equal(ref, result), target)
+            self.assertIs(obj.get(target), result)
+            self.assertNotIn(thermo.N_e, obj.list())
+
+    def test_chunked_sequential(self):
+        for chunksize in (1, 20, 65, 100, 10000):
+            self.assertChunked(chunksize=chunksize)
+        with self.assertRaises(thermo.ThermoError):
+            self._new().get_chunked(thermo.N_ff)
+        # Scalars
+        obj = thermo.Thermo(data={thermo.N_T: 280., thermo.N_P: 75000.})
+        self.assertEqual(obj.get_chunked(thermo.N_Theta), thermo.Thermo.T_P2Theta(280., 75000.))
+        obj = thermo.Thermo(data={thermo.N_T: np.array(280.), thermo.N_P: np.array(75000.)})
+        self.assertEqual(obj.get_chunked(thermo.N_Theta, chunksize=1), thermo.Thermo.T_P2Theta(280., 75000.))
+
+    def test_chunked_executors(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            self.assertChunked(chunksize=50, executor=executor)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            ref = self._new().get(thermo.N_rho)
+            self.assertTrue(np.array_equal(ref, self._new().get_chunked(thermo.N_rho, chunksize=100,
+                                                                        executor=executor)))
+
+    def test_chunked_memmap(self):
+        tmpdir = tempfile.mkdtemp(suffix='test_chunked_memmap')
+        try:
+            data = dict()
+            for k, v in self.data.items():
+                data[k] = np.memmap(os.path.join(tmpdir, k), dtype=v.dtype, mode='w+', shape=v.shape)
+                data[k][...] = v
+            out = np.memmap(os.path.join(tmpdir, 'out'), dtype=np.float64, mode='w+',
+                            shape=self.data[thermo.N_T].shape)
+            result = self._new(data).get_chunked(thermo.N_Huw, chunksize=30, out=out)
+            self.assertIs(result, out)
+            self.assertTrue(np.array_equal(self._new().get(thermo.N_Huw), out))
+            del data, out, result
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@unittest.skipUnless(npchecker.is_available(), 'NumPy is not available.')
+class TestThermoAdjust(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        shape = (6, 11, 9)
+        T = 240. + 30. * rng.random(shape)
+        P = 70000. + 30000. * rng.random(shape)
+        self.data = {thermo.N_T: T, thermo.N_P: P,
+                     thermo.N_rv: thermo.Thermo.e_P2rv(thermo.Thermo.T2esatw(T), P) * rng.uniform(.5, 1.05, shape)}
+        for h in HYDROMETEORS[1:]:
+            self.data['r' + h] = np.where(rng.random(shape) < .5, 5e-4 * rng.random(shape), 0.)
+
+    def _new(self, data=None):
+        return thermo.Thermo(hydrometeors=list(HYDROMETEORS), data=dict(data or self.data))
+
+    def assertWaterConserved(self, obj):
+        self.assertTrue(np.allclose(obj.get(thermo.N_rt), self._new().get(thermo.N_rt), rtol=0., atol=1e-15))
+
+    def test_evaporate(self):
+        for precision in ('full', 'standard'):
+            for species in (['c'], ['r', 'i', 's'], HYDROMETEORS[1:]):
+                ref = self._new()
+                target = {s: ref.get('r' + s) * (0. if s in species else 1.) for s in HYDROMETEORS[1:]}
+                result = self._new().evaporate(species, extra_variables=[thermo.N_P], precision=precision)
+                self.assertTrue(np.allclose(result.get(thermo.N_T), _reference_new_T(ref, target, precision),
+                                            rtol=1e-13, atol=0.))
+                self.assertTrue(np.all(result.get(thermo.N_T) <= self.data[thermo.N_T] + 1e-10))
+                for s in species:
+                    self.assertFalse(np.any(result.get('r' + s)))
+                self.assertWaterConserved(result)
+                self.assertIs(result.get(thermo.N_P), self.data[thermo.N_P])
+        with self.assertRaises(ValueError):
+            self._new().evaporate(['c'], precision='fast')
+
+    def test_adjust(self):
+        for species, mix_rule in ((['c'], None), (['i'], None), (['c', 'i'], 'same'), (['c', 'i'], '0T-20')):
+            for precision in ('full', 'standard'):
+                result = self._new().adjust(species, mix_rule, iteration=3, precision=precision)
+                self.assertSetEqual(set(result.list()),
+                                    {thermo.N_T} | {'r' + h for h in HYDROMETEORS})
+                self.assertEqual(result.get(thermo.N_T).shape, self.data[thermo.N_T].shape)
+                self.assertWaterConserved(result)
+                for h in HYDROMETEORS[1:]:
+                    if h not in species:
+                        self.assertTrue(np.array_equal(result.get('r' + h), self.data['r' + h]))
+                # Iterations are chained
+                step = self._new()
+                for _ in range(3):
+                    step = step.adjust(species, mix_rule, precision=precision, extra_variables=[thermo.N_P])
+                for var in result.list():
+                    self.assertTrue(np.allclose(result.get(var), step.get(var), rtol=1e-12, atol=1e-15))
+        with self.assertRaises(ValueError):
+            self._new().adjust(['r'])
+        with self.assertRaises(ValueError):
+            self._new().adjust(['c'], precision='fast')
+        # Scalars
+        obj = thermo.Thermo(hydrometeors=['v', 'c'],
+                            data={thermo.N_T: 280., thermo.N_P: 90000., thermo.N_rv: 0.0075, thermo.N_rc: 0.})
+        result = obj.adjust(['c'], iteration=100, extra_variables=[thermo.N_P], tolerance=1e-10)
+        self.assertEqual(np.ndim(result.get(thermo.N_T)), 0)
+        self.assertGreater(result.get(thermo.N_T), 280.)
+        self.assertAlmostEqual(result.get(thermo.N_rv), result.get(thermo.N_rsatw), places=6)
+
+    def test_adjust_tolerance(self):
+        fixed = self._new().adjust(['c'], iteration=40, extra_variables=[thermo.N_P])
+        converged = self._new().adjust(['c'], iteration=40, tolerance=1e-9, extra_variables=[thermo.N_P])
+        for var in fixed.list():
+            self.assertTrue(np.allclose(fixed.get(var), converged.get(var), rtol=0., atol=1e-5))
+        self.assertWaterConserved(converged)
+        # Saturation is reached wherever some cloud water remains
+        cloudy = converged.get(thermo.N_rc) > 1e-8
+        self.assertTrue(cloudy.any())
+        self.assertTrue(np.allclose(converged.get(thermo.N_rv)[cloudy], converged.get(thermo.N_rsatw)[cloudy],
+                                    rtol=1e-6, atol=0.))
+        # A large tolerance stops after the first iteration
+        self.assertTrue(np.array_equal(self._new().adjust(['c'], iteration=40, tolerance=1.).get(thermo.N_T),
+                                       self._new().adjust(['c']).get(thermo.N_T)))
+
+
+@unittest.skipUnless(npchecker.is_available(), 'NumPy is not available.')
+class TestEsatTable(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        shape = (6, 11, 9)
+        self.data = {thermo.N_T: 220. + 80. * rng.random(shape),
+                     thermo.N_P: 40000. + 60000. * rng.random(shape),
+                     thermo.N_rv: 1e-2 * rng.random(shape)}
+
+    def test_e2Td(self):
+        T = np.linspace(150., 350., 10001)
+        self.assertTrue(np.allclose(thermo.Thermo.e2Td(thermo.Thermo.Td2e(T)), T, rtol=1e-14, atol=0.))
+        obj = thermo.Thermo(hydrometeors=['v'], data=dict(self.data))
+        self.assertTrue(np.allclose(thermo.Thermo.Td2e(obj.get(thermo.N_Td)), obj.get(thermo.N_e),
+                                    rtol=1e-13, atol=0.))
+        subsaturated = obj.get(thermo.N_Huw) <= 100.
+        self.assertTrue(np.all(obj.get(thermo.N_Td)[subsaturated] <= self.data[thermo.N_T][subsaturated]))
+
+    def test_esat_table_bounds(self):
+        T = np.linspace(145., 355., 1000001)
+        for order, rtol in ((1, 1e-6), (3, 1e-6), (3, 1e-10)):
+            table = thermo.EsatTable(order=order, rtol=rtol)
+            self.assertEqual(table.order, order)
+            self.assertSetEqual(set(table.error_bounds), {'esatw', 'esati', 'Td'})
+            for name, bound in table.error_bounds.items():
+                self.assertLessEqual(bound, rtol)
+            for name, method in (('esatw', 'T2esatw'), ('esati', 'T2esati')):
+                error = np.abs(getattr(table, method)(T) / getattr(thermo.Thermo, method)(T) - 1.)
+                self.assertLessEqual(error.max(), table.error_bounds[name])
+            self.assertTrue(np.array_equal(table.Td2e(T), table.T2esatw(T)))
+            e = thermo.Thermo.T2esatw(T)
+            error = np.abs(table.e2Td(e) / T - 1.)
+            self.assertLessEqual(error.max(), table.error_bounds['Td'] + 1e-14)
+            # Ice vs liquid water switch
+            T0 = np.array([273.15, 273.15 + 1e-9])
+            self.assertTrue(np.allclose(table.T2esati(T0), thermo.Thermo.T2esati(T0), rtol=1e-13, atol=0.))
+        # Outside of the table, with NaNs, scalars, other dtypes and shapes
+        table = thermo.EsatTable.shared(1)
+        T = np.array([[100., np.nan, 250.], [400., 290., 273.15]])
+        self.assertTrue(np.array_equal(table.T2esati(T)[:, 0], thermo.Thermo.T2esati(T)[:, 0]))
+        self.assertTrue(np.isnan(table.T2esati(T)[0, 1]))
+        self.assertTrue(np.allclose(table.T2esati(T), thermo.Thermo.T2esati(T), rtol=1e-6, atol=0., equal_nan=True))
+        self.assertEqual(table.T2esatw(280.), thermo.Thermo.T2esatw(280.))
+        self.assertEqual(table.T2esatw(np.array([], dtype=np.float32)).size, 0)
+        T32 = np.array([260., 280.], dtype=np.float32)
+        self.assertTrue(np.allclose(table.T2esatw(T32), thermo.Thermo.T2esatw(T32.astype(np.float64)),
+                                    rtol=1e-6, atol=0.))
+        with self.assertRaises(ValueError):
+            thermo.EsatTable(order=2)
+        with self.assertRaises(ValueError):
+            thermo.EsatTable(tmin=280.)
+        with self.assertRaises(ValueError):
+            thermo.EsatTable(order=3, rtol=1e-15)
+        with self.assertRaises(ValueError):
+            thermo.EsatTable(order=1, rtol=1e-12)
+
+    def test_esat_table_thermo(self):
+        self.assertIs(thermo.EsatTable.shared(3), thermo.EsatTable.shared(3))
+        self.assertIs(pickle.loads(pickle.dumps(thermo.EsatTable.shared(3))), thermo.EsatTable.shared(3))
+        table = thermo.EsatTable(order=3, rtol=1e-9)
+        self.assertEqual(pickle.loads(pickle.dumps(table)).error_bounds, table.error_bounds)
+        exact = thermo.Thermo(hydrometeors=['v'], data=dict(self.data))
+        for esat in ('linear', 'cubic', table):
+            obj = thermo.Thermo(hydrometeors=['v'], data=dict(self.data), esat=esat)
+            self.assertIsInstance(obj.esat, thermo.EsatTable)
+            for param in (thermo.N_esatw, thermo.N_esati, thermo.N_rsatw, thermo.N_rsati,
+                          thermo.N_Huw, thermo.N_Hui, thermo.N_Td):
+                self.assertTrue(np.allclose(obj.get(param), exact.get(param), rtol=2e-6, atol=0.), param)
+            # The exact formula is used for esatw
+            self.assertTrue(np.array_equal(obj.get(thermo.N_esatw), exact.get(thermo.N_esatw)))
+            self.assertTrue(np.allclose(obj.get_chunked(thermo.N_Huw, chunksize=100), exact.get(thermo.N_Huw),
+                                        rtol=2e-6, atol=0.))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+            obj = thermo.Thermo(hydrometeors=['v'], data=dict(self.data), esat='cubic')
+            self.assertTrue(np.array_equal(obj.get_chunked(thermo.N_Td, chunksize=100, executor=executor),
+                                           thermo.Thermo(hydrometeors=['v'], data=dict(self.data),
+                                                         esat='cubic').get(thermo.N_Td)))
+        # Adjustment/evaporation results use the same tables
+        data = dict(self.data, rc=np.zeros_like(self.data[thermo.N_T]))
+        obj = thermo.Thermo(hydrometeors=['v', 'c'], data=data, esat='linear')
+        self.assertIs(obj.adjust(['c'], iteration=2).esat, obj.esat)
+        self.assertIs(obj.evaporate(['c']).esat, obj.esat)
+        self.assertTrue(np.allclose(obj.adjust(['c'], iteration=2).get(thermo.N_T),
+                                    thermo.Thermo(hydrometeors=['v', 'c'], data=data).adjust(['c'], iteration=2)
+                                    .get(thermo.N_T), rtol=1e-8, atol=0.))
+        with self.assertRaises(ValueError):
+            thermo.Thermo(esat='quadratic')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,7 +1,8 @@
 from calendar import IllegalMonthError
 from datetime import datetime, timedelta
 import pickle
-from unittest import TestCase, main
+import types
+from unittest import TestCase, skipUnless, main
 
 from bronx.stdtypes import date
 
@@ -76,6 +77,46 @@ class utDate(TestCase):
 
         self.assertEqual(pickle.loads(pickle.dumps(rv)), rv)
 
+    def test_date_fixed_width(self):
+        # Compact and canonical ISO 8601 strings
+        for dstr, compact in (("20110726", "20110726000000"),
+                              ("2011072612", "20110726120000"),
+                              ("201107261213", "20110726121300"),
+                              ("20110726121314", "20110726121314"),
+                              ("2011-07-26", "20110726000000"),
+                              ("2011-07-26T12:13", "20110726121300"),
+                              ("2011-07-26T12:13Z", "20110726121300"),
+                              ("2011-07-26T12:13:14Z", "20110726121314")):
+            rv = date.Date(dstr)
+            self.assertEqual(rv.compact(), compact)
+            self.assertEqual(rv.epoch, date.Date(rv.year, rv.month, rv.day,
+                                                 rv.hour, rv.minute, rv.second).epoch)
+        for dstr in ("20111326", "2011072625", "2011-07-32", "2011-07-26T12:60"):
+            with self.assertRaises(ValueError):
+                date.Date(dstr)
+        rv = date.Date("2011072612/-P1D/PT3H")
+        self.assertEqual(rv.compact(), "20110725150000")
+
+    def test_date_strings_memo(self):
+        self.assertIsNone(date.Date.strings_memo_info())
+        date.Date.set_strings_memo(128)
+        try:
+            # A large number of dates, with a lot of duplicates
+            dstrs = ['2017{:02d}{:02d}{:02d}'.format(1 + i % 12, 1 + i % 28, i % 4 * 6)
+                     for i in range(10000)]
+            dates = [date.Date(dstr) for dstr in dstrs]
+            self.assertListEqual([d.ymdh for d in dates], dstrs)
+            self.assertEqual(date.Date.strings_memo_info().currsize, 84)
+            self.assertGreater(date.Date.strings_memo_info().hits, 0)
+            # Distinct objects are returned
+            self.assertIsNot(date.Date(dstrs[0]), date.Date(dstrs[0]))
+            # YYYY strings are never memoized
+            self.assertEqual(date.Date("YYYY0201", year=1995).compact(), "19950201000000")
+            self.assertEqual(date.Date("YYYY0201", year=1996).compact(), "19960201000000")
+        finally:
+            date.Date.set_strings_memo(0)
+        self.assertIsNone(date.Date.strings_memo_info())
+
     def test_date_format(self):
         rv = date.Date("2011-07-26T021314Z")
         self.assertEqual(rv.ymd, "20110726")
@@ -339,6 +380,54 @@ class utDate(TestCase):
             date.daterangex('2017110803', end='2017110806', step='PT3H', shift='-P2D'),
             [date.Date(2017, 11, 6, 3, 0), date.Date(2017, 11, 6, 6, 0)])
 
+    def test_date_irangex(self):
+        rv = date.idaterangex('2017110803-2017110806-PT1H,2017110805-2017110809-PT2H')
+        self.assertIsInstance(rv, types.GeneratorType)
+        self.assertEqual(next(rv), date.Date(2017, 11, 8, 3, 0))
+        self.assertListEqual(list(rv), [date.Date(2017, 11, 8, h, 0) for h in (4, 5, 6, 7, 9)])
+        for spec, kwargs in (('2017010100-2017013100-P14D,2017060100-2017063000-P14D,2017122500', dict()),
+                             ('2017013100-2017010100-PT7H,2017010100-2017010300-PT5H', dict(shift='-P2D')),
+                             ('2017110803-2017110806-PT1H,2017110805', dict(fmt='ymdh', prefix='foo_')),
+                             ('2017110803-2017110806-PT1H,2017110805', dict(fmt='%Y')),
+                             (['2016020100/2016030100/P1D', '2016022500/2016030500/PT12H'],
+                              dict(fmt='{0.year:d}{0.month:02d}'))):
+            self.assertListEqual(sorted(date.idaterangex(spec, **kwargs)), date.daterangex(spec, **kwargs))
+        # Long ranges are not expanded
+        rv = date.idaterangex('1950010100', '2049123123', 'PT1M')
+        self.assertEqual(next(rv), date.Date(1950, 1, 1, 0, 0))
+        self.assertEqual(next(rv), date.Date(1950, 1, 1, 0, 1))
+
+    def test_date_rangeexpression(self):
+        spec = '2017010100-2017013100-P14D,2017060100-2017063000-P14D,2017122500,2017011500'
+        rexpr = date.DateRangeExpression(spec)
+        self.assertEqual(len(rexpr), 7)
+        self.assertEqual(len(rexpr.plan), 3)
+        for kwargs in (dict(), dict(shift='PT6H'), dict(fmt='ymdh'), dict(fmt='ymdh', prefix='foo_', shift='-P1D'),
+                       dict(fmt='{1:d}'), dict(fmt='%Y')):
+            self.assertListEqual(rexpr.expand(**kwargs), date.daterangex(spec, **kwargs))
+        self.assertListEqual(list(rexpr), date.daterangex(spec))
+        self.assertListEqual(list(rexpr.iter(fmt='ymdh')), list(date.idaterangex(spec, fmt='ymdh')))
+        self.assertIn(date.Date(2017, 6, 15), rexpr)
+        self.assertIn('2017122500', rexpr)
+        self.assertNotIn(date.Date(2017, 6, 16), rexpr)
+        self.assertNotIn('2017062900', rexpr.shifted('PT1H'))
+        self.assertIn('2017062901', rexpr.shifted('PT1H'))
+        self.assertNotIn('not a date', rexpr)
+        # Immutable & Hashable
+        self.assertEqual(rexpr, date.DateRangeExpression(spec.split(',')))
+        self.assertEqual(rexpr.shifted('PT1H'), date.DateRangeExpression(spec).shifted('PT1H'))
+        self.assertNotEqual(rexpr, rexpr.shifted('PT1H'))
+        self.assertEqual(len({rexpr, date.DateRangeExpression(spec)}), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(rexpr)), rexpr)
+        # Overlapping sub-ranges and large ranges
+        spec = '2000010100-2000123100-PT6H,2000010100-2000123100-PT4H,2000010100-2000020100-PT2H'
+        self.assertEqual(len(date.DateRangeExpression(spec)), len(date.daterangex(spec)))
+        rexpr = date.DateRangeExpression('1950010100', '2049123123', 'PT1M')
+        self.assertEqual(len(rexpr), 52595941)
+        self.assertIn(date.Date(2000, 2, 29, 12, 34), rexpr)
+        with self.assertRaises(ValueError):
+            date.DateRangeExpression('2017010100-2017013100-PT0S')
+
     def test_date_getattr(self):
         rv = date.Date("2011072612")
         self.assertEqual(rv.addPT6H.compact(), "20110726180000")
@@ -374,6 +463,34 @@ class utDate(TestCase):
                                                             dict()).compact(),
                          "20110726200000")
 
+    def test_date_getattr_plans(self):
+        date.Date.set_getattr_plans_cache(16)
+        try:
+            rv = date.Date("2011072612")
+            for _ in range(10):
+                self.assertEqual(rv.addPT6H_ymdh, "2011072618")
+                self.assertEqual(rv.addterm_subPT1H_ymdh(dict(term='PT2H'), dict()), "2011072613")
+                self.assertEqual(date.Time(12, 0).addPT6H30M_fmthm, '0018:30')
+                with self.assertRaises(AttributeError):
+                    rv.a_strange_attribute_that_does_not_exists
+            info = date.Date.getattr_plans_info()
+            self.assertEqual(info.misses, 4)
+            self.assertEqual(info.hits, 36)
+            self.assertEqual(info.maxsize, 16)
+            # Plans depend on the class
+            self.assertEqual(date.Time(12, 0).addPT6H30M_fmthm, '0018:30')
+            self.assertEqual(date.Date.getattr_plans_info().hits, 37)
+            # Bounded
+            for i in range(32):
+                self.assertEqual(getattr(rv, 'addPT{:d}H_ymd'.format(i + 24)),
+                                 (rv + date.Period(hours=i + 24)).ymd)
+            self.assertEqual(date.Date.getattr_plans_info().currsize, 16)
+            date.Date.set_getattr_plans_cache(0)
+            self.assertIsNone(date.Date.getattr_plans_info())
+            self.assertEqual(rv.addPT6H_ymdh, "2011072618")
+        finally:
+            date.Date.set_getattr_plans_cache()
+
 
 class utSpecial(TestCase):
 
@@ -461,6 +578,28 @@ class utJeffrey(TestCase):
         result = obj * factor
         self.assertEqual(result.iso8601(), 'PT30S')
 
+    def test_period_compact(self):
+        # Common periods are interned
+        obj = date.Period('PT6H')
+        self.assertIs(obj, date.Period(21600))
+        self.assertIs(obj, date.Period(hours=6))
+        self.assertIs(obj, date.Period('PT3H') * 2)
+        self.assertIs(obj, pickle.loads(pickle.dumps(obj)))
+        self.assertIsNot(date.Period('PT6H1S'), date.Period('PT6H1S'))
+        self.assertEqual(date.Period('-P1DT6H').total_seconds(), -108000)
+        self.assertEqual(date.Period('P1Y1M1W1DT1H1M1S').total_seconds(),
+                         ((365 + 31 + 7 + 1) * 24 + 1) * 3600 + 61)
+        # No instance dictionaries
+        for obj in (date.Period('PT6H'), date.Date(2017, 1, 1), date.Time(6, 0)):
+            with self.assertRaises(AttributeError):
+                obj.foo = 1
+
+        class MyPeriod(date.Period):
+            pass
+
+        self.assertIsInstance(MyPeriod('PT6H'), MyPeriod)
+        self.assertEqual(MyPeriod('PT6H'), date.Period('PT6H'))
+
     def test_date_substractmore(self):
         obj1 = date.Date('2011-07-03T12:20:00Z')
         obj2 = date.Date('2011-07-03T12:20:59Z')
@@ -740,6 +879,43 @@ class utTime(TestCase):
         self.assertListEqual(rv, ['value no.1 is 09:15', 'value no.2 is 09:30', 'value no.3 is 09:45',
                                   'value no.4 is 10:00'])
 
+    def test_timetimerangex_lazy(self):
+        for args, kwargs in [((0, 12, 3), dict()),
+                             (('0-12-3,18-36-6,48', ), dict(shift=24)),
+                             (('0,4', 12, 3, 0), dict()),
+                             ((3, 0, '-0:30'), dict()),
+                             ((-3, 0, '0:30'), dict(fmt='{0.hour:03d}')),
+                             (('10:00', '8:10', '-:15'), dict(prefix='toto-')),
+                             ((3, 1, 1), dict())]:
+            rv = date.itimerangex(*args, **kwargs)
+            self.assertIsInstance(rv, types.GeneratorType)
+            self.assertListEqual(sorted(rv), date.timerangex(*args, **kwargs))
+        self.assertListEqual(list(date.itimerangex(None)), [])
+        rv = date.itimerangex('0-12-3,1-13-3')
+        self.assertTimeListEqual([next(rv) for _ in range(3)], [0, 1, 3])
+
+    def test_timetimerangeexpression(self):
+        for args in [(0, 12, 3), ('0-12-3,18-36-6,48', ), ('0,4', 12, 3), (3, 0, '-0:30'), (-3, 0, '0:30'),
+                     ('10:00', '8:10', '-:15'), (3, 1, 1)]:
+            rexpr = date.TimeRangeExpression(*args)
+            self.assertEqual(len(rexpr), len(date.timerangex(*args)))
+            for kwargs in (dict(), dict(shift=24), dict(fmt='{0.hour:03d}'), dict(prefix='toto-', shift='0:01')):
+                self.assertListEqual(rexpr.expand(**kwargs), date.timerangex(*args, **kwargs))
+        rexpr = date.TimeRangeExpression('0-12-3,1-13-3')
+        self.assertIn(12, rexpr)
+        self.assertIn('13:00', rexpr)
+        self.assertNotIn(date.Time(12, 30), rexpr)
+        self.assertEqual(rexpr, date.TimeRangeExpression('1-13-3,0-12-3'))
+        self.assertEqual(len(date.TimeRangeExpression(None)), 0)
+        # Many overlapping sub-ranges (with non-empty intersections)
+        spec = ','.join(['0-2000-{:d}'.format(p) for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43)] +
+                        ['3000-3010-1', '3005-3020-2', '3021-3031-2', '3077-3093-27', '3077-3080-19'])
+        rexpr = date.TimeRangeExpression(spec)
+        self.assertEqual(len(rexpr), len(date.timerangex(spec)))
+        expanded = set([int(t) for t in rexpr.expand()])
+        for i in range(3100):
+            self.assertEqual(i in rexpr, int(date.Time(i)) in expanded)
+
 
 # A pure internal usage
 
@@ -975,6 +1151,105 @@ class utTimeInt(TestCase):
         self.assertListEqual(rv, ['value no.1 is 0009:15', 'value no.2 is 0009:30', 'value no.3 is 0009:45',
                                   'value no.4 is 0010:00'])
 
+    def test_rangex_lazy(self):
+        for args, kwargs in [((0, 12, 3), dict()),
+                             (('0-12-3,18-36-6,48', ), dict(shift=24)),
+                             (('0-12-3', ), dict(fmt='%03d')),
+                             ((0, 3, '0:30'), dict()),
+                             (('foo_0:15', 2, ':15'), dict()),
+                             (('foo_0', -2, ':15'), dict()),
+                             (('0:30-2-1,3', ), dict()),
+                             (('10:00', '8:10', '-:15'), dict(prefix='toto-'))]:
+            rv = date.itimeintrangex(*args, **kwargs)
+            self.assertIsInstance(rv, types.GeneratorType)
+            self.assertListEqual(sorted(rv), date.timeintrangex(*args, **kwargs))
+        # Chronological order
+        self.assertListEqual(list(date.itimeintrangex('foo_0', -1, '-:15')),
+                             ['foo_-0001:00', 'foo_-0000:45', 'foo_-0000:30', 'foo_-0000:15', 'foo_0000:00'])
+
+
+@skipUnless(date.npchecker.is_available(), 'NumPy is not available.')
+class utDateArray(TestCase):
+
+    def test_datearray_basics(self):
+        import numpy as np
+        rv = date.DateArray(['2020-02-29T12:34:56', date.Date(2001, 2, 3, 4, 5, 6, 7), datetime(2011, 7, 26)])
+        self.assertEqual(len(rv), 3)
+        self.assertEqual(rv.values.dtype, np.dtype('M8[us]'))
+        self.assertListEqual(rv.to_dates(), [date.Date(2020, 2, 29, 12, 34, 56),
+                                             date.Date(2001, 2, 3, 4, 5, 6, 7),
+                                             date.Date(2011, 7, 26)])
+        self.assertIsInstance(rv[0], date.Date)
+        self.assertIsInstance(rv[1:], date.DateArray)
+        self.assertListEqual(list(rv.ymdhms), ['20200229123456', '20010203040506', '20110726000000'])
+        self.assertListEqual(list(rv.compact()), list(rv.ymdhms))
+        self.assertListEqual(list(rv.ymdh), ['2020022912', '2001020304', '2011072600'])
+        self.assertListEqual(list(rv.yymdh), ['20022912', '01020304', '11072600'])
+        self.assertListEqual(list(rv.ymdhm), ['202002291234', '200102030405', '201107260000'])
+        self.assertListEqual(list(rv.ymd), ['20200229', '20010203', '20110726'])
+        self.assertListEqual(list(rv.yymd), ['200229', '010203', '110726'])
+        self.assertListEqual(list(rv.y), ['2020', '2001', '2011'])
+        self.assertListEqual(list(rv.mm), ['02', '02', '07'])
+        self.assertListEqual(list(rv.dd), ['29', '03', '26'])
+        self.assertListEqual(list(rv.hh), ['12', '04', '00'])
+        self.assertListEqual(list(rv.hm), ['1234', '0405', '0000'])
+        self.assertListEqual(list(rv.mmddhh), ['022912', '020304', '072600'])
+        # Comparisons
+        self.assertListEqual(list(rv > '2011072600'), [True, False, False])
+        self.assertListEqual(list(rv == date.Date(2011, 7, 26)), [False, False, True])
+        # Sort & Uniq
+        rv = date.DateArray(['2020010100', '2019010100', '2020010100'])
+        self.assertListEqual(rv.uniq().to_dates(), [date.Date(2019, 1, 1), date.Date(2020, 1, 1)])
+        rv.sort()
+        self.assertListEqual(list(rv.ymd), ['20190101', '20200101', '20200101'])
+
+    def test_datearray_arithmetic(self):
+        rv = date.DateArray.range('2017010100', '2017010300', 'P1D')
+        self.assertListEqual(list((rv + 'PT6H').ymdh), ['2017010106', '2017010206', '2017010306'])
+        self.assertListEqual(list((rv - date.Period('P1D')).ymdh), ['2016123100', '2017010100', '2017010200'])
+        self.assertListEqual(list(('PT6H' + rv).ymdh), ['2017010106', '2017010206', '2017010306'])
+        delta = rv - '2017010100'
+        self.assertIsInstance(delta, date.PeriodArray)
+        self.assertListEqual(delta.to_periods(), [date.Period(0), date.Period('P1D'), date.Period('P2D')])
+        self.assertListEqual(list(delta.length), [0, 86400, 172800])
+        self.assertListEqual((rv - date.Date(2017, 1, 1)).to_periods(), delta.to_periods())
+        self.assertListEqual(list((date.Date(2017, 1, 4) - rv).pseconds), [259200, 172800, 86400])
+        self.assertListEqual((date.Date(2017, 1, 1) + delta).to_dates(), rv.to_dates())
+        self.assertListEqual((rv + delta * 2).to_dates(),
+                             [date.Date(2017, 1, 1), date.Date(2017, 1, 4), date.Date(2017, 1, 7)])
+        self.assertListEqual(list((- delta).pseconds), [0, -86400, -172800])
+        self.assertListEqual(list((delta - 'PT1H').pseconds), [-3600, 82800, 169200])
+        self.assertListEqual(list(delta >= 'P1D'), [False, True, True])
+
+    def test_datearray_rangex(self):
+        for spec in ('2017010100-2017013100-P14D,2017060100-2017063000-P14D,2017122500',
+                     '2017013100-2017010100-PT7H,2017010100-2017010300-PT5H',
+                     '2016020100-2016030100-P1D,2016022500-2016030500-PT12H'):
+            for shift in (None, 'PT3H'):
+                self.assertListEqual(date.daterangex(spec, shift=shift, asarray=True).to_dates(),
+                                     date.daterangex(spec, shift=shift))
+        rv = date.daterangex('1990010100', '2019123123', 'PT1H', asarray=True)
+        self.assertEqual(len(rv), 262968)
+        self.assertEqual(rv[-1], date.Date(2019, 12, 31, 23))
+        self.assertEqual(rv.ymdh[24 * 365], '1991010100')
+        with self.assertRaises(ValueError):
+            date.daterangex('2017010100-2017013100-P14D', fmt='ymdh', asarray=True)
+
+    def test_datearray_timerangex(self):
+        for args, kwargs in [((0, 12, 3), dict()),
+                             (('0-12-3,18-36-6,48', ), dict()),
+                             ((3, 0, '-0:30'), dict()),
+                             ((-3, 0, '0:30'), dict()),
+                             ((0, 3, '0:30'), dict(shift=24)),
+                             (('10:00', '9:10', '-:15'), dict(shift='0:01'))]:
+            rv = date.timerangex(*args, asarray=True, **kwargs)
+            self.assertIsInstance(rv, date.PeriodArray)
+            self.assertListEqual(rv.to_periods(),
+                                 [date.Period(t) for t in date.timerangex(*args, **kwargs)])
+        self.assertEqual(len(date.timerangex(None, asarray=True)), 0)
+        with self.assertRaises(ValueError):
+            date.timerangex(0, 12, 3, prefix='toto', asarray=True)
+
 
 # noinspection PyUnusedLocal
 class utMonth(TestCase):